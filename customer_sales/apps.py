@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CustomerSalesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'customer_sales'
+
+    def ready(self):
+        from . import signals  # noqa: F401
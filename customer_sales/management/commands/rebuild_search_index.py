@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from customer_sales.signals import SEARCH_INDEXES
+
+
+class Command(BaseCommand):
+    help = "Rebuild the customer and sale search tokens from the current records."
+
+    def handle(self, *args, **options):
+        tables = set(connection.introspection.table_names())
+        for index in SEARCH_INDEXES:
+            if not {index.customer_model._meta.db_table, index.sale_model._meta.db_table} <= tables:
+                self.stderr.write(f"Skipping {index.customer_kind}: its tables don't exist")
+                continue
+            index.rebuild()
+            self.stdout.write(f"Indexed {index.customer_kind} and {index.sale_kind}")
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+def backfill_search_tokens(apps, schema_editor):
+    from customer_sales.search import SearchIndex
+
+    tables = set(schema_editor.connection.introspection.table_names())
+    SearchToken = apps.get_model('customer_sales', 'SearchToken')
+    for customer_name, sale_name in (('Customer', 'Sale'), ('TestCustomer', 'TestSale')):
+        index = SearchIndex(
+            apps.get_model('customer_sales', customer_name), apps.get_model('customer_sales', sale_name), SearchToken,
+        )
+        if {index.customer_model._meta.db_table, index.sale_model._meta.db_table} <= tables:
+            index.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_sales', '0006_testcustomer_alter_customer_table_alter_sale_table_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('token', models.CharField(max_length=64)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'token', 'object_id'], name='customer_sa_kind_feff10_idx'), models.Index(fields=['kind', 'object_id', 'token'], name='customer_sa_kind_a94bae_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_search_tokens, migrations.RunPython.noop),
+    ]
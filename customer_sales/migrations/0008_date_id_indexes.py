@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_sales', '0007_searchtoken'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['date', 'id'], name='customer_sa_date_8446c8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date', 'id'], name='customer_sa_date_8a06c6_idx'),
+        ),
+    ]
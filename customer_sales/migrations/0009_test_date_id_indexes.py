@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_sales', '0008_date_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='testcustomer',
+            index=models.Index(fields=['date', 'id'], name='customer_sa_date_f96dbe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testsale',
+            index=models.Index(fields=['date', 'id'], name='customer_sa_date_23921c_idx'),
+        ),
+    ]
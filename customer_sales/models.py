@@ -43,6 +43,8 @@ class Customer(models.Model):
 
     class Meta:
         db_table = 'customer_sales_customer'  # Default table for regular users
+        # Keyset pagination of the lists (see customer_sales.pagination)
+        indexes = [models.Index(fields=['date', 'id'])]
 
 
 class Sale(models.Model):
@@ -85,6 +87,28 @@ class Sale(models.Model):
 
     class Meta:
         db_table = 'customer_sales_sale'  # Default table for regular users
+        # Keyset pagination of the lists (see customer_sales.pagination)
+        indexes = [models.Index(fields=['date', 'id'])]
+
+
+class SearchToken(models.Model):
+    """
+    One normalized word of a customer or sale, for indexed prefix search
+    (see customer_sales.search). ``kind`` is the searched model's name.
+    """
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    token = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.token}"
+
+    class Meta:
+        indexes = [
+            # Prefix lookups, and each record's own tokens; both cover the columns searches read
+            models.Index(fields=['kind', 'token', 'object_id']),
+            models.Index(fields=['kind', 'object_id', 'token']),
+        ]
 
 
 ########################################################### FOR TESTING PURPOSES ONLY #############################################
@@ -130,6 +154,8 @@ class TestCustomer(models.Model):
 
     class Meta:
         db_table = 'customer_sales_customer_welight'  # Default table for regular users
+        # Keyset pagination of the lists (see customer_sales.pagination)
+        indexes = [models.Index(fields=['date', 'id'])]
 
 class TestSale(models.Model):
     PRODUCT_TYPE_CHOICES = [
@@ -170,4 +196,6 @@ class TestSale(models.Model):
         return f"{self.product_name} ({self.product_model})"
 
     class Meta:
-        db_table = 'customer_sales_sale_welight'  # Default table for regular users
\ No newline at end of file
+        db_table = 'customer_sales_sale_welight'  # Default table for regular users
+        # Keyset pagination of the lists (see customer_sales.pagination)
+        indexes = [models.Index(fields=['date', 'id'])]
\ No newline at end of file
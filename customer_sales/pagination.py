@@ -0,0 +1,96 @@
+"""
+Keyset pagination for the customer and sales lists.
+
+Rows are ordered by (date, id) and a page is addressed by a cursor holding
+the key of the row it starts after or ends before. Fetching any page is a
+range scan on the (date, id) index that reads one page of rows, so a deep
+page costs the same as the first. There are no page numbers and no
+COUNT(*); estimated_total() gives a cheap approximate size instead.
+"""
+import base64
+from datetime import datetime
+
+from django.db import connections
+from django.db.models import Max, Q
+
+PAGE_SIZE = 10
+# Searches are counted up to this many matches, and shown as "over" it beyond
+ESTIMATE_LIMIT = 1000
+# The ``before`` cursor of the last page
+LAST = 'last'
+
+
+def encode_cursor(obj):
+    key = f'{obj.date.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """The ``(date, id)`` key of a cursor, or None if it isn't one."""
+    try:
+        date, pk = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        return datetime.fromisoformat(date), int(pk)
+    except ValueError:
+        return None
+
+
+class KeysetPage:
+    """One page of rows, with the cursors of the pages either side of it."""
+
+    def __init__(self, rows, has_previous, has_next):
+        self.object_list = rows
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.previous_cursor = encode_cursor(rows[0]) if rows and has_previous else None
+        self.next_cursor = encode_cursor(rows[-1]) if rows and has_next else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate(queryset, after=None, before=None, per_page=PAGE_SIZE):
+    """
+    The page of ``queryset`` that follows the ``after`` cursor or precedes
+    the ``before`` cursor; the first page without either (or with an
+    invalid one), and the last page when ``before`` is LAST.
+    """
+    key = decode_cursor(before) if before and before != LAST else None
+    if before == LAST or key:
+        if key:
+            date, pk = key
+            # A range on date with only the rows sharing its value filtered, so the index bounds the scan
+            queryset = queryset.filter(date__lte=date).exclude(Q(date=date) & Q(pk__gte=pk))
+        rows = list(queryset.order_by('-date', '-pk')[:per_page + 1])
+        return KeysetPage(rows[:per_page][::-1], has_previous=len(rows) > per_page, has_next=key is not None)
+
+    key = decode_cursor(after) if after else None
+    if key:
+        date, pk = key
+        queryset = queryset.filter(date__gte=date).exclude(Q(date=date) & Q(pk__lte=pk))
+    rows = list(queryset.order_by('date', 'pk')[:per_page + 1])
+    return KeysetPage(rows[:per_page], has_previous=key is not None, has_next=len(rows) > per_page)
+
+
+def estimated_total(queryset):
+    """
+    Roughly how many rows ``queryset`` has, as ``(total, qualifier)`` where
+    the qualifier is '' for an exact count, 'about' or 'over'. A whole
+    table is estimated from the planner's statistics (PostgreSQL) or its
+    highest id; a filtered queryset is counted up to ESTIMATE_LIMIT.
+    """
+    if queryset.query.has_filters():
+        total = queryset.order_by()[:ESTIMATE_LIMIT + 1].count()
+        return (ESTIMATE_LIMIT, 'over') if total > ESTIMATE_LIMIT else (total, '')
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table has been analyzed
+        if row and row[0] >= 0:
+            return int(row[0]), 'about'
+    return queryset.aggregate(total=Max('pk'))['total'] or 0, 'about'
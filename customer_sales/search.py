@@ -0,0 +1,169 @@
+"""
+Indexed search over customers and sales.
+
+The searchable fields of every customer and sale are broken into normalized
+words and stored in SearchToken:
+
+- a customer's name, ID and phone numbers, plus the serial numbers and
+  sales reps of its sales;
+- a sale's product name, serial number and sales rep, plus its customer's
+  name, ID and phone number.
+
+A search matches each word of the query as a prefix of some token. That is
+a range scan on the (kind, token) index, so its cost follows the number of
+matches rather than the size of the table. The handlers in
+customer_sales.signals keep the tokens in sync as records are saved; the
+rebuild_search_index command rebuilds them from scratch.
+"""
+import re
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .models import SearchToken
+
+TOKEN_LENGTH = 64
+MAX_QUERY_WORDS = 8
+INDEX_BATCH_SIZE = 2000
+
+CUSTOMER_FIELDS = ('name', 'id_number', 'phone_number', 'alternate_phone_number')
+SALE_FIELDS = ('product_name', 'product_serial_number', 'sales_rep')
+SALE_CUSTOMER_FIELDS = ('customer__name', 'customer__id_number', 'customer__phone_number')
+
+
+def _words(text):
+    return re.findall(r'\w+', str(text).lower()) if text else []
+
+
+def _identifier_tokens(text):
+    # Also the words run together, so "JD-29ED0001" is found as "jd29ed0001" too
+    words = _words(text)
+    return words + [''.join(words)] if len(words) > 1 else words
+
+
+def _phone_forms(digits):
+    """A phone number's digits, and the local number without its 0 or 254 prefix."""
+    forms = {digits}
+    if digits.startswith('254'):
+        forms.add(digits[3:])
+    elif digits.startswith('0'):
+        forms.add(digits[1:])
+    return forms - {''}
+
+
+def _phone_tokens(text):
+    digits = re.sub(r'\D', '', str(text)) if text else ''
+    return _phone_forms(digits) if digits else set()
+
+
+def customer_tokens(name, id_number, phone_number, alternate_phone_number, sales=()):
+    """Tokens of a customer; ``sales`` holds ``(product_serial_number, sales_rep)`` for each of its sales."""
+    tokens = {*_words(name), *_identifier_tokens(id_number), *_phone_tokens(phone_number),
+              *_phone_tokens(alternate_phone_number)}
+    for product_serial_number, sales_rep in sales:
+        tokens.update(_identifier_tokens(product_serial_number))
+        tokens.update(_words(sales_rep))
+    return {token[:TOKEN_LENGTH] for token in tokens}
+
+
+def sale_tokens(product_name, product_serial_number, sales_rep, customer_name, customer_id_number,
+                customer_phone_number):
+    tokens = {*_words(product_name), *_identifier_tokens(product_serial_number), *_words(sales_rep),
+              *_words(customer_name), *_identifier_tokens(customer_id_number), *_phone_tokens(customer_phone_number)}
+    return {token[:TOKEN_LENGTH] for token in tokens}
+
+
+def _batches(values, size=INDEX_BATCH_SIZE):
+    batch = []
+    for value in values:
+        batch.append(value)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SearchIndex:
+    """
+    The tokens of one customer model and its sale model. Takes the models
+    as arguments so migrations can use it with their historical models.
+    """
+
+    def __init__(self, customer_model, sale_model, token_model=SearchToken):
+        self.customer_model = customer_model
+        self.sale_model = sale_model
+        self.token_model = token_model
+        self.customer_kind = customer_model._meta.model_name
+        self.sale_kind = sale_model._meta.model_name
+
+    def _replace(self, kind, pks, tokens_by_pk):
+        with transaction.atomic():
+            self.token_model.objects.filter(kind=kind, object_id__in=pks).delete()
+            self.token_model.objects.bulk_create(
+                self.token_model(kind=kind, object_id=pk, token=token)
+                for pk, tokens in tokens_by_pk.items() for token in tokens
+            )
+
+    def index_customers(self, pks):
+        """Re-tokenize customers; tokens of customers that no longer exist are dropped."""
+        pks = list(pks)
+        sales = {pk: [] for pk in pks}
+        for customer_id, *sale in (self.sale_model.objects.filter(customer_id__in=pks)
+                                   .values_list('customer_id', 'product_serial_number', 'sales_rep')):
+            sales[customer_id].append(sale)
+        tokens_by_pk = {
+            pk: customer_tokens(*values, sales=sales[pk])
+            for pk, *values in self.customer_model.objects.filter(pk__in=pks).values_list('pk', *CUSTOMER_FIELDS)
+        }
+        self._replace(self.customer_kind, pks, tokens_by_pk)
+
+    def index_sales(self, pks):
+        """Re-tokenize sales; tokens of sales that no longer exist are dropped."""
+        pks = list(pks)
+        tokens_by_pk = {
+            pk: sale_tokens(*values)
+            for pk, *values in self.sale_model.objects.filter(pk__in=pks)
+            .values_list('pk', *SALE_FIELDS, *SALE_CUSTOMER_FIELDS)
+        }
+        self._replace(self.sale_kind, pks, tokens_by_pk)
+
+    def customer_changed(self, pk):
+        self.index_customers([pk])
+        # Sales carry their customer's name, ID and phone number
+        self.index_sales(self.sale_model.objects.filter(customer_id=pk).values_list('pk', flat=True))
+
+    def sale_changed(self, pk, customer_ids):
+        self.index_sales([pk])
+        # Customers carry their sales' serial numbers and sales reps
+        self.index_customers({customer_id for customer_id in customer_ids if customer_id is not None})
+
+    def rebuild(self):
+        self.token_model.objects.filter(kind__in=[self.customer_kind, self.sale_kind]).delete()
+        for model, index in ((self.customer_model, self.index_customers), (self.sale_model, self.index_sales)):
+            for pks in _batches(model.objects.order_by('pk').values_list('pk', flat=True).iterator()):
+                index(pks)
+
+
+def _matching(kind, term):
+    # A range rather than LIKE 'term%', so every backend can use the (kind, token) index
+    return SearchToken.objects.filter(kind=kind, token__gte=term, token__lt=term + '\uffff')
+
+
+def search(queryset, query):
+    """Narrow a customer or sale queryset to records with a token starting with each word of the query."""
+    words = sorted(set(_words(query)[:MAX_QUERY_WORDS]), key=len, reverse=True)
+    if not words:
+        return queryset
+    kind = queryset.model._meta.model_name
+    # The longest word picks the candidates; the others are checked on each candidate's own tokens
+    condition = Q(pk__in=_matching(kind, words[0]).values('object_id'))
+    for word in words[1:]:
+        condition &= Exists(_matching(kind, word).filter(object_id=OuterRef('pk')))
+    # Numbers and serials typed with spaces or dashes ("0712 345 678", "JD-29ED0001")
+    compact = ''.join(_words(query))[:TOKEN_LENGTH]
+    terms = _phone_forms(compact) if compact.isdigit() else {compact}
+    terms.difference_update(words)
+    for term in terms:
+        condition |= Q(pk__in=_matching(kind, term).values('object_id'))
+    return queryset.filter(condition)
@@ -0,0 +1,36 @@
+"""Keep the search tokens of customers and sales in step with their records (see customer_sales.search)."""
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import Customer, Sale, TestCustomer, TestSale
+from .search import SearchIndex
+
+SEARCH_INDEXES = [
+    SearchIndex(Customer, Sale),
+    SearchIndex(TestCustomer, TestSale),
+]
+
+
+def connect(index):
+    def customer_changed(sender, instance, **kwargs):
+        index.customer_changed(instance.pk)
+
+    def sale_saving(sender, instance, **kwargs):
+        # A sale moved to another customer takes its serial number off the old one
+        instance._search_previous_customer_id = (
+            sender.objects.filter(pk=instance.pk).values_list('customer_id', flat=True).first()
+            if instance.pk else None
+        )
+
+    def sale_changed(sender, instance, **kwargs):
+        index.sale_changed(instance.pk, {instance.customer_id, getattr(instance, '_search_previous_customer_id', None)})
+
+    uid = f'search-{index.customer_kind}'
+    post_save.connect(customer_changed, sender=index.customer_model, weak=False, dispatch_uid=f'{uid}-customer-save')
+    post_delete.connect(customer_changed, sender=index.customer_model, weak=False, dispatch_uid=f'{uid}-customer-delete')
+    pre_save.connect(sale_saving, sender=index.sale_model, weak=False, dispatch_uid=f'{uid}-sale-presave')
+    post_save.connect(sale_changed, sender=index.sale_model, weak=False, dispatch_uid=f'{uid}-sale-save')
+    post_delete.connect(sale_changed, sender=index.sale_model, weak=False, dispatch_uid=f'{uid}-sale-delete')
+
+
+for search_index in SEARCH_INDEXES:
+    connect(search_index)
@@ -1,3 +1,275 @@
-from django.test import TestCase
+import base64
+from datetime import date, timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Customer, Sale, SearchToken
+from .pagination import LAST, estimated_total, paginate
+from .search import customer_tokens, sale_tokens, search
+
+
+def add_customer(name, id_number, phone_number='0712345678', **fields):
+    return Customer.objects.create(
+        name=name, id_number=id_number, phone_number=phone_number, country='Kenya', location='Town',
+        gender='F', household_type='F', household_size=3, preferred_language='EN', **fields,
+    )
+
+
+def add_sale(customer, product_serial_number, sales_rep='Mary Otieno', product_name='Pressure Cooker'):
+    return Sale.objects.create(
+        customer=customer, registration_date=date(2024, 1, 1), product_type='EPC', product_name=product_name,
+        product_model='EPC-6', product_serial_number=product_serial_number, purchase_mode='P', sales_rep=sales_rep,
+    )
+
+
+class TokenTests(SimpleTestCase):
+
+    def test_names_are_lowercased_words(self):
+        self.assertEqual(customer_tokens('Jane  WANJIRU-Kamau', '', '', None),
+                         {'jane', 'wanjiru', 'kamau'})
+
+    def test_phone_numbers_are_digits_with_and_without_their_prefix(self):
+        for phone_number in ('+254 712 345 678', '254712345678', '+254-712-345-678'):
+            with self.subTest(phone_number):
+                self.assertEqual(customer_tokens('', '', phone_number, None), {'254712345678', '712345678'})
+        self.assertEqual(customer_tokens('', '', '0712 345 678', None), {'0712345678', '712345678'})
+
+    def test_alternate_phone_numbers_are_tokenised(self):
+        self.assertEqual(customer_tokens('', '', '', '0722 000 111'), {'0722000111', '722000111'})
+
+    def test_serial_numbers_are_split_and_joined(self):
+        self.assertEqual(customer_tokens('', '', '', None, sales=[('JD-29ED0001', 'Mary')]),
+                         {'jd', '29ed0001', 'jd29ed0001', 'mary'})
+        self.assertEqual(sale_tokens('Cooker', 'JD 29ED0001', 'Mary', 'Jane', '12345678', '+254712345678'),
+                         {'cooker', 'jd', '29ed0001', 'jd29ed0001', 'mary', 'jane', '12345678',
+                          '254712345678', '712345678'})
+
+    def test_blank_fields_have_no_tokens(self):
+        self.assertEqual(customer_tokens('', '', '', None), set())
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.jane = add_customer('Jane Wanjiru', '11111111', phone_number='+254 712 345 678')
+        self.janet = add_customer('Janet Achieng', '22222222', phone_number='0722000111')
+        self.john = add_customer('John Wanjiru', '33333333', phone_number='0733000222')
+        self.sale = add_sale(self.jane, 'JD-29ED0001')
+        add_sale(self.john, 'JD-29ED0002', sales_rep='Peter Kimani')
+
+    def customers(self, query):
+        return set(search(Customer.objects.all(), query))
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(self.customers('jan'), {self.jane, self.janet})
+        self.assertEqual(self.customers('WANJ'), {self.jane, self.john})
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.customers('jane wanjiru'), {self.jane})
+        self.assertEqual(self.customers('wanjiru jan'), {self.jane})
+        self.assertEqual(self.customers('jan peter'), set())
+        self.assertEqual(self.customers('john peter'), {self.john})
+
+    def test_phone_numbers_match_in_any_form(self):
+        for query in ('0712345678', '0712 345 678', '+254 712 345 678', '712345678'):
+            with self.subTest(query):
+                self.assertEqual(self.customers(query), {self.jane})
+
+    def test_serial_numbers_match_with_or_without_separators(self):
+        for query in ('JD-29ED0001', 'jd29ed0001', '29ed0001'):
+            with self.subTest(query):
+                self.assertEqual(self.customers(query), {self.jane})
+                self.assertEqual(set(search(Sale.objects.all(), query)), {self.sale})
+        self.assertEqual(self.customers('jd-29ed'), {self.jane, self.john})
+
+    def test_sales_match_their_customer(self):
+        self.assertEqual(set(search(Sale.objects.all(), 'jane cooker')), {self.sale})
+
+    def test_a_blank_query_matches_everything(self):
+        self.assertEqual(self.customers(' - '), {self.jane, self.janet, self.john})
+
+
+class ReindexTests(TestCase):
+
+    def setUp(self):
+        self.jane = add_customer('Jane Wanjiru', '11111111')
+        self.john = add_customer('John Kamau', '33333333', phone_number='0733000222')
+        self.sale = add_sale(self.jane, 'JD-29ED0001')
+
+    def customers(self, query):
+        return set(search(Customer.objects.all(), query))
+
+    def sales(self, query):
+        return set(search(Sale.objects.all(), query))
+
+    def test_renaming_a_customer(self):
+        self.jane.name = 'Jane Njeri'
+        self.jane.save()
+
+        self.assertEqual(self.customers('njeri'), {self.jane})
+        self.assertEqual(self.customers('wanjiru'), set())
+        # The customer's sales carry the new name too
+        self.assertEqual(self.sales('njeri'), {self.sale})
+        self.assertEqual(self.sales('wanjiru'), set())
+
+    def test_moving_a_sale_to_another_customer(self):
+        self.sale.customer = self.john
+        self.sale.save()
+
+        self.assertEqual(self.customers('jd29ed0001'), {self.john})
+        self.assertEqual(self.sales('kamau'), {self.sale})
+        self.assertEqual(self.sales('jane'), set())
+
+    def test_deleting_a_sale(self):
+        self.sale.delete()
+
+        self.assertEqual(self.customers('jd29ed0001'), set())
+        self.assertFalse(SearchToken.objects.filter(kind='sale').exists())
+
+    def test_deleting_a_customer(self):
+        self.jane.delete()
+
+        self.assertEqual(self.customers('jane'), set())
+        self.assertFalse(SearchToken.objects.filter(kind='customer', object_id=self.jane.pk).exists())
+        # Its sales go with it
+        self.assertFalse(SearchToken.objects.filter(kind='sale').exists())
+
+
+class BackfillMigrationTests(TransactionTestCase):
+    before = [('customer_sales', '0006_testcustomer_alter_customer_table_alter_sale_table_and_more')]
+    after = [('customer_sales', '0007_searchtoken')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes('customer_sales')
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(latest))
+        executor.migrate(self.before)
+
+    def test_existing_records_are_indexed(self):
+        apps = MigrationExecutor(connection).loader.project_state(self.before).apps
+        HistoricalCustomer = apps.get_model('customer_sales', 'Customer')
+        HistoricalSale = apps.get_model('customer_sales', 'Sale')
+        customer = HistoricalCustomer.objects.create(
+            name='Jane Wanjiru', id_number='11111111', phone_number='0712345678', country='Kenya', location='Town',
+            gender='F', household_type='F', household_size=3, preferred_language='EN',
+        )
+        sale = HistoricalSale.objects.create(
+            customer=customer, registration_date=date(2024, 1, 1), product_type='EPC', product_name='Cooker',
+            product_model='EPC-6', product_serial_number='JD-29ED0001', purchase_mode='P', sales_rep='Mary',
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+        apps = executor.loader.project_state(self.after).apps
+        tokens = apps.get_model('customer_sales', 'SearchToken').objects
+        self.assertEqual(
+            set(tokens.filter(kind='customer', object_id=customer.pk).values_list('token', flat=True)),
+            {'jane', 'wanjiru', '11111111', '0712345678', '712345678', 'jd', '29ed0001', 'jd29ed0001', 'mary'},
+        )
+        self.assertEqual(
+            set(tokens.filter(kind='sale', object_id=sale.pk).values_list('token', flat=True)),
+            {'cooker', 'jd', '29ed0001', 'jd29ed0001', 'mary', 'jane', 'wanjiru', '11111111', '0712345678',
+             '712345678'},
+        )
+
+
+class PaginationTests(TestCase):
+
+    def setUp(self):
+        self.customers = [add_customer(f'Customer {i}', str(i)) for i in range(1, 26)]
+        # Rows saved in the same instant share a date, so pages must break ties on id
+        Customer.objects.update(date=timezone.now())
+        self.client.force_login(User.objects.create(username='staff'))
+
+    def walk_forward(self, queryset, per_page=10):
+        pages, page = [], paginate(queryset, per_page=per_page)
+        pages.append(page)
+        while page.has_next:
+            page = paginate(queryset, after=page.next_cursor, per_page=per_page)
+            pages.append(page)
+        return pages
+
+    def test_tied_dates_are_split_on_id(self):
+        pages = self.walk_forward(Customer.objects.all())
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([customer for page in pages for customer in page], self.customers)
+        self.assertFalse(pages[0].has_previous)
+
+    def test_dates_order_before_ids(self):
+        Customer.objects.filter(pk=self.customers[0].pk).update(date=timezone.now() + timedelta(days=1))
+        pages = self.walk_forward(Customer.objects.all())
+
+        self.assertEqual([customer for page in pages for customer in page], self.customers[1:] + self.customers[:1])
+
+    def test_paging_back_from_the_last_page(self):
+        page = paginate(Customer.objects.all(), before=LAST)
+        self.assertEqual(page.object_list, self.customers[15:])
+        self.assertTrue(page.has_previous)
+        self.assertFalse(page.has_next)
+
+        page = paginate(Customer.objects.all(), before=page.previous_cursor)
+        self.assertEqual(page.object_list, self.customers[5:15])
+        self.assertTrue(page.has_next)
+
+        page = paginate(Customer.objects.all(), before=page.previous_cursor)
+        self.assertEqual(page.object_list, self.customers[:5])
+        self.assertFalse(page.has_previous)
+        # And forward again
+        self.assertEqual(paginate(Customer.objects.all(), after=page.next_cursor).object_list, self.customers[5:15])
+
+    def test_malformed_cursors_give_the_first_page(self):
+        def cursor(key):
+            return base64.urlsafe_b64encode(key.encode()).decode()
+
+        for value in ('garbage', '%%%', 'é', cursor('no separator'), cursor('not a date|1'),
+                      cursor('2024-01-01T00:00:00|x'), cursor('2024-01-01T00:00:00|1|2'),
+                      base64.urlsafe_b64encode(b'\xff\xfe').decode()):
+            for param in ('after', 'before'):
+                with self.subTest(param=param, value=value):
+                    response = self.client.get(reverse('customers_list'), {param: value})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(list(response.context['customers']), self.customers[:10])
+
+    def test_searches_are_paged(self):
+        for customer in self.customers[::2]:
+            customer.name = f'Wanjiru {customer.pk}'
+            customer.save()
+        Customer.objects.update(date=timezone.now())
+        queryset = search(Customer.objects.all(), 'wanjiru')
+
+        pages = self.walk_forward(queryset, per_page=5)
+        self.assertEqual([customer for page in pages for customer in page], self.customers[::2])
+        self.assertEqual(paginate(queryset, before=LAST, per_page=5).object_list, self.customers[16::2])
+
+        response = self.client.get(reverse('customers_list'), {'q': 'wanjiru', 'after': pages[0].next_cursor})
+        self.assertEqual(list(response.context['customers']), self.customers[10::2])
+        self.assertContains(response, '&q=wanjiru')
+
+    def test_estimates(self):
+        self.assertEqual(estimated_total(Customer.objects.all()), (self.customers[-1].pk, 'about'))
+        self.assertEqual(estimated_total(search(Customer.objects.all(), 'customer 1')), (11, ''))
+        self.assertEqual(estimated_total(Customer.objects.none()), (0, ''))
+
+        with patch('customer_sales.pagination.ESTIMATE_LIMIT', 20):
+            self.assertEqual(estimated_total(Customer.objects.filter(name__startswith='Customer')), (20, 'over'))
+            self.assertEqual(estimated_total(Customer.objects.filter(pk__lte=self.customers[19].pk)), (20, ''))
+
+    def test_estimate_wording(self):
+        with patch('customer_sales.pagination.ESTIMATE_LIMIT', 20):
+            pages = {
+                '': f'About {self.customers[-1].pk} customers.',
+                'customer': 'Over 20 customers.',
+                'customer 2': '7 customers.',
+            }
+            for query, wording in pages.items():
+                with self.subTest(query):
+                    response = self.client.get(reverse('customers_list'), {'q': query} if query else {})
+                    self.assertContains(response, wording)
@@ -1,17 +1,17 @@
+from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
 from django.core.paginator import Paginator
 from .models import Customer, Sale, TestCustomer, TestSale
+from .pagination import estimated_total, paginate
+from .search import search
 from .forms import CustomerForm, SaleForm, TestCustomerForm, TestSaleForm
 from datetime import timedelta
-import requests
-from requests.auth import HTTPBasicAuth
-import pandas as pd
-from django.http import HttpResponse
-
-# Constants
-BASE_URL = "https://appliapay.com/"
-AUTH = HTTPBasicAuth('admin', '123Give!@#')
+from export_jobs import jobs as export_jobs
+from export_jobs.models import ExportJob
+from powerpay.caching import cached_get_json
+from powerpay.exports import csv_response, queryset_xlsx_response
+from powerpay.upstream import get_tenant
 
 
 # Existing customer views...
@@ -22,16 +22,17 @@ def customers_list(request):
     CustomerModel = TestCustomer if user.first_name == 'Welight' else Customer
     # Query the appropriate model
     if query:
-        customers = CustomerModel.objects.filter(name__icontains=query)
+        customers = search(CustomerModel.objects.all(), query)
     else:
         customers = CustomerModel.objects.all()
 
     # Pagination
-    paginator = Paginator(customers, 10)
-    page = request.GET.get('page')
-    customers = paginator.get_page(page)
-    
-    return render(request, 'customer_sales/customers_list.html', {'customers': customers, 'query': query})
+    page = paginate(customers, after=request.GET.get('after'), before=request.GET.get('before'))
+    total, total_qualifier = estimated_total(customers)
+
+    return render(request, 'customer_sales/customers_list.html', {
+        'customers': page, 'query': query, 'total': total, 'total_qualifier': total_qualifier,
+    })
 
 
 def customer_detail(request, pk): 
@@ -160,15 +161,16 @@ def sales_list(request):
     # Choose the model based on user
     SaleModel = TestSale if user.first_name == 'Welight' else Sale
     if query:
-        sales = SaleModel.objects.filter(product_name__icontains=query)
+        sales = search(SaleModel.objects.all(), query)
     else:
         sales = SaleModel.objects.all()
-    
-    paginator = Paginator(sales, 10)  # Show 10 sales per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
 
-    return render(request, 'customer_sales/sales_list.html', {'sales': page_obj, 'query': query})
+    page = paginate(sales, after=request.GET.get('after'), before=request.GET.get('before'))
+    total, total_qualifier = estimated_total(sales)
+
+    return render(request, 'customer_sales/sales_list.html', {
+        'sales': page, 'query': query, 'total': total, 'total_qualifier': total_qualifier,
+    })
 
 def sale_detail(request, pk):
     user = request.user
@@ -210,10 +212,8 @@ def sale_delete(request, pk):
     return render(request, 'customer_sales/sale_confirm_delete.html', {'sale': sale})
 
 
-def fetch_data(endpoint):
-    response = requests.get(BASE_URL + endpoint, auth=AUTH)
-    response.raise_for_status()
-    return response.json()
+def fetch_data(endpoint, tenant='default'):
+    return cached_get_json(endpoint, tenant=tenant)
 #######PAYGO
 def paygo_sales(request):
     sort_field = request.GET.get('sort', 'product_serial_number')
@@ -221,7 +221,7 @@ def paygo_sales(request):
     query = request.GET.get('q', '')
 
     # Fetch sales data (assuming it's coming from an external source or model)
-    sales_data = fetch_data('paygoScode')
+    sales_data = fetch_data('paygoScode', get_tenant(request.user.username))
 
     # Custom sorting function
     def sort_sales(data, sort_field, direction='asc'):
@@ -273,7 +273,7 @@ def paygo_sales_non_metered(request):
     query = request.GET.get('q', '')
 
     # Fetch sales data (assuming it's coming from an external source or model)
-    sales_data = fetch_data('paygoScodeNonMetered')
+    sales_data = fetch_data('paygoScodeNonMetered', get_tenant(request.user.username))
 
     # Custom sorting function
     def sort_sales(data, sort_field, direction='asc'):
@@ -320,51 +320,27 @@ def paygo_sales_non_metered(request):
     return render(request, 'customer_sales/paygo_sales_non_metered.html', context)
 
 ###############################DOWNLOAD CUSTOMER DATA#######################################################
+@login_required
 def export_customer_data(request):
     user = request.user
     # Choose the model based on user
     CustomerModel = TestCustomer if user.first_name == 'Welight' else Customer
-    customers = CustomerModel.objects.all().values()
-    df = pd.DataFrame(customers)
-    # Convert any datetime columns to timezone-unaware
-    for column in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[column]):
-            df[column] = df[column].dt.tz_convert(None)  # Remove timezone information
-    # Create the filename
-    fileName = "customer_data.xlsx"
-    
-    # Create a HttpResponse with content_type as ms-excel
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    
-    # Specify the file name using f-string
-    response['Content-Disposition'] = f'attachment; filename="{fileName}"'
-    
-    # Use pandas to save the dataframe as an excel file in the response
-    df.to_excel(response, index=False, engine='openpyxl')
-
-    return response
+    if request.GET.get('format') == 'csv':
+        # Stream rows straight from the database instead of building a workbook
+        return csv_response(CustomerModel.objects.all(), "customer_data.csv")
+    if export_jobs.is_enabled():
+        return export_jobs.start_export(request, ExportJob.CUSTOMERS, {'model': CustomerModel._meta.label})
+    return queryset_xlsx_response(CustomerModel.objects.all(), "customer_data.xlsx")
 
 ###############################DOWNLOAD SALES DATA#######################################################
+@login_required
 def export_sales_data(request):
     user = request.user
     # Choose the model based on user
     SaleModel = TestSale if user.first_name == 'Welight' else Sale
-    sales = SaleModel.objects.all().values()
-    df = pd.DataFrame(sales)
-    # Convert any datetime columns to timezone-unaware
-    for column in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[column]):
-            df[column] = df[column].dt.tz_convert(None)  # Remove timezone information
-    # Create the filename
-    fileName = "sales_data.xlsx"
-    
-    # Create a HttpResponse with content_type as ms-excel
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    
-    # Specify the file name using f-string
-    response['Content-Disposition'] = f'attachment; filename="{fileName}"'
-    
-    # Use pandas to save the dataframe as an excel file in the response
-    df.to_excel(response, index=False, engine='openpyxl')
-
-    return response
+    if request.GET.get('format') == 'csv':
+        # Stream rows straight from the database instead of building a workbook
+        return csv_response(SaleModel.objects.all(), "sales_data.csv")
+    if export_jobs.is_enabled():
+        return export_jobs.start_export(request, ExportJob.SALES, {'model': SaleModel._meta.label})
+    return queryset_xlsx_response(SaleModel.objects.all(), "sales_data.xlsx")
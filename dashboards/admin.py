@@ -0,0 +1,8 @@
+from django.contrib import admin
+from .models import DashboardSnapshot
+
+
+@admin.register(DashboardSnapshot)
+class DashboardSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('tenant', 'page', 'device_id', 'range_minutes', 'computed_at')
+    list_filter = ('tenant', 'page')
@@ -0,0 +1,73 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboards.models import DashboardSnapshot
+from dashboards.snapshots import standard_ranges, store_snapshot
+from powerpay import upstream
+from powerpay.views import dashboard_snapshot
+from telemetry import queries as telemetry_store
+from telemetry.sync import DEVICE_DATA_ENDPOINTS
+
+
+class Command(BaseCommand):
+    help = "Store homepage and device page snapshots for the standard ranges of each tenant."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenant', action='append', dest='tenants', choices=sorted(DEVICE_DATA_ENDPOINTS),
+            help='Tenant to precompute (repeatable). Defaults to all tenants.',
+        )
+        parser.add_argument('--skip-devices', action='store_true', help='Only precompute the homepage.')
+        parser.add_argument('--loop', action='store_true', help='Keep precomputing until interrupted.')
+        parser.add_argument('--interval', type=int, default=300, help='Seconds between runs with --loop.')
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'DASHBOARD_SNAPSHOTS', {}).get('DEVICE_BATCH_SIZE', 8),
+            help='Devices fetched at once; only this many device payloads are held in memory.',
+        )
+
+    def handle(self, *args, **options):
+        tenants = options['tenants'] or sorted(DEVICE_DATA_ENDPOINTS)
+        try:
+            while True:
+                for tenant in tenants:
+                    self.precompute(tenant, options['skip_devices'], options['loop'], options['batch_size'])
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def precompute(self, tenant, skip_devices, loop, batch_size):
+        try:
+            for range_minutes in standard_ranges(DashboardSnapshot.HOME):
+                store_snapshot(tenant, DashboardSnapshot.HOME, range_minutes, dashboard_snapshot(tenant, range_minutes))
+            devices = 0 if skip_devices else self.precompute_devices(tenant, batch_size)
+        except Exception as e:
+            # A failed run shouldn't stop the loop; views keep serving the previous snapshots until MAX_AGE
+            if not loop:
+                raise CommandError(f"Precompute failed for {tenant}: {e}")
+            self.stderr.write(f"Precompute failed for {tenant}: {e}")
+            return
+        self.stdout.write(f"{tenant}: stored homepage snapshots and snapshots for {devices} devices")
+
+    def precompute_devices(self, tenant, batch_size):
+        device_ids = [device['deviceID'] for device in upstream.get_json(upstream.command_endpoint(tenant))]
+        for range_minutes in standard_ranges(DashboardSnapshot.DEVICE):
+            # A batch of devices at a time, each stored before the next batch is fetched
+            for i in range(0, len(device_ids), batch_size):
+                batch = device_ids[i:i + batch_size]
+                for device_id, payload in zip(batch, self.device_payloads(tenant, batch, range_minutes)):
+                    store_snapshot(tenant, DashboardSnapshot.DEVICE, range_minutes, payload, device_id)
+        return len(device_ids)
+
+    def device_payloads(self, tenant, device_ids, range_minutes):
+        if telemetry_store.is_enabled(tenant):
+            since = telemetry_store.range_start(range_minutes)
+            return (telemetry_store.device_summary(tenant, device_id, since) for device_id in device_ids)
+        # Fetched past the view cache: the snapshots are the cached copy, and full histories would crowd it out
+        return upstream.fetch_concurrently(*[
+            (upstream.get_json, ("deviceDataDjangoo", {'device': device_id, 'range': range_minutes}))
+            for device_id in device_ids
+        ])
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=20)),
+                ('page', models.CharField(choices=[('home', 'Homepage'), ('device', 'Device page')], max_length=10)),
+                ('device_id', models.CharField(blank=True, default='', max_length=100)),
+                ('range_minutes', models.IntegerField()),
+                ('payload', models.JSONField()),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'page', 'device_id', 'range_minutes'), name='unique_dashboard_snapshot')],
+            },
+        ),
+    ]
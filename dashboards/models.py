@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class DashboardSnapshot(models.Model):
+    """Precomputed dashboard data for one tenant, page and standard range."""
+    HOME = 'home'
+    DEVICE = 'device'
+    PAGE_CHOICES = [
+        (HOME, 'Homepage'),
+        (DEVICE, 'Device page'),
+    ]
+
+    tenant = models.CharField(max_length=20)
+    page = models.CharField(max_length=10, choices=PAGE_CHOICES)
+    device_id = models.CharField(max_length=100, blank=True, default='')
+    range_minutes = models.IntegerField()
+    payload = models.JSONField()
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.tenant} {self.page} {self.device_id} ({self.range_minutes} min)"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'page', 'device_id', 'range_minutes'], name='unique_dashboard_snapshot'),
+        ]
@@ -0,0 +1,47 @@
+"""
+Stored dashboard snapshots for the standard ranges.
+
+The precompute_dashboards command materialises the homepage panels and each
+device page's data for the standard ranges (settings.DASHBOARD_SNAPSHOTS)
+of every tenant. Views serve a standard range from its snapshot while it is
+younger than MAX_AGE and compute anything else live.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DashboardSnapshot
+
+
+def _config():
+    return getattr(settings, 'DASHBOARD_SNAPSHOTS', {})
+
+
+def standard_ranges(page):
+    return _config().get('RANGES', {}).get(page, [])
+
+
+def is_standard_range(page, range):
+    try:
+        return int(range) in standard_ranges(page)
+    except (TypeError, ValueError):
+        return False
+
+
+def get_snapshot(tenant, page, range, device_id=''):
+    """Return the snapshot for a standard range, or None if there is no fresh one."""
+    if not is_standard_range(page, range):
+        return None
+    max_age = timedelta(seconds=_config().get('MAX_AGE', 1800))
+    return DashboardSnapshot.objects.filter(
+        tenant=tenant, page=page, device_id=device_id, range_minutes=int(range),
+        computed_at__gte=timezone.now() - max_age,
+    ).first()
+
+
+def store_snapshot(tenant, page, range, payload, device_id=''):
+    DashboardSnapshot.objects.update_or_create(
+        tenant=tenant, page=page, device_id=device_id, range_minutes=int(range),
+        defaults={'payload': payload, 'computed_at': timezone.now()},
+    )
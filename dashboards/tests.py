@@ -0,0 +1,41 @@
+import threading
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from powerpay.testing import StubUpstream
+from .models import DashboardSnapshot
+
+
+@override_settings(DASHBOARD_SNAPSHOTS={'RANGES': {'home': [], 'device': [1440, 9999999]}})
+class PrecomputeDashboardsTests(TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.in_flight = self.most_in_flight = 0
+
+    def device_data(self, params):
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight -= 1
+        return {'device': params['device'], 'range': params['range']}
+
+    def test_devices_are_fetched_a_batch_at_a_time(self):
+        routes = {
+            'command': [{'deviceID': f'device{i}'} for i in range(10)],
+            'deviceDataDjangoo': self.device_data,
+        }
+        out = StringIO()
+        with StubUpstream(routes) as upstream:
+            call_command('precompute_dashboards', tenants=['default'], batch_size=3, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'default: stored homepage snapshots and snapshots for 10 devices')
+        self.assertEqual(len(upstream.calls('deviceDataDjangoo')), 20)
+        self.assertLessEqual(self.most_in_flight, 3)
+        snapshot = DashboardSnapshot.objects.get(page=DashboardSnapshot.DEVICE, device_id='device7', range_minutes=1440)
+        self.assertEqual(snapshot.payload, {'device': 'device7', 'range': '1440'})
@@ -0,0 +1,8 @@
+from django.contrib import admin
+from .models import ExportJob
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
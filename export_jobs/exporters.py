@@ -0,0 +1,64 @@
+"""
+What each kind of export job writes.
+
+Each exporter takes the job params and returns an Export. ``rows`` is a
+callable, so the worker can read the rows once to fingerprint them and again
+to write the file only if that fingerprint has no file yet. Exports streamed
+from upstream can only be read once and are marked ``single_pass``; the
+worker fingerprints those while writing them.
+"""
+from collections import namedtuple
+
+from django.apps import apps
+
+from powerpay import upstream
+from powerpay.exports import export_fields, iter_records, iter_rows, split_records
+from powerpay.views import transaction_records
+from .models import ExportJob
+
+Export = namedtuple('Export', ['filename', 'format', 'header', 'rows', 'single_pass'], defaults=[False])
+
+
+def export_queryset(params, filename):
+    queryset = apps.get_model(params['model']).objects.all()
+    fields = export_fields(queryset)
+    return Export(filename, 'xlsx', fields, lambda: iter_rows(queryset, fields))
+
+
+def export_stream(records, filename, file_format='csv'):
+    columns, rows = split_records(records)
+    return Export(filename, file_format, columns, lambda: rows, single_pass=True)
+
+
+def export_customers(params):
+    return export_queryset(params, "customer_data.xlsx")
+
+
+def export_sales(params):
+    return export_queryset(params, "sales_data.xlsx")
+
+
+def export_transactions(params):
+    columns, records = transaction_records(params['tenant'])
+    return Export("transactions.xlsx", 'xlsx', columns, lambda: iter_records(records, columns))
+
+
+def export_meter_data(params):
+    return export_stream(upstream.stream_json_array("migaaMeterDownload"), "migaaMeter.csv")
+
+
+def export_ml_dataset(params):
+    file_format = params.get('format', 'csv')
+    return export_stream(
+        upstream.stream_json_array('getMeasurementData', {'q': params['set']}),
+        f"{params['set']}.{file_format}", file_format,
+    )
+
+
+EXPORTERS = {
+    ExportJob.CUSTOMERS: export_customers,
+    ExportJob.SALES: export_sales,
+    ExportJob.TRANSACTIONS: export_transactions,
+    ExportJob.METER_DATA: export_meter_data,
+    ExportJob.ML_DATASET: export_ml_dataset,
+}
@@ -0,0 +1,43 @@
+"""
+Queueing of background exports.
+
+Views call start_export() instead of building a large file inside the
+request: it records an ExportJob and redirects to the job's status page. An
+identical export the user already has queued or running is attached to
+instead. The run_export_worker command picks the jobs up, reusing an earlier
+job's file when the data hasn't changed; see export_jobs.worker.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.shortcuts import redirect
+
+from .models import ExportJob
+
+
+def _config():
+    return getattr(settings, 'EXPORT_JOBS', {})
+
+
+def is_enabled():
+    return _config().get('ENABLED', False)
+
+
+def make_key(kind, params):
+    return hashlib.md5(f"{kind}:{json.dumps(params, sort_keys=True)}".encode()).hexdigest()
+
+
+def enqueue(kind, params, user):
+    """Queue an export for a user, reusing an identical job of theirs that hasn't finished yet."""
+    key = make_key(kind, params)
+    job = (ExportJob.objects.filter(key=key, requested_by=user, status__in=[ExportJob.PENDING, ExportJob.RUNNING])
+           .order_by('-created_at').first())
+    if job is None:
+        job = ExportJob.objects.create(kind=kind, params=params, key=key, requested_by=user)
+    return job
+
+
+def start_export(request, kind, params):
+    job = enqueue(kind, params, request.user)
+    return redirect('export_job', pk=job.pk)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from export_jobs.worker import claim_next, cleanup, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued export jobs, writing their files under MEDIA_ROOT."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to wait when the queue is empty.')
+
+    def handle(self, *args, **options):
+        cleanup()
+        last_cleanup = time.monotonic()
+        try:
+            while True:
+                job = claim_next()
+                if job is not None:
+                    run_job(job)
+                    self.stdout.write(f"Export job {job.pk} ({job.kind}): {job.status}")
+                    continue
+                if options['once']:
+                    break
+                if time.monotonic() - last_cleanup > 3600:
+                    cleanup()
+                    last_cleanup = time.monotonic()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('customers', 'Customer data'), ('sales', 'Sales data'), ('transactions', 'Transactions'), ('meter_data', 'Migaa meter data'), ('ml_dataset', 'ML dataset')], max_length=20)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('key', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('fingerprint', models.CharField(blank=True, max_length=32)),
+                ('file', models.FileField(blank=True, upload_to='exports/')),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='export_jobs_status_156fe6_idx'), models.Index(fields=['key', 'status'], name='export_jobs_key_b0defb_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import models
+
+
+class ExportJob(models.Model):
+    """A file export run in the background by the run_export_worker command."""
+    CUSTOMERS = 'customers'
+    SALES = 'sales'
+    TRANSACTIONS = 'transactions'
+    METER_DATA = 'meter_data'
+    ML_DATASET = 'ml_dataset'
+    KIND_CHOICES = [
+        (CUSTOMERS, 'Customer data'),
+        (SALES, 'Sales data'),
+        (TRANSACTIONS, 'Transactions'),
+        (METER_DATA, 'Migaa meter data'),
+        (ML_DATASET, 'ML dataset'),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    # Hash of kind and params; jobs with the same key produce the same export
+    key = models.CharField(max_length=32)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # Hash of the exported rows, shared by jobs whose data didn't change
+    fingerprint = models.CharField(max_length=32, blank=True)
+    file = models.FileField(upload_to='exports/', blank=True)
+    filename = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['key', 'status']),
+        ]
@@ -0,0 +1,71 @@
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+
+from customer_sales.models import Customer
+from .models import ExportJob
+from .worker import claim_next, run_job
+
+
+def add_customer(i):
+    Customer.objects.create(
+        name=f'Customer {i}', id_number=str(i), phone_number=f'07{i:08d}', country='Kenya', location='Town',
+        gender='F', household_type='F', household_size=3, preferred_language='EN',
+    )
+
+
+class ExportJobTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, EXPORT_JOBS={'ENABLED': True})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        add_customer(1)
+
+    def export(self, username):
+        self.client.force_login(User.objects.get_or_create(username=username)[0])
+        response = self.client.get(reverse('export_customers'))
+        return ExportJob.objects.get(pk=resolve(response['Location']).kwargs['pk'])
+
+    def test_anonymous_exports_need_a_login(self):
+        response = self.client.get(reverse('export_customers'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response['Location'])
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_unchanged_data_reuses_the_file(self):
+        first = self.export('first')
+        run_job(claim_next())
+        second = self.export('second')
+        self.assertEqual(second.status, ExportJob.PENDING)
+        run_job(claim_next())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.status, ExportJob.DONE)
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(self.client.get(reverse('export_job_download', args=[second.pk])).status_code, 200)
+
+    def test_edited_data_gets_a_new_file(self):
+        first = self.export('first')
+        run_job(claim_next())
+
+        add_customer(2)
+        second = self.export('first')
+        self.assertNotEqual(second, first)
+        self.assertEqual(second.status, ExportJob.PENDING)
+        run_job(claim_next())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.status, ExportJob.DONE)
+        self.assertNotEqual(second.file.name, first.file.name)
+
+    def test_unfinished_exports_are_shared_per_user(self):
+        job = self.export('first')
+        self.assertEqual(self.export('first'), job)
+        self.assertNotEqual(self.export('second'), job)
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('<int:pk>/', views.job_status, name='export_job'),
+    path('<int:pk>/download/', views.job_download, name='export_job_download'),
+]
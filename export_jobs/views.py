@@ -0,0 +1,25 @@
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404, render
+
+from .models import ExportJob
+
+
+def get_user_job(request, pk):
+    job = get_object_or_404(ExportJob, pk=pk)
+    if job.requested_by_id != request.user.pk and not request.user.is_staff:
+        raise Http404("No such export")
+    return job
+
+
+@login_required
+def job_status(request, pk):
+    return render(request, 'export_jobs/job_status.html', {'job': get_user_job(request, pk)})
+
+
+@login_required
+def job_download(request, pk):
+    job = get_user_job(request, pk)
+    if job.status != ExportJob.DONE or not job.file:
+        raise Http404("Export not ready")
+    return FileResponse(job.file.open('rb'), as_attachment=True, filename=job.filename)
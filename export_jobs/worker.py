@@ -0,0 +1,111 @@
+"""
+The export worker loop, run by the run_export_worker command.
+
+Jobs are claimed with a conditional UPDATE, so several workers can share the
+queue without a broker. Files are written under MEDIA_ROOT/exports/ and named
+after the job key and a fingerprint of the exported rows: a job whose data
+hasn't changed since an earlier identical job reuses that file instead of
+writing a new one. Single-pass exports are fingerprinted while they are
+written, and the new copy is discarded if that file already exists.
+"""
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.utils import timezone
+
+from powerpay.exports import hashed_rows, rows_fingerprint, write_columnar, write_csv, write_xlsx
+from .exporters import EXPORTERS
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+
+def _config():
+    return getattr(settings, 'EXPORT_JOBS', {})
+
+
+WRITERS = {
+    'csv': write_csv,
+    'xlsx': write_xlsx,
+    'parquet': partial(write_columnar, file_format='parquet'),
+    'arrow': partial(write_columnar, file_format='arrow'),
+}
+
+
+def claim_next():
+    """Mark the oldest pending job as running and return it, or None if the queue is empty."""
+    for job in ExportJob.objects.filter(status=ExportJob.PENDING).order_by('created_at')[:10]:
+        claimed = ExportJob.objects.filter(pk=job.pk, status=ExportJob.PENDING).update(
+            status=ExportJob.RUNNING, started_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def write_artifact(job, export):
+    """Return the storage name of the job's file, writing it only if this data has no file yet."""
+    directory = os.path.join(settings.MEDIA_ROOT, 'exports')
+    os.makedirs(directory, exist_ok=True)
+
+    if not export.single_pass:
+        job.fingerprint = rows_fingerprint(export.header, export.rows())
+        name = f"exports/{job.key[:12]}-{job.fingerprint}.{export.format}"
+        if os.path.exists(os.path.join(settings.MEDIA_ROOT, name)):
+            return name
+
+    # Write to a temporary name first so a half-written file is never served
+    part_path = os.path.join(directory, f"{job.key[:12]}.{job.pk}.part")
+    try:
+        digest = hashlib.md5()
+        with open(part_path, 'wb') as file:
+            WRITERS[export.format](file, export.header, hashed_rows(digest, export.header, export.rows()))
+        job.fingerprint = digest.hexdigest()
+        name = f"exports/{job.key[:12]}-{job.fingerprint}.{export.format}"
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if not os.path.exists(path):
+            os.replace(part_path, path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return name
+
+
+def run_job(job):
+    try:
+        export = EXPORTERS[job.kind](job.params)
+        job.file.name = write_artifact(job, export)
+        job.filename = export.filename
+        job.status = ExportJob.DONE
+    except Exception as e:
+        logger.exception("Export job %s failed", job.pk)
+        job.status = ExportJob.FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def cleanup():
+    """
+    Fail jobs left running by a worker that died, then delete jobs older than
+    KEEP_DAYS and the files no remaining job points at.
+    """
+    ExportJob.objects.filter(
+        status=ExportJob.RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=_config().get('RUNNING_TIMEOUT', 3600)),
+    ).update(status=ExportJob.FAILED, error='The export worker stopped before finishing.', finished_at=timezone.now())
+
+    cutoff = timezone.now() - timedelta(days=_config().get('KEEP_DAYS', 7))
+    old_jobs = ExportJob.objects.filter(created_at__lt=cutoff).exclude(status=ExportJob.RUNNING)
+    names = set(old_jobs.exclude(file='').values_list('file', flat=True))
+    old_jobs.delete()
+    for name in names - set(ExportJob.objects.filter(file__in=names).values_list('file', flat=True)):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if os.path.exists(path):
+            os.remove(path)
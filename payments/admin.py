@@ -0,0 +1,30 @@
+from django.contrib import admin
+from .models import CampaignPrompt, MpesaCallback, PaymentCampaign, PaymentStatus
+
+
+@admin.register(PaymentStatus)
+class PaymentStatusAdmin(admin.ModelAdmin):
+    list_display = ('ref', 'checkout_request_id', 'tenant', 'status', 'amount', 'receipt_number', 'created_at')
+    list_filter = ('tenant', 'status')
+    search_fields = ('ref', 'checkout_request_id', 'receipt_number')
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ('checkout_request_id', 'result_code', 'receipt_number', 'amount', 'phone_number', 'received_at')
+    list_filter = ('result_code',)
+    search_fields = ('checkout_request_id', 'receipt_number', 'phone_number')
+
+
+class CampaignPromptInline(admin.TabularInline):
+    model = CampaignPrompt
+    fields = ('ref', 'contact', 'amount', 'state', 'detail', 'sent_at')
+    readonly_fields = fields
+    extra = 0
+
+
+@admin.register(PaymentCampaign)
+class PaymentCampaignAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'tenant', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('tenant',)
+    inlines = [CampaignPromptInline]
@@ -0,0 +1,56 @@
+"""
+Ingestion of M-Pesa STK push callbacks.
+
+Every callback is kept in MpesaCallback. Safaricom retries callbacks it
+doesn't see acknowledged in time, and the table has unique CheckoutRequestID
+and receipt number columns: a retried callback costs one rejected insert and
+changes nothing else.
+"""
+from django.db import IntegrityError, transaction
+
+from .models import MpesaCallback
+
+# CallbackMetadata item names and the fields they are parsed into
+METADATA_FIELDS = {
+    'Amount': 'amount',
+    'MpesaReceiptNumber': 'receipt_number',
+    'TransactionDate': 'transaction_date',
+    'PhoneNumber': 'phone_number',
+}
+
+
+def parse_stk_callback(data):
+    """The fields of an STK callback body, reading its CallbackMetadata items in one pass."""
+    stk_callback = data.get('Body', {}).get('stkCallback', {})
+    fields = {
+        'checkout_request_id': stk_callback.get('CheckoutRequestID'),
+        'merchant_request_id': stk_callback.get('MerchantRequestID'),
+        'result_code': stk_callback.get('ResultCode'),
+        'result_desc': stk_callback.get('ResultDesc'),
+    }
+    fields.update(dict.fromkeys(METADATA_FIELDS.values()))
+    for item in stk_callback.get('CallbackMetadata', {}).get('Item', []):
+        field = METADATA_FIELDS.get(item.get('Name'))
+        if field is not None:
+            fields[field] = item.get('Value')
+    return fields
+
+
+def record_callback(fields, payload):
+    """Store a parsed callback. Returns it, or None if it repeats one already stored."""
+    try:
+        # A savepoint, so a rejected duplicate doesn't break an enclosing transaction
+        with transaction.atomic():
+            return MpesaCallback.objects.create(
+                checkout_request_id=fields['checkout_request_id'],
+                merchant_request_id=fields['merchant_request_id'] or '',
+                result_code=fields['result_code'],
+                result_desc=fields['result_desc'] or '',
+                receipt_number=fields['receipt_number'] or None,
+                amount=fields['amount'],
+                transaction_date=str(fields['transaction_date'] or ''),
+                phone_number=str(fields['phone_number'] or ''),
+                payload=payload,
+            )
+    except IntegrityError:
+        return None
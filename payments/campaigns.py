@@ -0,0 +1,158 @@
+"""
+Bulk STK push campaigns.
+
+start_campaign() records a PaymentCampaign with one CampaignPrompt per
+reference, queued for the run_campaign_worker command; see send_prompts().
+Workers claim queued prompts with a conditional UPDATE, like export jobs, so
+several can share the queue and a restarted worker picks up where the last
+one stopped. Each worker sends through a bounded thread pool, spaced so that
+no more than CAMPAIGN_RATE_PER_SECOND start each second. Each prompt's row
+records whether M-Pesa accepted it, and an accepted prompt's PaymentStatus
+then follows its callback like any other. Only the worker's main thread
+touches the database; the pool threads only make the upstream calls.
+"""
+import threading
+import time
+from concurrent.futures import as_completed
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from powerpay import upstream
+from . import store
+from .models import CampaignPrompt, PaymentCampaign
+
+
+def _config():
+    return getattr(settings, 'PAYMENTS', {})
+
+
+class RateLimiter:
+    """Spaces out calls across threads so no more than ``rate`` start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _amount(value):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+    return amount if amount.is_finite() and amount > 0 else None
+
+
+def _amount_text(amount):
+    # Sent as the manual prompt form sends them, e.g. "150" or "99.5"
+    if amount == amount.to_integral_value():
+        return str(amount.to_integral_value())
+    return str(amount.normalize())
+
+
+def start_campaign(targets, endpoint, tenant='default', user=None):
+    """
+    Record a campaign for ``(ref, contact, amount)`` targets, to be sent as
+    STK pushes through the upstream ``endpoint``. Targets without a contact
+    or an amount due are recorded as skipped.
+    """
+    campaign = PaymentCampaign.objects.create(tenant=tenant, endpoint=endpoint, requested_by=user)
+    prompts = []
+    for ref, contact, amount in targets:
+        prompt = CampaignPrompt(campaign=campaign, ref=ref, contact=contact or '', amount=_amount(amount))
+        if not contact:
+            prompt.state, prompt.detail = CampaignPrompt.SKIPPED, 'No phone number on the customer record.'
+        elif prompt.amount is None:
+            prompt.state, prompt.detail = CampaignPrompt.SKIPPED, 'Nothing due.'
+        prompts.append(prompt)
+    CampaignPrompt.objects.bulk_create(prompts)
+    finish_campaigns()
+    return campaign
+
+
+def claim_prompts(limit):
+    """Mark up to ``limit`` queued prompts, oldest first, as sending and return them."""
+    claimed = []
+    queued = CampaignPrompt.objects.filter(state=CampaignPrompt.QUEUED).select_related('campaign').order_by('pk')
+    for prompt in queued[:limit]:
+        if CampaignPrompt.objects.filter(pk=prompt.pk, state=CampaignPrompt.QUEUED).update(
+            state=CampaignPrompt.SENDING, sent_at=timezone.now(),
+        ):
+            claimed.append(prompt)
+    return claimed
+
+
+def send_prompt(prompt):
+    # The same request the manual prompt form sends
+    payload = {"contact": prompt.contact, "ref": prompt.ref, "amount": _amount_text(prompt.amount)}
+    return upstream.post_json(prompt.campaign.endpoint, payload)
+
+
+def send_prompts(prompts, pool, limiter):
+    """Send claimed prompts through ``pool`` and record how each went."""
+    def dispatch(prompt):
+        limiter.wait()
+        return send_prompt(prompt)
+
+    futures = {pool.submit(dispatch, prompt): prompt for prompt in prompts}
+    for future in as_completed(futures):
+        record_outcome(futures[future], future)
+    finish_campaigns()
+
+
+def record_outcome(prompt, future):
+    try:
+        res = future.result()
+    except Exception as e:
+        prompt.state, prompt.detail = CampaignPrompt.ERROR, str(e)
+    else:
+        if res.get('ResponseCode') == 0:
+            prompt.state = CampaignPrompt.SENT
+            prompt.payment = store.record_prompt(
+                prompt.ref, res.get('CheckoutRequestID'),
+                tenant=prompt.campaign.tenant, user=prompt.campaign.requested_by,
+            )
+        else:
+            prompt.state = CampaignPrompt.REJECTED
+        prompt.detail = res.get('ResponseDescription') or res.get('errorMessage') or ''
+    prompt.save(update_fields=['state', 'detail', 'payment'])
+
+
+def finish_campaigns():
+    """Mark campaigns with nothing left to send as finished."""
+    unsent = CampaignPrompt.objects.filter(
+        campaign=OuterRef('pk'), state__in=[CampaignPrompt.QUEUED, CampaignPrompt.SENDING],
+    )
+    PaymentCampaign.objects.filter(finished_at__isnull=True).exclude(Exists(unsent)).update(finished_at=timezone.now())
+
+
+def cleanup():
+    """
+    Fail prompts left sending by a worker that died. They may have reached
+    the customer, so they aren't sent again.
+    """
+    CampaignPrompt.objects.filter(
+        state=CampaignPrompt.SENDING,
+        sent_at__lt=timezone.now() - timedelta(seconds=_config().get('CAMPAIGN_SENDING_TIMEOUT', 600)),
+    ).update(state=CampaignPrompt.ERROR, detail='The campaign worker stopped while sending this prompt.')
+    finish_campaigns()
+
+
+def progress(campaign):
+    """Number of the campaign's prompts in each state."""
+    counts = dict.fromkeys((state for state, _ in CampaignPrompt.STATE_CHOICES), 0)
+    for row in campaign.prompts.values('state').annotate(count=Count('pk')).order_by():
+        counts[row['state']] = row['count']
+    return counts
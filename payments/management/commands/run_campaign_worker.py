@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.campaigns import RateLimiter, claim_prompts, cleanup, send_prompts
+
+
+class Command(BaseCommand):
+    help = "Send the queued prompts of payment campaigns."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to wait when the queue is empty.')
+
+    def handle(self, *args, **options):
+        config = getattr(settings, 'PAYMENTS', {})
+        workers = config.get('CAMPAIGN_WORKERS', 10)
+        limiter = RateLimiter(config.get('CAMPAIGN_RATE_PER_SECOND', 20))
+        cleanup()
+        last_cleanup = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='campaign') as pool:
+                while True:
+                    # A couple of prompts per thread at a time, so other workers share a large campaign
+                    prompts = claim_prompts(workers * 2)
+                    if prompts:
+                        send_prompts(prompts, pool, limiter)
+                        self.stdout.write(f"Sent {len(prompts)} campaign prompts")
+                        continue
+                    if options['once']:
+                        break
+                    if time.monotonic() - last_cleanup > 60:
+                        cleanup()
+                        last_cleanup = time.monotonic()
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
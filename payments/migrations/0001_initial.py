@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ref', models.CharField(max_length=255)),
+                ('checkout_request_id', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('tenant', models.CharField(default='default', max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('success', 'Success'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('message', models.TextField(blank=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('receipt_number', models.CharField(blank=True, max_length=20)),
+                ('transaction_date', models.CharField(blank=True, max_length=20)),
+                ('phone_number', models.CharField(blank=True, max_length=15)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'payment statuses',
+                'indexes': [models.Index(fields=['ref', 'created_at'], name='payments_pa_ref_14b67f_idx'), models.Index(fields=['created_at'], name='payments_pa_created_343680_idx')],
+            },
+        ),
+    ]
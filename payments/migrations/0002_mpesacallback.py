@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('merchant_request_id', models.CharField(blank=True, max_length=100)),
+                ('result_code', models.IntegerField(blank=True, null=True)),
+                ('result_desc', models.TextField(blank=True)),
+                ('receipt_number', models.CharField(blank=True, max_length=20, null=True, unique=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('transaction_date', models.CharField(blank=True, max_length=20)),
+                ('phone_number', models.CharField(blank=True, max_length=15)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
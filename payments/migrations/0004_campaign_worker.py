@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_paymentcampaign_campaignprompt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentcampaign',
+            name='endpoint',
+            field=models.CharField(default='stkpush', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='campaignprompt',
+            name='state',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('rejected', 'Rejected'), ('error', 'Error'), ('skipped', 'Skipped')], default='queued', max_length=10),
+        ),
+    ]
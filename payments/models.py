@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.db import models
+
+
+class PaymentStatus(models.Model):
+    """The outcome of one STK push prompt, filled in by the M-Pesa callback."""
+    PENDING = 'pending'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SUCCESS, 'Success'),
+        (FAILED, 'Failed'),
+    ]
+
+    ref = models.CharField(max_length=255)
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    tenant = models.CharField(max_length=20, default='default')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    message = models.TextField(blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    receipt_number = models.CharField(max_length=20, blank=True)
+    transaction_date = models.CharField(max_length=20, blank=True)
+    phone_number = models.CharField(max_length=15, blank=True)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.ref} ({self.status})"
+
+    class Meta:
+        verbose_name_plural = 'payment statuses'
+        indexes = [
+            models.Index(fields=['ref', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+
+class MpesaCallback(models.Model):
+    """An STK push callback as M-Pesa sent it, stored once however often it is retried."""
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    merchant_request_id = models.CharField(max_length=100, blank=True)
+    result_code = models.IntegerField(null=True, blank=True)
+    result_desc = models.TextField(blank=True)
+    # Only successful payments have a receipt
+    receipt_number = models.CharField(max_length=20, unique=True, null=True, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    transaction_date = models.CharField(max_length=20, blank=True)
+    phone_number = models.CharField(max_length=15, blank=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.checkout_request_id} ({self.result_code})"
+
+
+class PaymentCampaign(models.Model):
+    """A batch of STK push prompts sent to many PAYGO customers at once."""
+    tenant = models.CharField(max_length=20, default='default')
+    # Upstream STK push endpoint the prompts are sent through
+    endpoint = models.CharField(max_length=50, default='stkpush')
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Campaign {self.pk} ({self.tenant})"
+
+    @property
+    def is_finished(self):
+        return self.finished_at is not None
+
+
+class CampaignPrompt(models.Model):
+    """One reference in a campaign, and how sending its prompt went."""
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    REJECTED = 'rejected'
+    ERROR = 'error'
+    SKIPPED = 'skipped'
+    STATE_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (REJECTED, 'Rejected'),
+        (ERROR, 'Error'),
+        (SKIPPED, 'Skipped'),
+    ]
+
+    campaign = models.ForeignKey(PaymentCampaign, on_delete=models.CASCADE, related_name='prompts')
+    ref = models.CharField(max_length=255)
+    contact = models.CharField(max_length=15, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=QUEUED)
+    # M-Pesa's response, or why the prompt wasn't sent
+    detail = models.TextField(blank=True)
+    payment = models.ForeignKey(PaymentStatus, on_delete=models.SET_NULL, null=True, blank=True)
+    # When a worker claimed the prompt to send it
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.ref} ({self.state})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['campaign', 'state']),
+        ]
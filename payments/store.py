@@ -0,0 +1,94 @@
+"""
+Per-prompt payment status.
+
+Each STK push records a PaymentStatus row keyed by its reference and the
+CheckoutRequestID M-Pesa returned for it. The callback fills in the result
+on the row with that CheckoutRequestID with a conditional UPDATE, so any
+number of worker processes can share the store, and the waiting page reads
+only its own row. Rows older than STATUS_TTL are ignored, and deleted as new
+prompts are recorded.
+
+Requests waiting on a prompt's result (see result_event) are woken as
+soon as a callback handled by the same process records it; callbacks handled
+by other processes are seen on the waiters' next poll of the table.
+"""
+import threading
+import weakref
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PaymentStatus
+
+# One Event per CheckoutRequestID being waited on, dropped once nobody waits on it
+_events = weakref.WeakValueDictionary()
+_events_lock = threading.Lock()
+
+
+def _config():
+    return getattr(settings, 'PAYMENTS', {})
+
+
+def _cutoff():
+    return timezone.now() - timedelta(seconds=_config().get('STATUS_TTL', 86400))
+
+
+def record_prompt(ref, checkout_request_id, tenant='default', user=None):
+    """Record a prompt that M-Pesa accepted, as pending until its callback arrives."""
+    PaymentStatus.objects.filter(created_at__lt=_cutoff()).delete()
+    details = {'ref': ref, 'tenant': tenant, 'requested_by': user}
+    if not checkout_request_id:
+        return PaymentStatus.objects.create(**details)
+    # The callback may have beaten us here, in which case only the details are filled in
+    status, _ = PaymentStatus.objects.update_or_create(checkout_request_id=checkout_request_id, defaults=details)
+    return status
+
+
+def record_result(checkout_request_id, status, message, amount=None, receipt_number=None,
+                  transaction_date=None, phone_number=None):
+    """
+    Fill in the result of a prompt. Returns False if the prompt already had a
+    result, as it does when M-Pesa retries a callback.
+    """
+    result = {
+        'status': status,
+        'message': message or '',
+        'amount': amount,
+        'receipt_number': receipt_number or '',
+        'transaction_date': str(transaction_date or ''),
+        'phone_number': str(phone_number or ''),
+    }
+    updated = PaymentStatus.objects.filter(
+        checkout_request_id=checkout_request_id, status=PaymentStatus.PENDING,
+    ).update(updated_at=timezone.now(), **result)
+    if not updated:
+        _, updated = PaymentStatus.objects.get_or_create(checkout_request_id=checkout_request_id, defaults=result)
+    if updated:
+        with _events_lock:
+            event = _events.get(checkout_request_id)
+        if event is not None:
+            # Waiters re-read the table when woken, so not before it holds the result
+            transaction.on_commit(event.set)
+    return bool(updated)
+
+
+def get_status(ref, checkout_request_id=None):
+    """The latest unexpired prompt for a reference, or the one with checkout_request_id, or None."""
+    statuses = PaymentStatus.objects.filter(ref=ref, created_at__gte=_cutoff())
+    if checkout_request_id:
+        statuses = statuses.filter(checkout_request_id=checkout_request_id)
+    return statuses.order_by('-created_at').first()
+
+
+def result_event(checkout_request_id):
+    """
+    An Event set when a callback in this process records the prompt's result.
+    Take it before checking the table, so a result recorded in between isn't missed.
+    """
+    with _events_lock:
+        event = _events.get(checkout_request_id)
+        if event is None:
+            event = _events[checkout_request_id] = threading.Event()
+    return event
@@ -0,0 +1,185 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from customer_sales.models import Customer
+from powerpay import views
+from powerpay.testing import StubUpstream, benchmark
+from . import campaigns, store
+from .models import CampaignPrompt, MpesaCallback, PaymentCampaign, PaymentStatus
+
+
+def stk_callback(checkout_request_id, receipt_number, amount=100):
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': f'mr_{checkout_request_id}',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': 0,
+        'ResultDesc': 'The service request is processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt_number},
+            {'Name': 'Balance'},
+            {'Name': 'TransactionDate', 'Value': 20240101120000},
+            {'Name': 'PhoneNumber', 'Value': 254700000000},
+        ]},
+    }}}
+
+
+@override_settings(PAYMENTS={'STREAM_POLL_INTERVAL': 15, 'STREAM_TIMEOUT': 10, 'STREAM_MAX_OPEN': 2})
+class PaymentStatusEventsTests(TransactionTestCase):
+
+    def test_a_callback_in_this_process_wakes_the_stream(self):
+        store.record_prompt('ref1', 'ws_1')
+        threading.Timer(0.2, store.record_result, ('ws_1', 'success', 'Paid')).start()
+
+        start = time.perf_counter()
+        # The table is read when the stream opens and once more when the event wakes it, not every second
+        with self.assertNumQueries(2):
+            events = list(views.payment_status_events('ref1', 'ws_1'))
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertIn('"status": "pending"', events[1])
+        self.assertIn('"status": "success"', events[-1])
+
+    def test_streams_past_the_cap_fall_back_to_polling(self):
+        store.record_prompt('ref1', 'ws_1')
+        streams = [views.payment_status_events('ref1', 'ws_1') for _ in range(3)]
+        for stream in streams[:2]:
+            next(stream), next(stream)
+
+        self.assertEqual(list(streams[2])[1:], ["event: timeout\ndata: {}\n\n"])
+
+        # Closing a stream, as the server does when the browser goes away, frees its place
+        streams[0].close()
+        stream = views.payment_status_events('ref1', 'ws_1')
+        next(stream)
+        self.assertIn('"status": "pending"', next(stream))
+        stream.close()
+        streams[1].close()
+
+
+class PaymentConfirmationTests(TestCase):
+
+    def post(self, client, body):
+        return client.post(reverse('payment_confirmation'), json.dumps(body), content_type='application/json')
+
+    def test_retries_are_recorded_once(self):
+        store.record_prompt('ref1', 'ws_1')
+        for _ in range(3):
+            self.assertEqual(self.post(self.client, stk_callback('ws_1', 'RCPT1')).json()['status'], 'success')
+
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+        payment = PaymentStatus.objects.get(checkout_request_id='ws_1')
+        self.assertEqual((payment.status, payment.receipt_number), ('success', 'RCPT1'))
+
+    def test_a_failed_result_write_leaves_the_callback_to_be_retried(self):
+        store.record_prompt('ref1', 'ws_1')
+        client = Client(raise_request_exception=False)
+        with mock.patch.object(store, 'record_result', side_effect=RuntimeError):
+            self.assertEqual(self.post(client, stk_callback('ws_1', 'RCPT1')).status_code, 500)
+        self.assertFalse(MpesaCallback.objects.exists())
+
+        self.post(client, stk_callback('ws_1', 'RCPT1'))
+        self.assertEqual(PaymentStatus.objects.get(checkout_request_id='ws_1').status, 'success')
+
+    @benchmark
+    def test_callbacks_per_second(self):
+        count = 2000
+        for i in range(count):
+            store.record_prompt(f'ref{i}', f'ws_{i}')
+        bodies = [json.dumps(stk_callback(f'ws_{i}', f'RCPT{i}')) for i in range(count)]
+        requests = [
+            RequestFactory().post(reverse('payment_confirmation'), body, content_type='application/json')
+            for body in bodies
+        ]
+
+        # One worker handling the callbacks one after another, then Safaricom retrying every one
+        for label in ('new', 'retried'):
+            start = time.perf_counter()
+            for request in requests:
+                views.payment_confirmation(request)
+            elapsed = time.perf_counter() - start
+            print(f"\npayment_confirmation, {label} callbacks: {count / elapsed:.0f}/s")
+
+        self.assertEqual(MpesaCallback.objects.count(), count)
+        self.assertFalse(PaymentStatus.objects.filter(status=PaymentStatus.PENDING).exists())
+
+
+class PaymentCampaignTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff'))
+        customers = [
+            Customer.objects.create(
+                name=f'Customer {i}', id_number=str(i), phone_number=f'07{i:08d}', country='Kenya', location='Town',
+                gender='F', household_type='F', household_size=3, preferred_language='EN',
+            )
+            for i in range(4)
+        ]
+        self.sales = [
+            {'product_serial_number': f'SN{i}', 'customer_id': customer.pk,
+             'paymentData': {'payment_status': 'overdue', 'paygoBalance': 100 + i}}
+            for i, customer in enumerate(customers[:3])
+        ]
+        # A sale upstream has no payment data for
+        self.sales.append({'product_serial_number': 'SN3', 'customer_id': customers[3].pk})
+
+    def stub(self):
+        def stk_push(payload):
+            return {'ResponseCode': 0, 'CheckoutRequestID': f"ws_{payload['ref']}", 'ResponseDescription': 'Accepted'}
+
+        return StubUpstream({'paygoScode': lambda params: self.sales, 'stkpush': stk_push})
+
+    def start(self):
+        response = self.client.post(reverse('payment_campaign_start'), {'filter': 'overdue'})
+        return PaymentCampaign.objects.get(pk=resolve(response['Location']).kwargs['pk'])
+
+    def states(self, campaign):
+        return dict(campaign.prompts.values_list('ref', 'state'))
+
+    def test_prompts_are_queued_for_the_worker(self):
+        with self.stub() as upstream:
+            campaign = self.start()
+            self.assertEqual(upstream.calls('stkpush'), [])
+            self.assertEqual(self.states(campaign), {ref: CampaignPrompt.QUEUED for ref in ('SN0', 'SN1', 'SN2')})
+
+            call_command('run_campaign_worker', once=True, stdout=StringIO())
+            self.assertEqual(
+                sorted(upstream.calls('stkpush'), key=lambda payload: payload['ref']),
+                [{'contact': f'07{i:08d}', 'ref': f'SN{i}', 'amount': str(100 + i)} for i in range(3)],
+            )
+
+        campaign.refresh_from_db()
+        self.assertTrue(campaign.is_finished)
+        self.assertEqual(set(self.states(campaign).values()), {CampaignPrompt.SENT})
+        self.assertEqual(PaymentStatus.objects.get(checkout_request_id='ws_SN1').ref, 'SN1')
+
+    def test_balances_are_read_past_the_cache(self):
+        with self.stub():
+            views.fetch_data('paygoScode')
+            self.sales[0]['paymentData']['paygoBalance'] = 40
+            campaign = self.start()
+        self.assertEqual(campaign.prompts.get(ref='SN0').amount, 40)
+
+    def test_a_restarted_worker_resumes_the_campaign(self):
+        with self.stub() as upstream:
+            campaign = self.start()
+            # A worker that died after claiming a prompt
+            claimed, = campaigns.claim_prompts(1)
+            CampaignPrompt.objects.filter(pk=claimed.pk).update(sent_at=timezone.now() - timedelta(hours=1))
+
+            call_command('run_campaign_worker', once=True, stdout=StringIO())
+            # The claimed prompt may have reached the customer, so it isn't sent again
+            self.assertEqual(len(upstream.calls('stkpush')), 2)
+
+        campaign.refresh_from_db()
+        self.assertTrue(campaign.is_finished)
+        self.assertEqual(campaign.prompts.get(pk=claimed.pk).state, CampaignPrompt.ERROR)
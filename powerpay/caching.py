@@ -0,0 +1,179 @@
+"""
+Caching for upstream appliapay feeds and rendered chart fragments.
+
+Responses are stored in Django's cache keyed by tenant, endpoint and query
+params. Each endpoint has a TTL (settings.UPSTREAM_CACHE['TTLS']); once that
+expires the entry is still served for STALE_TTL seconds while a background
+thread refreshes it, so page views never wait on a refetch of data we already
+have.
+
+Rendered chart fragments are cached per tenant and range under a fingerprint
+of the data they were built from, so unchanged data skips figure building.
+Aggregated dashboard data is cached per tenant and range so the dashboard
+panels, which the browser requests in parallel, share one aggregation.
+"""
+import hashlib
+import logging
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+import numpy as np
+import pandas as pd
+
+from . import upstream
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'hits': 0,
+    'stale_hits': 0,
+    'misses': 0,
+    'refreshes': 0,
+    'refresh_errors': 0,
+    'fragment_hits': 0,
+    'fragment_misses': 0,
+}
+
+# Serialises builds of the same key within this process. Keys include
+# user-supplied params, so they share a fixed pool of locks by hash rather
+# than each getting one of their own
+BUILD_LOCK_STRIPES = 64
+_build_locks = [threading.Lock() for _ in range(BUILD_LOCK_STRIPES)]
+
+
+def _incr(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """Return a snapshot of the cache counters for this process."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['hits'] + stats['stale_hits']) / lookups if lookups else None
+    fragment_lookups = stats['fragment_hits'] + stats['fragment_misses']
+    stats['fragment_hit_rate'] = stats['fragment_hits'] / fragment_lookups if fragment_lookups else None
+    return stats
+
+
+def _config():
+    return getattr(settings, 'UPSTREAM_CACHE', {})
+
+
+def get_ttl(endpoint):
+    config = _config()
+    return config.get('TTLS', {}).get(endpoint, config.get('DEFAULT_TTL', 60))
+
+
+def get_dashboard_ttl():
+    return _config().get('DASHBOARD_TTL', 60)
+
+
+def make_key(tenant, endpoint, params=None):
+    query = urlencode(sorted((params or {}).items()))
+    digest = hashlib.md5(f"{tenant}:{endpoint}?{query}".encode()).hexdigest()
+    return f"upstream:{endpoint}:{digest}"
+
+
+def _store(key, endpoint, data):
+    stale_ttl = _config().get('STALE_TTL', 600)
+    cache.set(key, {'data': data, 'fetched_at': time.time()}, get_ttl(endpoint) + stale_ttl)
+
+
+def _refresh(key, endpoint, params):
+    try:
+        _store(key, endpoint, upstream.get_json(endpoint, params))
+        _incr('refreshes')
+    except Exception:
+        _incr('refresh_errors')
+        logger.exception("Background refresh of %s failed", endpoint)
+    finally:
+        cache.delete(key + ':refreshing')
+
+
+def cached_get_json(endpoint, params=None, tenant='default'):
+    """
+    Fetch an upstream JSON payload through the cache.
+
+    Fresh entries are returned as-is, stale entries are returned immediately
+    and refreshed in the background, and misses are fetched synchronously.
+    Endpoints with a TTL of 0 bypass the cache.
+    """
+    ttl = get_ttl(endpoint)
+    if ttl <= 0:
+        return upstream.get_json(endpoint, params)
+
+    key = make_key(tenant, endpoint, params)
+    entry = cache.get(key)
+    if entry is None:
+        _incr('misses')
+        data = upstream.get_json(endpoint, params)
+        _store(key, endpoint, data)
+        return data
+
+    if time.time() - entry['fetched_at'] < ttl:
+        _incr('hits')
+    else:
+        _incr('stale_hits')
+        # cache.add is atomic, so only one worker refreshes a given key
+        if cache.add(key + ':refreshing', True, 60):
+            threading.Thread(target=_refresh, args=(key, endpoint, params), daemon=True).start()
+    return entry['data']
+
+
+def fingerprint(*parts):
+    """
+    Hash the data a fragment is built from. Numpy arrays and pandas objects
+    are hashed from their values; anything else by its repr.
+    """
+    digest = hashlib.md5()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        elif isinstance(part, np.ndarray) and part.dtype == object:
+            digest.update(pd.util.hash_array(part).tobytes())
+        elif isinstance(part, np.ndarray):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def cached_fragments(name, tenant, range, data_fingerprint, build):
+    """
+    Return the fragments built by ``build()`` for this tenant and range,
+    reusing the cached copy while the data fingerprint is unchanged.
+    """
+    key = f"fragments:{name}:{tenant}:{range}:{data_fingerprint}"
+    fragments = cache.get(key)
+    if fragments is not None:
+        _incr('fragment_hits')
+        return fragments
+
+    _incr('fragment_misses')
+    fragments = build()
+    cache.set(key, fragments, _config().get('FRAGMENT_TTL', 3600))
+    return fragments
+
+
+def cached_build(key, ttl, build):
+    """
+    Return ``build()`` cached under key for ttl seconds. Concurrent misses for
+    the same key in this process wait for the first build instead of
+    repeating it (as, rarely, do misses for keys sharing its lock stripe).
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with _build_locks[hash(key) % BUILD_LOCK_STRIPES]:
+        value = cache.get(key)
+        if value is None:
+            value = build()
+            cache.set(key, value, ttl)
+    return value
@@ -0,0 +1,115 @@
+"""
+Chart rendering helpers.
+
+Views render figures as compact JSON specs instead of self-contained plotly
+HTML. plotly.js and the shared layout template are loaded once per page by
+layout.html (see powerpay.context_processors.charts), so each chart only
+carries its own data and layout.
+
+Time series are downsampled before plotting (settings.CHART_MAX_POINTS) so
+full-history ranges don't ship every raw reading to the browser.
+"""
+import uuid
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from django.conf import settings
+from django.utils.safestring import mark_safe
+from plotly.offline import get_plotlyjs_version
+
+
+def get_plotlyjs_url():
+    # Pin the bundle to the plotly.js version this plotly.py release targets
+    return getattr(settings, 'PLOTLYJS_URL', None) or f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+
+def _to_json(obj):
+    # Escapes '<' and '/', so the output is safe inside a <script> tag
+    return pio.json.to_json_plotly(obj)
+
+
+PLOTLY_TEMPLATE_JSON = _to_json(pio.templates[pio.templates.default].to_plotly_json())
+
+
+def chart_spec(fig):
+    """Return a figure as a JSON spec without its (shared) layout template."""
+    spec = fig.to_plotly_json()
+    spec['layout'].pop('template', None)
+    return _to_json(spec)
+
+
+def render_chart(fig):
+    """Render a figure as a div plus the script that draws it client-side."""
+    div_id = f"chart-{uuid.uuid4().hex}"
+    return mark_safe(
+        f'<div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>'
+        f'<script>renderChart("{div_id}", {chart_spec(fig)});</script>'
+    )
+
+
+# Candidate bucket widths for time-bucketed bar charts, smallest first
+BUCKET_FREQS = ['1min', '5min', '15min', '30min', '1h', '3h', '6h', '12h', '1D', '7D', '30D']
+
+
+def get_max_points():
+    return getattr(settings, 'CHART_MAX_POINTS', 2000)
+
+
+def choose_bucket(start, end, max_points):
+    """Pick the smallest bucket width that fits the visible range into max_points buckets."""
+    span = end - start
+    for freq in BUCKET_FREQS:
+        if span / pd.Timedelta(freq) <= max_points:
+            return freq
+    return BUCKET_FREQS[-1]
+
+
+def bucket_sum(df, x_column, y_column, max_points=None):
+    """
+    Aggregate a time series into time buckets sized from its visible range,
+    summing y_column per bucket. Returns a frame with x_column, y_column and
+    the number of readings in each bucket, plus the bucket width used.
+    """
+    max_points = max_points or get_max_points()
+    freq = choose_bucket(df[x_column].min(), df[x_column].max(), max_points)
+    grouped = df.groupby(df[x_column].dt.floor(freq))[y_column].agg(['sum', 'size'])
+    bucketed = pd.DataFrame({
+        x_column: grouped.index,
+        y_column: grouped['sum'].to_numpy(),
+        'readings': grouped['size'].to_numpy(),
+    })
+    return bucketed, freq
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling for line traces. Returns the
+    indices of the points to keep; the first and last points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('int64')
+    x = x.astype('float64')
+    y = np.asarray(y, dtype='float64')
+
+    # Interior points are split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    keep = np.empty(threshold, dtype='int64')
+    keep[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point for the final bucket)
+        next_start, next_end = (end, edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        keep[i + 1] = a
+    keep[-1] = n - 1
+    return keep
@@ -0,0 +1,8 @@
+from .charts import get_plotlyjs_url, PLOTLY_TEMPLATE_JSON
+
+
+def charts(request):
+    return {
+        'plotlyjs_url': get_plotlyjs_url(),
+        'plotly_template': PLOTLY_TEMPLATE_JSON,
+    }
@@ -0,0 +1,303 @@
+"""
+Streaming exports of model tables and upstream records.
+
+Rows are read with QuerySet.iterator() and written out chunk by chunk, so
+memory stays flat however large the table is. CSV goes out as soon as the
+first chunk has been read. XLSX is written by openpyxl in write-only mode
+into a temporary file that stays in memory up to EXPORT_SPOOL_MAX_SIZE and
+spills to disk beyond it, then streamed from there. Upstream records go out
+as they arrive, with the columns of the first COLUMN_SAMPLE_SIZE records.
+Parquet and Arrow IPC files are typed from every row, spooled the same way
+as XLSX, then written one row group at a time and streamed as each one is
+encoded; they need pyarrow, which is imported only when they are asked for.
+"""
+import csv
+import hashlib
+import importlib.util
+import io
+import itertools
+import pickle
+import tempfile
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook
+
+EXPORT_CHUNK_SIZE = 2000
+# Upstream records read to find the columns before any row is written
+COLUMN_SAMPLE_SIZE = 1000
+ROW_GROUP_SIZE = 64 * 1024
+
+COLUMNAR_CONTENT_TYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+
+
+def export_fields(queryset):
+    """Column names in the order ``queryset.values()`` returns them."""
+    return [field.attname for field in queryset.model._meta.concrete_fields]
+
+
+def export_value(value):
+    # Aware datetimes are written as naive UTC, like the pandas Excel exports
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def iter_rows(queryset, fields=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield each row of a queryset as a list of export-ready values."""
+    fields = fields or export_fields(queryset)
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield [export_value(value) for value in row]
+
+
+def iter_csv(header, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Encode a header and rows as CSV text, one chunk of rows at a time."""
+    buffer = io.StringIO()
+    # Same line endings as DataFrame.to_csv
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def split_records(records, sample_size=COLUMN_SAMPLE_SIZE):
+    """
+    Return ``(columns, rows)`` for a stream of dicts. The columns are the keys
+    of the first ``sample_size`` records in first-seen order, like
+    record_columns; only those records are read before rows start to flow.
+    A later record with a key outside them raises ValueError, since the
+    header has gone out by then.
+    """
+    records = iter(records)
+    sample = list(itertools.islice(records, sample_size))
+    columns = record_columns(sample)
+    known = set(columns)
+
+    def rows():
+        yield from iter_records(sample, columns)
+        for number, record in enumerate(records, len(sample) + 1):
+            if not known.issuperset(record):
+                late = [key for key in record if key not in known]
+                raise ValueError(f"Record {number} has keys {late} that the first {len(sample)} records don't")
+            yield [record.get(column) for column in columns]
+
+    return columns, rows()
+
+
+def iter_records_csv(records, chunk_size=EXPORT_CHUNK_SIZE):
+    """Encode a stream of dicts as CSV text as they arrive (see split_records)."""
+    columns, rows = split_records(records)
+    if columns:
+        yield from iter_csv(columns, rows, chunk_size)
+
+
+def records_csv_response(records, filename, chunk_size=500):
+    """Stream an iterator of dicts (see powerpay.upstream.stream_json_array) as a CSV attachment."""
+    response = StreamingHttpResponse(iter_records_csv(records, chunk_size), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def columnar_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _column_type(pa, values):
+    # Values pyarrow can't give one type are kept as text
+    try:
+        return pa.array(values).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.string()
+
+
+def _merged_type(pa, current, new):
+    """The type of a column whose row groups so far have ``current`` and ``new`` types."""
+    if pa.types.is_null(current) or current == new:
+        return new
+    if pa.types.is_null(new):
+        return current
+    numeric = (pa.types.is_integer, pa.types.is_floating)
+    if any(test(current) for test in numeric) and any(test(new) for test in numeric):
+        # Integers with fractions elsewhere in the column
+        return pa.float64()
+    return pa.string()
+
+
+def _column_array(pa, name, values, column_type):
+    if pa.types.is_string(column_type):
+        values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+    try:
+        # A safe cast: pa.array(values, type=...) would truncate fractions into an integer type
+        return pa.array(values).cast(column_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"Column {name!r} has values that don't fit its {column_type} type: {e}") from e
+
+
+def iter_columnar(header, rows, file_format, batch_size=ROW_GROUP_SIZE):
+    """
+    Encode a header and rows as a zstd-compressed Parquet or Arrow IPC file of
+    ``batch_size``-row row groups. Column types are inferred from every row,
+    so the rows are first read into a spool (see xlsx_response) one row group
+    at a time; integer columns holding a fraction anywhere become float64,
+    and columns with no values or mixed ones become text. The bytes of each
+    row group are then yielded as soon as it is written.
+    """
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    spool = tempfile.SpooledTemporaryFile(max_size=getattr(settings, 'EXPORT_SPOOL_MAX_SIZE', 10 * 1024 * 1024))
+    with spool:
+        rows = iter(rows)
+        types = [pa.null()] * len(header)
+        batch_count = 0
+        for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+            types = [_merged_type(pa, current, _column_type(pa, values)) for current, values in zip(types, zip(*batch))]
+            pickle.dump(batch, spool, pickle.HIGHEST_PROTOCOL)
+            batch_count += 1
+        schema = pa.schema([
+            (str(name), pa.string() if pa.types.is_null(column_type) else column_type)
+            for name, column_type in zip(header, types)
+        ])
+
+        sink = _ChunkSink()
+        if file_format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+        else:
+            writer = pyarrow.ipc.new_file(sink, schema, options=pyarrow.ipc.IpcWriteOptions(compression='zstd'))
+        spool.seek(0)
+        for _ in range(batch_count):
+            arrays = [
+                _column_array(pa, field.name, values, field.type)
+                for field, values in zip(schema, zip(*pickle.load(spool)))
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+
+def write_columnar(file, header, rows, file_format):
+    """Write a header and rows to a binary file as Parquet or Arrow IPC."""
+    for chunk in iter_columnar(header, rows, file_format):
+        file.write(chunk)
+
+
+def records_columnar_response(records, filename, file_format):
+    """Stream an iterator of dicts as a Parquet or Arrow IPC attachment, typed per column."""
+    def content():
+        columns, rows = split_records(records)
+        yield from iter_columnar(columns, rows, file_format)
+
+    response = StreamingHttpResponse(content(), content_type=COLUMNAR_CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_csv(file, header, rows):
+    """Write a header and rows to a binary file as UTF-8 CSV."""
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    for chunk in iter_csv(header, rows):
+        text.write(chunk)
+    text.flush()
+    # Leave the underlying file open for the caller
+    text.detach()
+
+
+def csv_response(queryset, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream a queryset as a CSV attachment with the same columns as its Excel export."""
+    fields = export_fields(queryset)
+    response = StreamingHttpResponse(
+        iter_csv(fields, iter_rows(queryset, fields, chunk_size), chunk_size),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def record_columns(records, exclude=()):
+    """Columns of a list of dicts in first-seen order, as pandas.DataFrame(records) would have them."""
+    columns = dict.fromkeys(key for record in records for key in record)
+    return [column for column in columns if column not in exclude]
+
+
+def iter_records(records, columns):
+    for record in records:
+        yield [record.get(column) for column in columns]
+
+
+def write_xlsx(file, header, rows):
+    """Write a header and rows to file as a single-sheet XLSX workbook, one row at a time."""
+    workbook = Workbook(write_only=True)
+    # Same sheet name as DataFrame.to_excel
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file)
+
+
+def xlsx_response(header, rows, filename):
+    """Return an XLSX attachment built from rows without holding the workbook in memory."""
+    file = tempfile.SpooledTemporaryFile(max_size=getattr(settings, 'EXPORT_SPOOL_MAX_SIZE', 10 * 1024 * 1024))
+    write_xlsx(file, header, rows)
+    file.seek(0)
+    # FileResponse streams the file in blocks and closes it when done
+    return FileResponse(file, as_attachment=True, filename=filename, content_type='application/vnd.ms-excel')
+
+
+def queryset_xlsx_response(queryset, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """Export a queryset as XLSX with the same columns as ``queryset.values()``."""
+    fields = export_fields(queryset)
+    return xlsx_response(fields, iter_rows(queryset, fields, chunk_size), filename)
+
+
+def hashed_rows(digest, header, rows):
+    """Pass rows through unchanged, feeding them and the header into digest."""
+    digest.update(repr(header).encode())
+    for row in rows:
+        digest.update(repr(row).encode())
+        yield row
+
+
+def rows_fingerprint(header, rows):
+    """Hash a header and rows, to tell whether an export's data has changed."""
+    digest = hashlib.md5()
+    for row in hashed_rows(digest, header, rows):
+        pass
+    return digest.hexdigest()
@@ -37,7 +37,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'customer_sales'
+    'customer_sales',
+    'telemetry',
+    'dashboards',
+    'export_jobs',
+    'payments',
 ]
 
 MIDDLEWARE = [
@@ -63,6 +67,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'powerpay.context_processors.charts',
             ],
         },
     },
@@ -153,6 +158,115 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_AGE = 1209600  # 2 weeks
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
+# Upstream appliapay.com API client (see powerpay/upstream.py)
+UPSTREAM = {
+    'RETRIES': 3,
+    'BACKOFF_FACTOR': 0.5,
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 20,
+    # Worker threads used to fan out independent upstream calls
+    'FANOUT_WORKERS': 8,
+    # (connect, read) timeouts in seconds
+    'DEFAULT_TIMEOUT': (3.05, 30),
+    'TIMEOUTS': {
+        'stkpush': (3.05, 15),
+        'stkpushscode': (3.05, 15),
+        'addDevice': (3.05, 15),
+        'getMeasurementData': (3.05, 120),
+        'migaaMeterDownload': (3.05, 120),
+    },
+}
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+}
 
+# TTL/stale-while-revalidate cache for upstream feeds (see powerpay/caching.py)
+UPSTREAM_CACHE = {
+    'DEFAULT_TTL': 60,
+    # How long an expired entry may still be served while it is refreshed
+    'STALE_TTL': 600,
+    # How long rendered chart fragments are kept for an unchanged data fingerprint
+    'FRAGMENT_TTL': 3600,
+    # How long the aggregated dashboard data built from the device data feeds is kept
+    'DASHBOARD_TTL': 60,
+    # Seconds per endpoint; 0 disables caching for that endpoint
+    'TTLS': {
+        # Multi-MB raw payloads, one per range; only their aggregates are cached (DASHBOARD_TTL)
+        'allDeviceDataDjango': 0,
+        'allDeviceDataScodeDjango': 0,
+        'allDeviceDataWelightDjango': 0,
+        'command': 30,
+        'commandScode': 30,
+        'commandWelight': 30,
+        'mpesarecords': 60,
+        'mpesarecordsscode': 60,
+        'paygoScode': 120,
+        'paygoScodeNonMetered': 120,
+        'getMeasurements': 300,
+        'getMeasurementData': 0,
+        'migaaMeterDownload': 0,
+    },
+}
 
+# Maximum points sent to the browser per time-series chart (see powerpay/charts.py)
+CHART_MAX_POINTS = 2000
+
+# Local telemetry store (see the telemetry app)
+TELEMETRY = {
+    # Serve homepage and device pages from locally ingested readings and rollups
+    'USE_LOCAL_STORE': False,
+    # Ranges up to this many minutes are answered from raw readings, longer ones from rollups
+    'RAW_RANGE_MINUTES': 1440,
+    # Extra minutes requested before each tenant's watermark by sync_telemetry; readings
+    # reaching upstream later than this behind the newest one need a deeper sync_telemetry --overlap
+    'SYNC_OVERLAP_MINUTES': 360,
+    # Upstream txtimes are local wall-clock times in this zone
+    'TXTIME_ZONE': 'Africa/Nairobi',
+}
+
+DASHBOARD_SNAPSHOTS = {
+    # Ranges (in minutes) precomputed by precompute_dashboards for each page:
+    # 24 hrs, 7 days, 1 month (as each page's range dropdown defines it) and all time
+    'RANGES': {
+        'home': [1440, 10080, 43200, 9999999],
+        'device': [1440, 10080, 40320, 9999999],
+    },
+    # Older snapshots are ignored and the range is computed live
+    'MAX_AGE': 1800,
+    # Devices precompute_dashboards fetches at once
+    'DEVICE_BATCH_SIZE': 8,
+}
+
+# XLSX exports are built in a temporary file kept in memory up to this size and spilled to disk beyond it
+EXPORT_SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+EXPORT_JOBS = {
+    # Run heavy exports through run_export_worker instead of inside the request;
+    # only turn this on where that command is deployed
+    'ENABLED': False,
+    # Finished jobs and their files are deleted after this many days
+    'KEEP_DAYS': 7,
+    # Running jobs older than this many seconds are marked failed
+    'RUNNING_TIMEOUT': 3600,
+}
+
+PAYMENTS = {
+    # STK push statuses older than this many seconds are ignored and deleted
+    'STATUS_TTL': 24 * 3600,
+    # The payment waiting page's event stream waits for a callback in its own process,
+    # re-reading the table this often (in seconds) for results recorded by other
+    # processes, and ends after STREAM_TIMEOUT seconds
+    'STREAM_POLL_INTERVAL': 15,
+    'STREAM_TIMEOUT': 60,
+    # Streams each process holds open at once; past this the page polls instead
+    'STREAM_MAX_OPEN': 20,
+    # Each run_campaign_worker sends through this many threads, starting at most this many prompts a second
+    'CAMPAIGN_WORKERS': 10,
+    'CAMPAIGN_RATE_PER_SECOND': 20,
+    # Prompts a worker claimed this many seconds ago without recording how sending went are marked failed
+    'CAMPAIGN_SENDING_TIMEOUT': 600,
+}
@@ -0,0 +1,113 @@
+"""
+A local stand-in for the appliapay upstream API, for tests.
+
+StubUpstream serves canned responses from an HTTP server on localhost and
+points powerpay.upstream at it for the duration of a ``with`` block. Each
+route is an endpoint name mapped to a payload, or to a function of the
+request's query params (or POSTed JSON) returning one. Dicts and lists are
+sent as JSON; bytes, or an iterable of bytes for streamed bodies, are sent
+as they are. ``delays`` holds seconds to sleep before answering an
+endpoint, and every request is recorded in ``requests``.
+
+Benchmarks are tests decorated with ``benchmark``; they are skipped unless
+the POWERPAY_BENCHMARKS environment variable is set.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import skipUnless
+from urllib.parse import parse_qsl, urlsplit
+
+from django.core.cache import cache
+
+from . import upstream
+
+benchmark = skipUnless(os.environ.get('POWERPAY_BENCHMARKS'), "set POWERPAY_BENCHMARKS=1 to run benchmarks")
+
+
+def timed(func, repeat=1):
+    """The best of ``repeat`` wall-clock timings of ``func()``, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+class StubUpstream:
+
+    def __init__(self, routes=None, delays=None):
+        self.routes = dict(routes or {})
+        self.delays = dict(delays or {})
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def calls(self, endpoint):
+        """The params of each request made to ``endpoint``, in order."""
+        with self._lock:
+            return [params for name, params in self.requests if name == endpoint]
+
+    def _respond(self, handler, endpoint, params):
+        with self._lock:
+            self.requests.append((endpoint, params))
+        time.sleep(self.delays.get(endpoint, 0))
+        if endpoint not in self.routes:
+            handler.send_error(404)
+            return
+        body = self.routes[endpoint]
+        if callable(body):
+            body = body(params)
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.end_headers()
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        if isinstance(body, bytes):
+            body = [body]
+        try:
+            for chunk in body:
+                handler.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading
+            pass
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # One response per connection, ended by closing it, so bodies of any length can be streamed
+            protocol_version = 'HTTP/1.0'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                stub._respond(self, url.path.strip('/'), dict(parse_qsl(url.query)))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                params = json.loads(self.rfile.read(length) or b'{}')
+                stub._respond(self, urlsplit(self.path).path.strip('/'), params)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._base_url = upstream.BASE_URL
+        upstream.BASE_URL = f'http://127.0.0.1:{self.server.server_port}/'
+        # Responses cached from earlier tests would hide the stub
+        cache.clear()
+        return self
+
+    def __exit__(self, *exc_info):
+        upstream.BASE_URL = self._base_url
+        self.server.shutdown()
+        self.server.server_close()
+        cache.clear()
@@ -0,0 +1,433 @@
+import io
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from customer_sales.models import Customer, Sale
+from dashboards import snapshots
+from dashboards.models import DashboardSnapshot
+from . import caching, exports, upstream, views
+from .testing import StubUpstream, benchmark, timed
+
+
+def device_data_payload(params):
+    return {
+        'totalkwh': 0.3,
+        'runtime': {'device1': 2.0},
+        'rawData': [
+            {'deviceID': 'device1', 'txtime': 20240101100000, 'kwh': 0.1},
+            {'deviceID': 'device1', 'txtime': 20240101100500, 'kwh': 0.2},
+        ],
+    }
+
+
+EMPTY_DEVICE_DATA = {'totalkwh': 0, 'runtime': 0, 'rawData': []}
+
+
+class FetchConcurrentlyTests(SimpleTestCase):
+
+    def test_latency_is_the_slowest_call(self):
+        routes = {'slow': {'n': 1}, 'slower': {'n': 2}, 'slowest': {'n': 3}}
+        with StubUpstream(routes, delays={'slow': 0.3, 'slower': 0.4, 'slowest': 0.5}):
+            start = time.perf_counter()
+            results = upstream.fetch_concurrently(
+                (upstream.get_json, ('slow',)), (upstream.get_json, ('slower',)), (upstream.get_json, ('slowest',)),
+            )
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(results, [{'n': 1}, {'n': 2}, {'n': 3}])
+        # Run one after another the calls would take 1.2 s
+        self.assertLess(elapsed, 0.9)
+
+    def test_exceptions_are_reraised(self):
+        with StubUpstream({'ok': {}}):
+            with self.assertRaises(Exception):
+                upstream.fetch_concurrently((upstream.get_json, ('ok',)), (upstream.get_json, ('missing',)))
+
+    def test_device_data_fetches_both_feeds_in_parallel(self):
+        routes = {'deviceDataDjangoo': {'runtime': 1}, 'command': [{'deviceID': 'device1'}]}
+        with StubUpstream(routes, delays={'deviceDataDjangoo': 0.5, 'command': 0.5}):
+            start = time.perf_counter()
+            data, devices = views.device_data('default', 'device1', 7)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual((data, devices), ({'runtime': 1}, [{'deviceID': 'device1'}]))
+        self.assertLess(elapsed, 0.9)
+
+
+class DashboardDataTests(SimpleTestCase):
+
+    def test_full_history_is_not_fetched_when_the_range_has_data(self):
+        with StubUpstream({'allDeviceDataDjango': device_data_payload}) as stub:
+            range, runtime, readings, fell_back = views.dashboard_data('default', 7)
+
+        self.assertEqual((range, fell_back), (7, False))
+        self.assertEqual(stub.calls('allDeviceDataDjango'), [{'range': '7'}])
+        self.assertAlmostEqual(readings['total_kwh'], 0.3)
+
+    def test_empty_range_falls_back_to_full_history(self):
+        def payload(params):
+            return EMPTY_DEVICE_DATA if params['range'] == '7' else device_data_payload(params)
+
+        with StubUpstream({'allDeviceDataDjango': payload}) as stub:
+            range, runtime, readings, fell_back = views.dashboard_data('default', 7)
+
+        self.assertEqual((range, fell_back), (9999999, True))
+        self.assertEqual(stub.calls('allDeviceDataDjango'), [{'range': '7'}, {'range': '9999999'}])
+        self.assertEqual(runtime, {'device1': 2.0})
+
+
+class DashboardCacheTests(TestCase):
+
+    def test_raw_device_data_is_not_cached_but_its_aggregate_is(self):
+        self.client.force_login(User.objects.create_user('staff'))
+        with StubUpstream({'allDeviceDataDjango': device_data_payload}) as stub:
+            for panel in views.DASHBOARD_PANELS:
+                self.assertEqual(self.client.get(reverse('dashboard_panel', args=[panel]), {'range': 7}).status_code, 200)
+            self.assertEqual(len(stub.calls('allDeviceDataDjango')), 1)
+            self.assertEqual(cache.get(caching.make_key('default', 'allDeviceDataDjango', {'range': 7})), None)
+
+
+class CachedBuildTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_build_once(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        threads = [threading.Thread(target=caching.cached_build, args=('key', 60, build)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(caching.cached_build('key', 60, build), 'value')
+
+    def test_lock_pool_does_not_grow_with_keys(self):
+        for minutes in range(1000):
+            caching.cached_build(f'dashboard:default:{minutes}', 60, lambda: minutes)
+        self.assertEqual(len(caching._build_locks), caching.BUILD_LOCK_STRIPES)
+
+
+def create_fleet(start, stop):
+    """One customer and one sale per device, with serial numbers SN{start:05d} to SN{stop - 1:05d}."""
+    customers = Customer.objects.bulk_create(
+        Customer(name=f'Customer {i}', id_number=str(i), phone_number=f'07{i:08d}', country='Kenya',
+                 location=f'Town {i % 50}', gender='FM'[i % 2], household_type='F', household_size=i % 8 + 1,
+                 preferred_language='EN')
+        for i in range(start, stop)
+    )
+    Sale.objects.bulk_create(
+        Sale(customer=customer, registration_date='2024-01-01', product_type='EPC', product_name='EPC',
+             product_model='m', product_serial_number=f'SN{i:05d}', purchase_mode='P', sales_rep=f'Rep {i % 20}')
+        for i, customer in enumerate(customers, start)
+    )
+
+
+def synthetic_readings(devices, count):
+    """``count`` readings spread over ``devices`` devices, one a minute per device from 2024-01-01."""
+    minutes = (i // devices for i in range(count))
+    return [
+        {'deviceID': f'SN{i % devices:05d}', 'txtime': 20240101000000 + minute // 60 * 10**4 + minute % 60 * 100,
+         'kwh': 0.01}
+        for i, minute in enumerate(minutes)
+    ]
+
+
+class LinkAllDataAndKwhBenchmark(TestCase):
+
+    @benchmark
+    def test_scales_linearly_to_10k_sales_and_1m_readings(self):
+        timings = {}
+        for sales, readings in ((1000, 100000), (10000, 1000000)):
+            create_fleet(Sale.objects.count(), sales)
+            raw = synthetic_readings(sales, readings)
+
+            def link():
+                aggregated = views.aggregate_readings(raw)
+                return views.linkAllDataAndKwh(False, aggregated['meals'], aggregated['device_kwh'])
+
+            linked = link()
+            timings[sales] = timed(link, repeat=3)
+            self.assertEqual(sum(row['meals_cooked'] > 0 for row in linked), sales)
+            print(f"\nlinkAllDataAndKwh: {sales} sales x {readings} readings: {timings[sales] * 1000:.0f} ms")
+
+        # Ten times the data: about ten times the time when linear, a hundred when quadratic
+        self.assertLess(timings[10000] / timings[1000], 20)
+
+
+class DemographicsModelSelectionTests(TestCase):
+
+    def test_tables_follow_the_first_name_not_the_tenant(self):
+        self.assertTrue(views.uses_test_models(User(username='staff', first_name='Welight')))
+        # The Welight username maps to the welight tenant, which alone doesn't choose the test tables
+        self.assertFalse(views.uses_test_models(User(username='Welight', first_name='')))
+
+        create_fleet(0, 1)
+        linked = views.linkAllDataAndKwh(False, {}, {'SN00000': 1.5})
+        self.assertEqual([(row['product_serial_number'], row['kwh']) for row in linked], [('SN00000', 1.5)])
+
+    def test_snapshot_demographics_are_not_served_to_welight_users(self):
+        snapshots.store_snapshot('default', DashboardSnapshot.HOME, 1440, {
+            'selected_range': '1440', 'fell_back': False, 'panels': {'demographics': 'snapshot'},
+        })
+        url = reverse('dashboard_panel', args=['demographics'])
+
+        self.client.force_login(User.objects.create_user('staff'))
+        self.assertEqual(self.client.get(url, {'range': 1440}).json()['fragments'], 'snapshot')
+
+        self.client.force_login(User.objects.create_user('welight-staff', first_name='Welight'))
+        with StubUpstream({'allDeviceDataDjango': device_data_payload}):
+            with mock.patch.object(views, 'linkAllDataAndKwh', return_value=[]) as link:
+                response = self.client.get(url, {'range': 1440}).json()
+        self.assertIsNone(response['computed_at'])
+        self.assertIs(link.call_args.args[0], True)
+
+
+def meter_records(count, chunks=1, delay=0):
+    """A JSON array of ``count`` meter records, sent in ``chunks`` pieces ``delay`` seconds apart."""
+    records = [{'meter': f'M{i % 100}', 'txtime': 20240101000000 + i, 'kwh': i / 1000} for i in range(count)]
+    per_chunk = -(-count // chunks)
+    yield b'['
+    for start in range(0, count, per_chunk):
+        time.sleep(delay)
+        chunk = ','.join(json.dumps(record) for record in records[start:start + per_chunk])
+        yield (b',' if start else b'') + chunk.encode()
+    yield b']'
+
+
+class RecordsCsvTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff'))
+
+    def test_rows_are_sent_before_the_upstream_body_finishes(self):
+        with StubUpstream({'migaaMeterDownload': lambda params: meter_records(100000, chunks=20, delay=0.1)}):
+            start = time.perf_counter()
+            content = iter(self.client.get(reverse('export_meter_data')).streaming_content)
+            first = next(content)
+            first_byte = time.perf_counter() - start
+            content = first + b''.join(content)
+            elapsed = time.perf_counter() - start
+
+        # The upstream body takes 2 s to arrive
+        self.assertLess(first_byte, 1)
+        self.assertGreater(elapsed, 1.9)
+        frame = pd.read_csv(io.BytesIO(content))
+        expected = pd.DataFrame(list(json.loads(b''.join(meter_records(100000)))))
+        pd.testing.assert_frame_equal(frame, expected, check_dtype=False)
+
+    def test_columns_are_the_keys_of_the_first_records(self):
+        records = [{'a': 1}, {'b': 2, 'a': 3}, {'a': 4}]
+        columns, rows = exports.split_records(iter(records), sample_size=2)
+        self.assertEqual((columns, list(rows)), (['a', 'b'], [[1, None], [3, 2], [4, None]]))
+
+    def test_keys_first_seen_after_the_sample_fail_the_export(self):
+        columns, rows = exports.split_records(iter([{'a': 1}, {'a': 2}, {'a': 3, 'late': 4}]), sample_size=2)
+        with self.assertRaisesMessage(ValueError, "Record 3 has keys ['late']"):
+            list(rows)
+
+    def test_empty_stream(self):
+        columns, rows = exports.split_records(iter(()))
+        self.assertEqual((columns, list(rows)), ([], []))
+
+
+class ColumnarExportTests(SimpleTestCase):
+
+    def read(self, header, rows, file_format, batch_size):
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        content = io.BytesIO(b''.join(exports.iter_columnar(header, rows, file_format, batch_size)))
+        if file_format == 'parquet':
+            return pyarrow.parquet.read_table(content)
+        return pyarrow.ipc.open_file(content).read_all()
+
+    def test_fractions_after_the_first_row_group_round_trip(self):
+        rows = [[i, value] for i, value in enumerate([0, 0, 0, 0, 0.5, 2.75])]
+        for file_format in exports.COLUMNAR_CONTENT_TYPES:
+            with self.subTest(file_format=file_format):
+                table = self.read(['i', 'v'], rows, file_format, batch_size=4)
+                self.assertEqual(table.column('v').to_pylist(), [0, 0, 0, 0, 0.5, 2.75])
+                self.assertEqual(table.column('i').to_pylist(), list(range(6)))
+                self.assertEqual([str(field.type) for field in table.schema], ['int64', 'double'])
+
+    def test_integer_columns_stay_integers(self):
+        rows = [[i, 20240101000000 + i, 2**53 + i, None] for i in range(6)]
+        for file_format in exports.COLUMNAR_CONTENT_TYPES:
+            with self.subTest(file_format=file_format):
+                table = self.read(['id', 'txtime', 'big', 'empty'], rows, file_format, batch_size=4)
+                self.assertEqual([str(field.type) for field in table.schema], ['int64', 'int64', 'int64', 'string'])
+                self.assertEqual(table.column('big').to_pylist(), [2**53 + i for i in range(6)])
+
+    def test_mixed_columns_are_written_as_text(self):
+        table = self.read(['v'], [[1.5], [2.5], ['n/a']], 'parquet', batch_size=2)
+        self.assertEqual(table.column('v').to_pylist(), ['1.5', '2.5', 'n/a'])
+
+    def test_empty_export(self):
+        self.assertEqual(self.read(['a'], [], 'arrow', batch_size=2).num_rows, 0)
+
+
+def reference_classify_and_count_meals(data):
+    """classify_and_count_meals as it was before it was vectorized, kept to check the new one against."""
+    sorted_data = sorted(data, key=lambda x: (x['deviceID'], x['txtime']))
+    device_meal_counts = {}
+    day_meal_counts = {}
+
+    for entry in sorted_data:
+        if entry['deviceID'] != 'OfficeFridge1':
+            device_id = entry['deviceID']
+            txtime = datetime.strptime(str(entry['txtime']), "%Y%m%d%H%M%S")
+
+            if device_id not in device_meal_counts:
+                device_meal_counts[device_id] = {'count': 0, 'last_txtime': None}
+            if device_meal_counts[device_id]['last_txtime'] is not None:
+                time_diff = txtime - device_meal_counts[device_id]['last_txtime']
+                if time_diff > timedelta(minutes=20):
+                    device_meal_counts[device_id]['count'] += 1
+            else:
+                device_meal_counts[device_id]['count'] += 1
+
+            date = txtime.strftime('%Y-%m-%d')
+            if date not in day_meal_counts:
+                day_meal_counts[date] = {}
+            if device_id not in day_meal_counts[date]:
+                day_meal_counts[date][device_id] = 0
+            if 'last_txtime' in day_meal_counts[date]:
+                time_diff = txtime - day_meal_counts[date]['last_txtime']
+                if time_diff > timedelta(minutes=20):
+                    day_meal_counts[date][device_id] += 1
+            else:
+                day_meal_counts[date][device_id] += 1
+
+            device_meal_counts[device_id]['last_txtime'] = txtime
+            day_meal_counts[date]['last_txtime'] = txtime
+
+    total_meals_per_day = {date: sum(count for device, count in counts.items() if device != 'last_txtime') for date, counts in day_meal_counts.items()}
+    return device_meal_counts, total_meals_per_day
+
+
+def random_readings(count, seed=0):
+    """Shuffled readings with gaps around the 20 minute threshold, across midnights, month ends and a leap day."""
+    rng = random.Random(seed)
+    devices = [f'device{i}' for i in range(12)] + ['OfficeFridge1']
+    steps = [0, 30, 60, 600, 1199, 1200, 1201, 1260, 3600, 6 * 3600, 86400]
+    clocks = {device: datetime(2023, 12, 28, 22) + timedelta(minutes=rng.randrange(600)) for device in devices}
+    readings = []
+    for _ in range(count):
+        device = rng.choice(devices)
+        clocks[device] += timedelta(seconds=rng.choice(steps))
+        readings.append({'deviceID': device, 'txtime': int(clocks[device].strftime('%Y%m%d%H%M%S')), 'kwh': 0.01})
+    rng.shuffle(readings)
+    return readings
+
+
+class ClassifyAndCountMealsTests(SimpleTestCase):
+
+    def assertSameMeals(self, data):
+        device_meal_counts, total_meals_per_day = views.classify_and_count_meals(data)
+        expected_devices, expected_days = reference_classify_and_count_meals(data)
+        # Same keys in the same order, not only equal dicts
+        self.assertEqual(list(device_meal_counts.items()), list(expected_devices.items()))
+        self.assertEqual(list(total_meals_per_day.items()), list(expected_days.items()))
+
+    def test_matches_the_row_by_row_implementation(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                self.assertSameMeals(random_readings(2000, seed))
+
+    def test_edge_cases(self):
+        self.assertSameMeals([])
+        self.assertSameMeals([{'deviceID': 'OfficeFridge1', 'txtime': 20240101100000, 'kwh': 1}])
+        self.assertSameMeals([
+            {'deviceID': 'b', 'txtime': 20240229235500, 'kwh': 1},
+            {'deviceID': 'a', 'txtime': 20240301000500, 'kwh': 1},
+            {'deviceID': 'a', 'txtime': 20240229235000, 'kwh': 1},
+            {'deviceID': 'a', 'txtime': 20240301001000, 'kwh': 1},
+            {'deviceID': 'b', 'txtime': 20240229235500, 'kwh': 1},
+            {'deviceID': 'b', 'txtime': 20240301001501, 'kwh': 1},
+        ])
+
+    def test_aggregate_readings_counts_the_same_meals(self):
+        data = random_readings(2000)
+        readings = views.aggregate_readings(data)
+        self.assertEqual((readings['meals'], readings['meals_per_day']), reference_classify_and_count_meals(data))
+
+    @benchmark
+    def test_speedup_on_a_million_readings(self):
+        data = random_readings(1000000)
+        reference = timed(lambda: reference_classify_and_count_meals(data))
+        vectorized = timed(lambda: views.classify_and_count_meals(data), repeat=3)
+        print(f"\nclassify_and_count_meals, 1M readings: row by row {reference * 1000:.0f} ms, "
+              f"vectorized {vectorized * 1000:.0f} ms ({reference / vectorized:.1f}x)")
+        self.assertGreater(reference / vectorized, 10)
+
+
+def linked_frame(rows, seed=0):
+    """A frame shaped like the linked sales the demographics panel classifies, with some missing values."""
+    rng = np.random.default_rng(seed)
+    records = [
+        {
+            'household_type': household_type, 'household_size': int(household_size), 'country': country,
+            'location': location, 'sales_rep': sales_rep, 'gender': gender, 'meals_cooked': int(meals),
+            'kwh': float(kwh),
+        }
+        for household_type, household_size, country, location, sales_rep, gender, meals, kwh in zip(
+            rng.choice(['F', 'M', 'S'], rows), rng.integers(1, 9, rows), rng.choice(['Kenya', 'Uganda', 'Tanzania'], rows),
+            rng.choice([f'Town {i}' for i in range(300)], rows), rng.choice([f'Rep {i}' for i in range(40)], rows),
+            rng.choice(['F', 'M'], rows), rng.integers(0, 50, rows), rng.random(rows),
+        )
+    ]
+    for record in records[::97]:
+        record['location'] = None
+        record['gender'] = None
+    return pd.DataFrame(records)
+
+
+def groupby_classifications(data):
+    """The totals as plot_classifications computed them before, one groupby per dimension and measure."""
+    return {
+        (dimension, measure): data.groupby(dimension)[measure].sum()
+        for dimension in views.CLASSIFICATION_DIMENSIONS for measure in views.CLASSIFICATION_MEASURES
+    }
+
+
+class ClassificationTotalsTests(SimpleTestCase):
+
+    def test_matches_one_groupby_per_dimension_and_measure(self):
+        data = linked_frame(5000)
+        totals = views.classification_totals(data)
+        for (dimension, measure), expected in groupby_classifications(data).items():
+            with self.subTest(dimension=dimension, measure=measure):
+                result = totals.loc[dimension, measure]
+                self.assertEqual(list(result.index), list(expected.index))
+                np.testing.assert_allclose(result.to_numpy(dtype='float64'), expected.to_numpy(dtype='float64'))
+        self.assertEqual(totals['meals_cooked'].dtype, 'int64')
+
+    def test_empty_frame(self):
+        self.assertTrue(views.classification_totals(pd.DataFrame()).empty)
+
+    @benchmark
+    def test_100k_linked_rows(self):
+        data = linked_frame(100000)
+        groupby = timed(lambda: groupby_classifications(data), repeat=5)
+        one_pass = timed(lambda: views.classification_totals(data), repeat=5)
+        print(f"\nclassifications, 100k linked rows: 12 groupbys {groupby * 1000:.1f} ms, "
+              f"classification_totals {one_pass * 1000:.1f} ms ({groupby / one_pass:.1f}x)")
+        self.assertLess(one_pass, groupby)
@@ -0,0 +1,182 @@
+"""
+Shared HTTP client for the appliapay.com upstream API.
+
+All views talk to appliapay through this module so that connections are
+pooled and kept alive between requests, every call has a connect/read
+timeout, and idempotent GETs are retried with backoff.
+"""
+import codecs
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+# Constants
+BASE_URL = "https://appliapay.com/"
+AUTH = HTTPBasicAuth('admin', '123Give!@#')
+
+DEFAULT_TIMEOUT = (3.05, 30)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _build_session():
+    config = getattr(settings, 'UPSTREAM', {})
+    # Only GETs are retried on read errors and 5xx; POSTs (STK push, add device)
+    # are not idempotent so urllib3 leaves them alone.
+    retry = Retry(
+        total=config.get('RETRIES', 3),
+        backoff_factor=config.get('BACKOFF_FACTOR', 0.5),
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry,
+        pool_connections=config.get('POOL_CONNECTIONS', 4),
+        pool_maxsize=config.get('POOL_MAXSIZE', 20),
+    )
+    session = requests.Session()
+    session.auth = AUTH
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+session = _build_session()
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'UPSTREAM', {}).get('FANOUT_WORKERS', 8),
+    thread_name_prefix='upstream',
+)
+
+
+def get_tenant(usr):
+    """Map a dashboard username onto the upstream tenant whose feeds it sees."""
+    if usr == 'John-Maina':
+        return 'scode'
+    elif usr == 'Welight':
+        return 'welight'
+    return 'default'
+
+
+def command_endpoint(tenant):
+    if tenant == 'scode':
+        return "commandScode"
+    elif tenant == 'welight':
+        return "commandWelight"
+    return "command"
+
+
+def get_timeout(endpoint):
+    """Return the (connect, read) timeout configured for an endpoint."""
+    config = getattr(settings, 'UPSTREAM', {})
+    timeouts = config.get('TIMEOUTS', {})
+    return timeouts.get(endpoint, config.get('DEFAULT_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def get(endpoint, params=None, **kwargs):
+    return session.get(BASE_URL + endpoint, params=params, timeout=get_timeout(endpoint), **kwargs)
+
+
+def post(endpoint, payload, **kwargs):
+    return session.post(BASE_URL + endpoint, json=payload, timeout=get_timeout(endpoint), **kwargs)
+
+
+def get_json(endpoint, params=None):
+    response = get(endpoint, params)
+    response.raise_for_status()
+    return response.json()
+
+
+def iter_json_array(chunks):
+    """
+    Decode the elements of a JSON array from an iterable of byte chunks,
+    yielding each element as soon as it is complete. Only the undecoded tail
+    of the stream is buffered, so memory is bounded by the chunk size and the
+    largest single element.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    chunks = iter(chunks)
+    done = False
+
+    while True:
+        # Skip whitespace and separators up to the next element
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if not started and pos < len(buffer):
+            if buffer[pos] != '[':
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if started and pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        if pos < len(buffer):
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+            # A value not yet followed by a delimiter (a number cut off at
+            # the end of a chunk, say) may continue in the next chunk
+            if end is not None and (done or (end < len(buffer) and buffer[end] in ' \t\r\n,]')):
+                yield element
+                pos = end
+                continue
+        if done:
+            raise ValueError("Malformed or truncated JSON array")
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            done = True
+            buffer = buffer[pos:] + text.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + text.decode(chunk)
+        pos = 0
+
+
+def stream_json_array(endpoint, params=None):
+    """
+    Start a GET whose response is a JSON array and return an iterator over
+    its elements, decoded as the body arrives. HTTP errors are raised here,
+    before any element is read.
+    """
+    response = get(endpoint, params, stream=True)
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        response.close()
+        raise
+
+    def elements():
+        try:
+            yield from iter_json_array(response.iter_content(STREAM_CHUNK_SIZE))
+        finally:
+            response.close()
+
+    return elements()
+
+
+def post_json(endpoint, payload):
+    response = post(endpoint, payload)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_concurrently(*calls):
+    """
+    Run independent upstream calls in parallel and return their results in
+    the order given. Each call is a ``(function, args)`` tuple; the first
+    exception raised by any call is re-raised here.
+    """
+    futures = [_executor.submit(func, *args) for func, args in calls]
+    return [future.result() for future in futures]
@@ -26,6 +26,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('customer_sales/', include('customer_sales.urls'), name="customers"),
     path('', views.homepage, name='home_page'),
+    path('dashboard/<str:panel>/', views.dashboard_panel, name='dashboard_panel'),
     path('add-device/', views.add_device, name='add_device'),
     path('transactions/', views.transactions_page, name='transactions_page'),
     path('export/excel/', views.export_transactions_excel, name='export_transactions'),
@@ -34,10 +35,15 @@ urlpatterns = [
     path('payment_waiting/<str:ref>', views.payment_waiting, name='payment_waiting'),
     path('payment_confirmation', views.payment_confirmation, name='payment_confirmation'),
     path('payment_confirmation_status', views.payment_confirmation_status, name='payment_confirmation_status'),
+    path('payment_status_stream', views.payment_status_stream, name='payment_status_stream'),
     path('payment_confirmation_page/', views.payment_confirmation_page, name='payment_confirmation_page'),
+    path('payment_campaign', views.payment_campaign_start, name='payment_campaign_start'),
+    path('payment_campaign/<int:pk>/', views.payment_campaign, name='payment_campaign'),
     path('devices/', views.devices_page, name='devices_page'),
     path('device/<str:device_id>/', views.device_data_page, name='device_data_page'),
     path('export/device_data/<str:device_id>/', views.export_device_data, name='export_device_data'),
+    path('cache-stats/', views.cache_stats_view, name='cache_stats'),
+    path('exports/', include('export_jobs.urls')),
     path('export/ml-data/', views.export_ml_dataset, name='export_ml_data'),
     path('export/<str:set>/', views.export_ml, name='export_ml'),
     path('accounts/', include('django.contrib.auth.urls')),
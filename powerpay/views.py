@@ -1,44 +1,62 @@
-from django.shortcuts import render, redirect
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render, redirect
 import requests
-from requests.auth import HTTPBasicAuth
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
-import plotly.io as pio
 from django.core.paginator import Paginator
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import JsonResponse, Http404
+from django.template.defaultfilters import floatformat
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 import json
-from django.http import HttpResponse
+import threading
+import time
+from array import array
+from collections import defaultdict
+from urllib.parse import urlencode
+from django.http import HttpResponse, StreamingHttpResponse
 from customer_sales.models import Customer, Sale, TestCustomer, TestSale
-
-# Constants
-BASE_URL = "https://appliapay.com/"
-AUTH = HTTPBasicAuth('admin', '123Give!@#')
-# At the top of your views.py file
-payment_status = {
-    "status": "pending",
-    "message": "",
-    "amount": None,
-    "receipt_number": None,
-    "transaction_date": None,
-    "phone_number": None
-}
-
-
-def fetch_data(endpoint):
-    response = requests.get(BASE_URL + endpoint, auth=AUTH)
-    response.raise_for_status()
-    return response.json()
-
-def fetch_data_index(endpoint, range):
-    response = requests.get(BASE_URL + endpoint+"?range="+str(range), auth=AUTH)
-    response.raise_for_status()
-    return response.json()
+from dashboards import snapshots
+from dashboards.models import DashboardSnapshot
+from export_jobs import jobs as export_jobs
+from export_jobs.models import ExportJob
+from payments import callbacks as payment_callbacks
+from payments import campaigns as payment_campaigns
+from payments import store as payment_store
+from payments.models import PaymentCampaign, PaymentStatus
+from telemetry import queries as telemetry_store
+from telemetry.sync import DEVICE_DATA_ENDPOINTS
+from . import upstream
+from .upstream import command_endpoint, get_tenant, fetch_concurrently
+from .caching import cached_get_json, cached_fragments, cached_build, cache_stats, fingerprint, get_dashboard_ttl
+from .exports import (
+    COLUMNAR_CONTENT_TYPES, columnar_available, record_columns, iter_records, records_columnar_response,
+    records_csv_response, xlsx_response,
+)
+from .charts import render_chart, get_max_points, bucket_sum, lttb
+
+
+def fetch_data(endpoint, tenant='default'):
+    return cached_get_json(endpoint, tenant=tenant)
+
+def fetch_data_index(endpoint, range, tenant='default'):
+    return cached_get_json(endpoint, {'range': range}, tenant=tenant)
+
+
+def parse_range(value):
+    """Minutes in a ``range`` query param, or None if it isn't a whole number of minutes."""
+    try:
+        minutes = int(value)
+    except (TypeError, ValueError):
+        return None
+    return minutes if minutes >= 0 else None
 
 
 def login_page(request):
@@ -59,158 +77,276 @@ def logout_page(request):
 
 @login_required
 def homepage(request):
-    usr = request.user.username
     range = request.GET.get('range', 9999999)
 
-    def fetch_and_process_data(range):
-        if usr == 'John-Maina':
-            data = fetch_data_index("allDeviceDataScodeDjango", range)
-        elif usr == 'Welight':
-            data = fetch_data_index("allDeviceDataWelightDjango", range)
-        else:
-            data = fetch_data_index("allDeviceDataDjango", range)
+    # Only the shell is rendered here; the browser fetches each panel from
+    # dashboard_panel in parallel
+    context = {
+        'selected_range': str(range),
+        'panel_urls': [(panel, reverse('dashboard_panel', args=[panel])) for panel in DASHBOARD_PANELS],
+    }
+    return render(request, 'index.html', context)
+
 
+def dashboard_data(tenant, range):
+    """
+    Return ``(range, runtime, readings, fell_back)`` for the dashboard. If the
+    selected range has no data the default range is used instead.
+    """
+    def process_data(data):
         # Check if the data response is empty
         if data['totalkwh'] == 0 and data['runtime'] == 0 and not data['rawData']:
             return None
 
-        runtime = data['runtime']
-        raw_data = data['rawData']
-        df = pd.DataFrame(raw_data)
-        data_list = df.to_dict(orient='records')
-        meals, mls = classify_and_count_meals(data_list)
-        morning, afternoon, night = categorize_kwh(data_list)
-        return runtime, data_list, meals, morning, afternoon, night
-    
-    processed_data = fetch_and_process_data(range)
+        return data['runtime'], aggregate_readings(data['rawData'])
+
+    use_local_store = telemetry_store.is_enabled(tenant)
+    if use_local_store:
+        # Answer from the local telemetry store instead of the raw upstream payload
+        processed_data = local_dashboard_data(tenant, range)
+    else:
+        endpoint = DEVICE_DATA_ENDPOINTS[tenant]
+        processed_data = process_data(fetch_data_index(endpoint, range, tenant))
 
-    # If no data is returned, refetch with default range
-    if not processed_data:
-        messages.warning(request, 'No data for the selected range. Showing default data.')
+    # If no data is returned, fall back to the default range
+    fell_back = not processed_data
+    if fell_back:
         range = 9999999
-        processed_data = fetch_and_process_data(range)
-    
-    runtime, data_list, meals, morning, afternoon, night = processed_data
+        if use_local_store:
+            processed_data = local_dashboard_data(tenant, range)
+        else:
+            # Only fetched when needed: the full history is the heaviest payload upstream serves
+            processed_data = process_data(fetch_data_index(endpoint, range, tenant))
 
-    meal_counts = [info['count'] for device_id, info in meals.items()]
-    sumKwh = sum(x['kwh'] for x in data_list)
-    sumRuntime = sum(runtime.values())
-    sumMeals = sum(meal_counts)
+    runtime, readings = processed_data
+    return range, runtime, readings, fell_back
+
+
+def totals_panel(tenant, range, runtime, readings):
+    sumKwh = readings['total_kwh']
+    return {
+        'sumKwh': floatformat(sumKwh, 2),
+        'sumEnergyCost': floatformat(sumKwh * 23.0, 1),
+        'sumRuntime': floatformat(sum(runtime.values()), 1),
+        'sumMeals': str(sum(info['count'] for info in readings['meals'].values())),
+        'sumEmissions': floatformat(sumKwh * 0.28 * 0.4999, 2),
+    }
+
+
+def readings_fingerprint(readings, runtime):
+    return fingerprint(readings['deviceID'], readings['txtime'], readings['kwh'], runtime)
+
+
+def devices_panel(tenant, range, runtime, readings):
+    # Chart fragments are rebuilt only when the underlying data changes
+    return cached_fragments(
+        'devices', tenant, range, readings_fingerprint(readings, runtime),
+        lambda: generate_device_charts(readings, runtime),
+    )
+
+
+def time_of_day_panel(tenant, range, runtime, readings):
+    return cached_fragments(
+        'time_of_day', tenant, range, readings_fingerprint(readings, runtime),
+        lambda: generate_time_of_day_charts(readings),
+    )
+
+
+def timeseries_panel(tenant, range, runtime, readings):
+    return cached_fragments(
+        'timeseries', tenant, range, readings_fingerprint(readings, runtime),
+        lambda: {'line_chart': render_chart(create_line_chart(readings_frame(readings), 'txtime', 'kwh', 'Energy Consumption'))},
+    )
+
+
+def demographics_panel(tenant, range, runtime, readings, test_models=False):
+    # Link meal data and kWh data with sales and customer data
+    linked_data = pd.DataFrame(linkAllDataAndKwh(test_models, readings['meals'], readings['device_kwh']))
 
-    charts = generate_charts(data_list, runtime, meals, morning, afternoon, night)
-    
-    # Step 1: Link meal data and kWh data with sales and customer data
-    linked_data = linkAllDataAndKwh(request, meals, data_list)
-    linked_data = pd.DataFrame(linked_data)
-    
     # Generate meal and kWh classifications
-    locations, countries, genders, household_size, household_type, sales_reps, locations_kwh, countries_kwh, genders_kwh, household_size_kwh, household_type_kwh, sales_reps_kwh = plot_classifications(linked_data)
+    return cached_fragments(
+        'demographics', tenant, range, fingerprint(linked_data), lambda: plot_classifications(linked_data),
+    )
 
-    # Output result
-    context = {
-        'line_chart': charts['line_chart'],
-        'pie_chart': charts['pie_chart'],
-        'meals_pie_html': charts['meals_pie_html'],
-        'meals_kwh_html': charts['meals_kwh_html'],
-        'cooking_time_pie_html': charts['cooking_time_pie_html'],
-        'meals_emissions_html': charts['meals_emissions_html'],
-        'pie_chart_emissions': charts['pie_chart_emissions'],
-        'sumKwh': sumKwh,
-        'sumRuntime': sumRuntime,
-        'sumEmissions': sumKwh * 0.28 * 0.4999,
-        'sumEnergyCost': sumKwh * 23.0,
-        'sumMeals': sumMeals,
+
+# Homepage panels, in the order the browser requests them
+DASHBOARD_PANELS = {
+    'totals': totals_panel,
+    'devices': devices_panel,
+    'time_of_day': time_of_day_panel,
+    'demographics': demographics_panel,
+    'timeseries': timeseries_panel,
+}
+
+
+def dashboard_snapshot(tenant, range):
+    """Build every homepage panel for a tenant and range, for dashboards.snapshots."""
+    range, runtime, readings, fell_back = dashboard_data(tenant, range)
+    return {
         'selected_range': str(range),
-        'meals': meals,
-        'linked_data': linked_data,
-        'location_graph': locations,
-        'countries_graph': countries,
-        'genders_graph': genders,
-        'household_size_graph': household_size,
-        'household_type_graph': household_type,
-        'sales_reps_graph': sales_reps,
-        'location_graph_kwh': locations_kwh,
-        'countries_graph_kwh': countries_kwh,
-        'genders_graph_kwh': genders_kwh,
-        'household_size_graph_kwh': household_size_kwh,
-        'household_type_graph_kwh': household_type_kwh,
-        'sales_reps_graph_kwh': sales_reps_kwh
+        'fell_back': fell_back,
+        'panels': {panel: build(tenant, range, runtime, readings) for panel, build in DASHBOARD_PANELS.items()},
     }
 
-    return render(request, 'index.html', context)
+
+@login_required
+def dashboard_panel(request, panel):
+    build = DASHBOARD_PANELS.get(panel)
+    if build is None:
+        raise Http404("Unknown dashboard panel")
+
+    tenant = get_tenant(request.user.username)
+    range = parse_range(request.GET.get('range', 9999999))
+    if range is None:
+        return JsonResponse({"error": "Invalid range"}, status=400)
+
+    # Demographics follow the user's customer tables rather than the tenant, and snapshots hold the default ones
+    options = {'test_models': True} if panel == 'demographics' and uses_test_models(request.user) else {}
+
+    # Standard ranges are served from the precomputed snapshot while it is fresh
+    snapshot = None if options else snapshots.get_snapshot(tenant, DashboardSnapshot.HOME, range)
+    if snapshot is not None:
+        selected_range = snapshot.payload['selected_range']
+        fell_back = snapshot.payload['fell_back']
+        fragments = snapshot.payload['panels'][panel]
+        computed_at = snapshot.computed_at.isoformat()
+    else:
+        # Panels are requested together, so they share one cached aggregation
+        range, runtime, readings, fell_back = cached_build(
+            f"dashboard:{tenant}:{range}", get_dashboard_ttl(), lambda: dashboard_data(tenant, range),
+        )
+        selected_range = str(range)
+        fragments = build(tenant, range, runtime, readings, **options)
+        computed_at = None
+
+    return JsonResponse({
+        'panel': panel,
+        'selected_range': selected_range,
+        'warning': 'No data for the selected range. Showing default data.' if fell_back else None,
+        'fragments': fragments,
+        'computed_at': computed_at,
+    })
+
+
+def local_dashboard_data(tenant, range):
+    """Build the homepage aggregates from the local telemetry store."""
+    since = telemetry_store.range_start(range)
+    if telemetry_store.use_raw_readings(range):
+        raw_data = telemetry_store.readings_since(tenant, since)
+        if not raw_data:
+            return None
+        return telemetry_store.runtime_since(tenant, since), aggregate_readings(raw_data)
+    return telemetry_store.rollup_aggregate(tenant, since)
 
 
-def linkAllDataAndKwh(request, devData, kwhData):
-    user = request.user
-    # Choose the model based on user
-    CustomerModel = TestCustomer if user.first_name == 'Welight' else Customer
-    customer_data = CustomerModel.objects.all().values()
-    SaleModel = TestSale if user.first_name == 'Welight' else Sale
-    sales_data = SaleModel.objects.all().values()
-    linked_data = []
+def uses_test_models(user):
+    return user.first_name == 'Welight'
 
-    # Step 1: Link meals data with sales data
+
+def linkAllDataAndKwh(test_models, devData, kwhData):
+    # devData maps serial number -> meals, kwhData maps deviceID -> summed kWh
+    # Choose the model based on user (see uses_test_models)
+    CustomerModel = TestCustomer if test_models else Customer
+    SaleModel = TestSale if test_models else Sale
+
+    # Only pull the columns plot_classifications groups on
+    customers = {
+        customer['id']: customer
+        for customer in CustomerModel.objects.values('id', 'country', 'location', 'gender', 'household_type', 'household_size')
+    }
+    sales_data = SaleModel.objects.values('customer_id', 'product_serial_number', 'sales_rep')
+
+    linked_data = []
     for sale in sales_data:
+        customer = customers.get(sale['customer_id'])
+        if customer is None:
+            continue
         serial_number = sale['product_serial_number']
-        meals_cooked = 0
-        last_txtime = None
-        matched_kwh = 0
-
-        # Find the matching deviceID in the meals and kWh data
-        for device in devData:
-            if device == serial_number:
-                meals_cooked = devData[device]['count']
-                last_txtime = devData[device]['last_txtime']
-                break
-        
-        for device in kwhData:
-            if device['deviceID'] == serial_number:
-                matched_kwh = device['kwh']
-                break
-
-        sale['meals_cooked'] = meals_cooked
-        sale['last_txtime'] = last_txtime
-        sale['kwh'] = matched_kwh
+        device = devData.get(serial_number, {})
 
-        # Step 2: Link sales data with customer data
-        for customer in customer_data:
-            if customer['id'] == sale['customer_id']:
-                linked_entry = {**sale, **customer}  # Merge the dictionaries
-                linked_data.append(linked_entry)
+        sale['meals_cooked'] = device.get('count', 0)
+        sale['last_txtime'] = device.get('last_txtime')
+        sale['kwh'] = kwhData.get(serial_number, 0)
+        linked_data.append({**sale, **customer})  # Merge the dictionaries
 
     return linked_data
 
 
+# Customer and sale columns the demographics panel breaks meals and kWh down by
+CLASSIFICATION_DIMENSIONS = ['household_type', 'household_size', 'country', 'location', 'sales_rep', 'gender']
+# Low-cardinality dimensions, grouped through categorical codes
+CATEGORICAL_DIMENSIONS = {'gender', 'household_type', 'country'}
+CLASSIFICATION_MEASURES = ['meals_cooked', 'kwh']
+
+
+def classification_totals(data):
+    """
+    Sum meals and kWh per value of every classification dimension at once.
+
+    Each dimension is hashed once into integer codes, and both measures are
+    summed off those codes with a bincount, instead of one groupby (and one
+    hashing of the column) per dimension and measure. Returns a frame indexed
+    by (dimension, value) with one column per measure; values are sorted
+    within each dimension and missing values are dropped, as groupby would.
+    """
+    if data.empty:
+        index = pd.MultiIndex.from_arrays([[], []], names=['dimension', 'value'])
+        return pd.DataFrame(columns=CLASSIFICATION_MEASURES, index=index)
+
+    weights = {measure: data[measure].to_numpy(dtype='float64') for measure in CLASSIFICATION_MEASURES}
+    totals = {measure: [] for measure in CLASSIFICATION_MEASURES}
+    dimensions, values = [], []
+    for dimension in CLASSIFICATION_DIMENSIONS:
+        if dimension in CATEGORICAL_DIMENSIONS:
+            column = data[dimension].astype('category')
+            codes, uniques = column.cat.codes.to_numpy(dtype='int64'), column.cat.categories
+        else:
+            codes, uniques = pd.factorize(data[dimension], sort=True)
+        # Missing values have code -1; shifted into bin 0, which is dropped
+        codes = codes + 1
+        for measure in CLASSIFICATION_MEASURES:
+            totals[measure].append(np.bincount(codes, weights=weights[measure], minlength=len(uniques) + 1)[1:])
+        dimensions.append(np.full(len(uniques), dimension, dtype=object))
+        values.append(np.asarray(uniques, dtype=object))
+
+    for measure in CLASSIFICATION_MEASURES:
+        totals[measure] = np.concatenate(totals[measure])
+        if pd.api.types.is_integer_dtype(data[measure]):
+            totals[measure] = totals[measure].round().astype('int64')
+
+    index = pd.MultiIndex.from_arrays([np.concatenate(dimensions), np.concatenate(values)], names=['dimension', 'value'])
+    return pd.DataFrame(totals, index=index)
+
+
+# Demographics panel slot, dimension and measure for each classification chart
+CLASSIFICATION_CHARTS = [
+    ('household_type_graph', 'household_type', 'meals_cooked', 'Meals Cooked by Household Type'),
+    ('household_size_graph', 'household_size', 'meals_cooked', 'Meals Cooked by Household Size'),
+    ('countries_graph', 'country', 'meals_cooked', 'Meals Cooked by Country'),
+    ('location_graph', 'location', 'meals_cooked', 'Meals Cooked by Location'),
+    ('sales_reps_graph', 'sales_rep', 'meals_cooked', 'Meals Cooked by Sales Rep'),
+    ('genders_graph', 'gender', 'meals_cooked', 'Meals Cooked by Gender'),
+    ('household_type_graph_kwh', 'household_type', 'kwh', 'Energy Use by Household Type'),
+    ('household_size_graph_kwh', 'household_size', 'kwh', 'Energy Use by Household Size'),
+    ('countries_graph_kwh', 'country', 'kwh', 'Energy Use by Country'),
+    ('location_graph_kwh', 'location', 'kwh', 'Energy Use by Location'),
+    ('sales_reps_graph_kwh', 'sales_rep', 'kwh', 'Energy Use by Sales Rep'),
+    ('genders_graph_kwh', 'gender', 'kwh', 'Energy Use by Gender'),
+]
+
+
 def plot_classifications(data):
-    # Create a dictionary to store the HTML of each graph
-    graphs_html = {}
+    """Render the meals and kWh pie chart for every classification, keyed by panel slot."""
+    totals = classification_totals(data)
+    dimensions = set(totals.index.get_level_values('dimension'))
 
-    # Shared function for creating pie charts for both meals and kWh
-    def create_pie_chart_for_classification(classification_column, value_column, label):
-        fig = go.Figure()
-        classification_data = data.groupby(classification_column)[value_column].sum().reset_index()
-        fig = create_pie_chart(classification_data[classification_column], classification_data[value_column], label)
-        fig.update_traces(hole=.5, hovertemplate=f'<b>{classification_column.capitalize()}: %{{label}}<br>{value_column.capitalize()}: %{{value}} {value_column}')
-        return pio.to_html(fig, full_html=False)
-
-    # Meals classification
-    graphs_html['meals_by_household_type'] = create_pie_chart_for_classification('household_type', 'meals_cooked', 'Meals Cooked by Household Type')
-    graphs_html['meals_by_household_size'] = create_pie_chart_for_classification('household_size', 'meals_cooked', 'Meals Cooked by Household Size')
-    graphs_html['meals_by_country'] = create_pie_chart_for_classification('country', 'meals_cooked', 'Meals Cooked by Country')
-    graphs_html['meals_by_location'] = create_pie_chart_for_classification('location', 'meals_cooked', 'Meals Cooked by Location')
-    graphs_html['meals_by_sales_rep'] = create_pie_chart_for_classification('sales_rep', 'meals_cooked', 'Meals Cooked by Sales Rep')
-    graphs_html['meals_by_gender'] = create_pie_chart_for_classification('gender', 'meals_cooked', 'Meals Cooked by Gender')
-
-    # kWh classification
-    graphs_html['kwh_by_household_type'] = create_pie_chart_for_classification('household_type', 'kwh', 'Energy Use by Household Type')
-    graphs_html['kwh_by_household_size'] = create_pie_chart_for_classification('household_size', 'kwh', 'Energy Use by Household Size')
-    graphs_html['kwh_by_country'] = create_pie_chart_for_classification('country', 'kwh', 'Energy Use by Country')
-    graphs_html['kwh_by_location'] = create_pie_chart_for_classification('location', 'kwh', 'Energy Use by Location')
-    graphs_html['kwh_by_sales_rep'] = create_pie_chart_for_classification('sales_rep', 'kwh', 'Energy Use by Sales Rep')
-    graphs_html['kwh_by_gender'] = create_pie_chart_for_classification('gender', 'kwh', 'Energy Use by Gender')
-
-    return graphs_html['meals_by_location'], graphs_html['meals_by_country'], graphs_html['meals_by_gender'], graphs_html['meals_by_household_size'], graphs_html['meals_by_household_type'], graphs_html['meals_by_sales_rep'], \
-           graphs_html['kwh_by_location'], graphs_html['kwh_by_country'], graphs_html['kwh_by_gender'], graphs_html['kwh_by_household_size'], graphs_html['kwh_by_household_type'], graphs_html['kwh_by_sales_rep']
+    graphs_html = {}
+    for slot, dimension, measure, label in CLASSIFICATION_CHARTS:
+        classification_data = totals.loc[dimension, measure] if dimension in dimensions else pd.Series(dtype='float64')
+        fig = create_pie_chart(classification_data.index, classification_data.to_numpy(), label)
+        fig.update_traces(hole=.5, hovertemplate=f'<b>{dimension.capitalize()}: %{{label}}<br>{measure.capitalize()}: %{{value}} {measure}')
+        graphs_html[slot] = render_chart(fig)
+    return graphs_html
 
 
 def plotAllDevData(data):
@@ -219,9 +355,14 @@ def plotAllDevData(data):
 
     fig = go.Figure()
 
+    # Split the point budget across devices and downsample each trace with LTTB
+    device_ids = data['deviceID'].unique()
+    points_per_device = max(get_max_points() // max(len(device_ids), 1), 3)
+
     # Create scatter plots for each unique deviceID
-    for device_id in data['deviceID'].unique():
-        device_data = data[data['deviceID'] == device_id]
+    for device_id in device_ids:
+        device_data = data[data['deviceID'] == device_id].sort_values('txtime')
+        device_data = device_data.iloc[lttb(device_data['txtime'], device_data['kwh'], points_per_device)]
         
         fig.add_trace(go.Scatter(
             x=device_data['txtime'],
@@ -245,7 +386,7 @@ def plotAllDevData(data):
     )
 
     # Convert the figure to HTML
-    fig_html = pio.to_html(fig, full_html=False)
+    fig_html = render_chart(fig)
     
     return fig_html
 
@@ -254,11 +395,11 @@ def plotAllDevData(data):
 def devices_page(request):
     usr = request.user.username
     if usr == 'John-Maina':
-        data = fetch_data("commandScode")
+        data = fetch_data("commandScode", get_tenant(usr))
     elif usr == 'Welight':
-        data = fetch_data("commandWelight")
+        data = fetch_data("commandWelight", get_tenant(usr))
     else:
-        data = fetch_data("command")
+        data = fetch_data("command", get_tenant(usr))
     data = pd.DataFrame(data)
     if not data.empty:
         # Sorting and handling different naming conventions
@@ -304,62 +445,148 @@ def devices_page(request):
     return render(request, 'devices.html', context)
 
 
+MEAL_GAP_SECONDS = 20 * 60
+EPOCH = datetime(1970, 1, 1)
+
+
+def txtime_to_seconds(txtime):
+    """Convert an array of YYYYMMDDHHMMSS integers to seconds since the epoch."""
+    months = (txtime // 10**10 - 1970) * 12 + txtime // 10**8 % 100 - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype('int64') + txtime // 10**6 % 100 - 1
+    return days * 86400 + txtime // 10**4 % 100 * 3600 + txtime // 100 % 100 * 60 + txtime % 100
+
+
 def classify_and_count_meals(data):
-    sorted_data = sorted(data, key=lambda x: (x['deviceID'], x['txtime']))
-    device_meal_counts = {}
-    day_meal_counts = {}
-
-    for entry in sorted_data:
-        if entry['deviceID'] != 'OfficeFridge1':
-            device_id = entry['deviceID']
-            txtime = datetime.strptime(str(entry['txtime']), "%Y%m%d%H%M%S")
-
-            if device_id not in device_meal_counts:
-                device_meal_counts[device_id] = {'count': 0, 'last_txtime': None}
-            if device_meal_counts[device_id]['last_txtime'] is not None:
-                time_diff = txtime - device_meal_counts[device_id]['last_txtime']
-                if time_diff > timedelta(minutes=20):
-                    device_meal_counts[device_id]['count'] += 1
-            else:
-                device_meal_counts[device_id]['count'] += 1
-
-            date = txtime.strftime('%Y-%m-%d')
-            if date not in day_meal_counts:
-                day_meal_counts[date] = {}
-            if device_id not in day_meal_counts[date]:
-                day_meal_counts[date][device_id] = 0
-            if 'last_txtime' in day_meal_counts[date]:
-                time_diff = txtime - day_meal_counts[date]['last_txtime']
-                if time_diff > timedelta(minutes=20):
-                    day_meal_counts[date][device_id] += 1
-            else:
-                day_meal_counts[date][device_id] += 1
-            
-            device_meal_counts[device_id]['last_txtime'] = txtime
-            day_meal_counts[date]['last_txtime'] = txtime
+    """Count cooking sessions per device and per day from a list of readings."""
+    devices = np.array([row['deviceID'] for row in data], dtype=object)
+    txtimes = np.array([int(row['txtime']) for row in data], dtype='int64')
+    return count_meals(devices, txtimes)
+
+
+def count_meals(devices, txtimes):
+    """
+    Count cooking sessions per device and per day.
+
+    A reading starts a new meal when it is the first for its device, or more
+    than 20 minutes after the device's previous reading. Daily counts compare
+    each reading with the previous one on the same date in (deviceID, txtime)
+    order. Works on whole columns rather than row by row.
+    """
+    keep = devices != 'OfficeFridge1'
+    devices, txtimes = devices[keep], txtimes[keep]
+    if not len(devices):
+        return {}, {}
+
+    # Sort by (deviceID, txtime); lexsort is stable like sorted()
+    codes, _ = pd.factorize(devices, sort=True)
+    order = np.lexsort((txtimes, codes))
+    devices, codes, seconds = devices[order], codes[order], txtime_to_seconds(txtimes[order])
+
+    # Per-device meals: first reading of a device, or a gap over 20 minutes
+    new_device = np.ones(len(devices), dtype=bool)
+    new_device[1:] = codes[1:] != codes[:-1]
+    gaps = np.zeros(len(seconds), dtype='int64')
+    gaps[1:] = np.diff(seconds)
+    meal_start = new_device | (gaps > MEAL_GAP_SECONDS)
+
+    device_starts = np.flatnonzero(new_device)
+    device_ends = np.append(device_starts[1:], len(devices)) - 1
+    device_counts = np.add.reduceat(meal_start.astype('int64'), device_starts)
+    device_meal_counts = {
+        device_id: {'count': int(count), 'last_txtime': EPOCH + timedelta(seconds=int(last_seen))}
+        for device_id, count, last_seen in zip(devices[device_starts], device_counts, seconds[device_ends])
+    }
 
-    total_meals_per_day = {date: sum(count for device, count in counts.items() if device != 'last_txtime') for date, counts in day_meal_counts.items()}
+    # Per-day meals: regroup by date keeping the (deviceID, txtime) order, then
+    # compare each reading with the previous one on the same date
+    days = seconds // 86400
+    order = np.argsort(days, kind='stable')
+    day_sorted = days[order]
+    seconds_sorted = seconds[order]
+    new_day = np.ones(len(day_sorted), dtype=bool)
+    new_day[1:] = day_sorted[1:] != day_sorted[:-1]
+    day_gaps = np.zeros(len(seconds_sorted), dtype='int64')
+    day_gaps[1:] = np.diff(seconds_sorted)
+    day_meal_start = new_day | (day_gaps > MEAL_GAP_SECONDS)
+
+    day_starts = np.flatnonzero(new_day)
+    day_counts = np.add.reduceat(day_meal_start.astype('int64'), day_starts)
+    # Keep dates in the order they are first seen in (deviceID, txtime) order
+    first_seen = order[day_starts]
+    dates = day_sorted[day_starts].astype('datetime64[D]').astype(str)
+    total_meals_per_day = {
+        str(dates[i]): int(day_counts[i]) for i in np.argsort(first_seen, kind='stable')
+    }
     return device_meal_counts, total_meals_per_day
 
-def categorize_kwh(data):
+
+def aggregate_readings(raw_data):
+    """
+    Aggregate the homepage readings in a single pass over the upstream payload.
+
+    Totals, per-device kWh and the breakfast/lunch/supper buckets are summed on
+    the way through. Per reading only compact columns (device code, txtime,
+    kWh) are kept, and meals are counted from those columns afterwards.
+    """
+    device_codes = {}
+    codes = array('l')
+    txtimes = array('q')
+    kwhs = array('d')
+    total_kwh = 0
+    device_kwh = defaultdict(float)
     morning_kwh = 0
     afternoon_kwh = 0
     night_kwh = 0
-    for record in data:
-        hour = int(str(record['txtime'])[8:10])
+
+    for reading in raw_data:
+        device_id = reading['deviceID']
+        txtime = int(reading['txtime'])
+        kwh = reading['kwh']
+
+        codes.append(device_codes.setdefault(device_id, len(device_codes)))
+        txtimes.append(txtime)
+        kwhs.append(kwh)
+
+        total_kwh += kwh
+        device_kwh[device_id] += kwh
+        hour = txtime // 10**4 % 100
         if 4 <= hour < 11:
-            morning_kwh += record['kwh']
+            morning_kwh += kwh
         elif 11 <= hour < 17:
-            afternoon_kwh += record['kwh']
+            afternoon_kwh += kwh
         else:
-            night_kwh += record['kwh']
-    return morning_kwh, afternoon_kwh, night_kwh
+            night_kwh += kwh
+
+    devices = np.array(list(device_codes), dtype=object)[np.frombuffer(codes, dtype=codes.typecode)]
+    txtimes = np.frombuffer(txtimes, dtype=txtimes.typecode)
+    meals, meals_per_day = count_meals(devices, txtimes)
 
-def generate_charts(data, runtime, meals, morning, afternoon, night):
-    # Convert data to DataFrame
-    df = pd.DataFrame(data)
-    df['txtime'] = pd.to_datetime(df['txtime'], format='%Y%m%d%H%M%S')
-    df = df[df['kwh'] >= 0]
+    return {
+        'total_kwh': total_kwh,
+        'device_kwh': dict(device_kwh),
+        'morning_kwh': morning_kwh,
+        'afternoon_kwh': afternoon_kwh,
+        'night_kwh': night_kwh,
+        'meals': meals,
+        'meals_per_day': meals_per_day,
+        'deviceID': devices,
+        'txtime': txtimes,
+        'kwh': np.frombuffer(kwhs, dtype=kwhs.typecode),
+    }
+
+def readings_frame(readings):
+    # Build the chart frame straight from the aggregated columns
+    valid = readings['kwh'] >= 0
+    return pd.DataFrame({
+        'txtime': pd.to_datetime(txtime_to_seconds(readings['txtime'][valid]), unit='s'),
+        'kwh': readings['kwh'][valid],
+        'deviceID': readings['deviceID'][valid],
+    })
+
+
+def generate_device_charts(readings, runtime):
+    meals = readings['meals']
+    df = readings_frame(readings)
 
     device_ids = [device_id for device_id, info in meals.items()]
     meal_counts = [info['count'] for device_id, info in meals.items()]
@@ -369,35 +596,37 @@ def generate_charts(data, runtime, meals, morning, afternoon, night):
     # Create Pie Charts
     cooking_time_pie = create_pie_chart(runtime_device_ids, runtime_hours, 'Cooking Time by Device')
     meals_pie = create_pie_chart(device_ids, meal_counts, 'Meals Distribution by Device')
-    kwh_pie = create_pie_chart(["Breakfast", "Lunch", "Supper"], [morning, afternoon, night], 'KWH Per Meal')
-    emissions_pie = create_pie_chart(["Breakfast", "Lunch", "Supper"], [morning * 0.4999 * 0.28, afternoon * 0.4999 * 0.28, night * 0.4999 * 0.28], 'Emissions Per Meal')
-
-    # Line Chart
-    energy_line_chart = create_line_chart(df, 'txtime', 'kwh', 'Energy Consumption')
 
     # Device kWh Pie Chart
     df_pie = df.groupby('deviceID')['kwh'].sum().reset_index()
     kwh_pie_chart = create_pie_chart(df_pie['deviceID'], df_pie['kwh'], 'kWh Distribution by Device')
 
     # Emissions per Device Pie Chart
-    df_pie_emissions = df.copy()
-    df_pie_emissions['emissions'] = df_pie_emissions['kwh'] * 0.4999 * 0.28
-    emissions_device_pie_chart = create_pie_chart(df_pie_emissions['deviceID'], df_pie_emissions['emissions'], 'Carbon Emissions Per Device')
+    emissions_device_pie_chart = create_pie_chart(df_pie['deviceID'], df_pie['kwh'] * 0.4999 * 0.28, 'Carbon Emissions Per Device')
     cooking_time_pie.update_traces(hovertemplate='<b>%{label}: %{value} hours', hole=.5)
     meals_pie.update_traces(hovertemplate='<b>%{label}: %{value} meals', hole=.5)
-    kwh_pie.update_traces(hovertemplate='<b>%{label}: %{value} kWh', hole=.5)
     kwh_pie_chart.update_traces(hovertemplate='<b>%{label}: %{value} kWh', hole=.5)
-    emissions_pie.update_traces(hovertemplate='<b>%{label}: %{value} kg CO₂', hole=.5)
     emissions_device_pie_chart.update_traces(hovertemplate='<b>%{label}: %{value} kg CO₂', hole=.5)
 
     return {
-        'line_chart': pio.to_html(energy_line_chart, full_html=False),
-        'pie_chart': pio.to_html(kwh_pie_chart, full_html=False),
-        'meals_pie_html': pio.to_html(meals_pie, full_html=False),
-        'meals_kwh_html': pio.to_html(kwh_pie, full_html=False),
-        'cooking_time_pie_html': pio.to_html(cooking_time_pie, full_html=False),
-        'meals_emissions_html': pio.to_html(emissions_pie, full_html=False),
-        'pie_chart_emissions': pio.to_html(emissions_device_pie_chart, full_html=False)
+        'pie_chart': render_chart(kwh_pie_chart),
+        'meals_pie_html': render_chart(meals_pie),
+        'cooking_time_pie_html': render_chart(cooking_time_pie),
+        'pie_chart_emissions': render_chart(emissions_device_pie_chart)
+    }
+
+
+def generate_time_of_day_charts(readings):
+    morning, afternoon, night = readings['morning_kwh'], readings['afternoon_kwh'], readings['night_kwh']
+
+    kwh_pie = create_pie_chart(["Breakfast", "Lunch", "Supper"], [morning, afternoon, night], 'KWH Per Meal')
+    emissions_pie = create_pie_chart(["Breakfast", "Lunch", "Supper"], [morning * 0.4999 * 0.28, afternoon * 0.4999 * 0.28, night * 0.4999 * 0.28], 'Emissions Per Meal')
+    kwh_pie.update_traces(hovertemplate='<b>%{label}: %{value} kWh', hole=.5)
+    emissions_pie.update_traces(hovertemplate='<b>%{label}: %{value} kg CO₂', hole=.5)
+
+    return {
+        'meals_kwh_html': render_chart(kwh_pie),
+        'meals_emissions_html': render_chart(emissions_pie),
     }
 
 def create_pie_chart(names, values, title):
@@ -421,15 +650,26 @@ def create_pie_chart(names, values, title):
     return pie_chart
 
 def create_line_chart(df, x_column, y_column, title):
+    if len(df) > get_max_points():
+        # Too many readings to plot one bar each: sum them into time buckets
+        df, freq = bucket_sum(df, x_column, y_column)
+        hovertemplate = '%{x}<br>%{y} kWh<br>Readings: %{text}'
+        text = df['readings']
+        width = pd.Timedelta(freq) / pd.Timedelta('1ms') * 0.8
+    else:
+        hovertemplate = '%{x}<br>%{y} kWh<br>Device ID: %{text}'
+        text = df['deviceID']
+        width = 0.8
+
     # Create the bar chart
     bar_chart = px.bar(df, x=x_column, y=y_column, title=title, labels={x_column: 'Time', y_column: 'kWh'})
 
     # Update the trace for better visibility
     bar_chart.update_traces(
         marker=dict(color="#0ead00"),
-        hovertemplate='%{x}<br>%{y} kWh<br>Device ID: %{text}',
-        text=df['deviceID'],
-        width=0.8  # Adjust width if needed
+        hovertemplate=hovertemplate,
+        text=text,
+        width=width  # Adjust width if needed
     )
 
     # Update layout for better visualization
@@ -449,9 +689,9 @@ def create_line_chart(df, x_column, y_column, title):
 def transactions_page(request):
     usr = request.user.username
     if usr == 'John-Maina':
-        data = fetch_data("mpesarecordsscode")
+        data = fetch_data("mpesarecordsscode", get_tenant(usr))
     else:
-        data = fetch_data("mpesarecords")
+        data = fetch_data("mpesarecords", get_tenant(usr))
     data = pd.DataFrame(data)
     # Convert 'transtime' to datetime format
     data['transtime'] = pd.to_datetime(data['transtime'], format='%Y%m%d%H%M%S')
@@ -490,7 +730,7 @@ def transactions_page(request):
         #width=0.7 * 800,  # Assuming an 800px base width
         margin=dict(l=20, r=20, t=40, b=20)
     )
-    line_chart = pio.to_html(fig_line, full_html=False)
+    line_chart = render_chart(fig_line)
 
     context = {
         'transactions_table': page_obj,  # Pass the page object to the template
@@ -500,50 +740,43 @@ def transactions_page(request):
 
     return render(request, 'transactions.html', context)
 
-def fetch_data_with_params(endpoint, dev, range_value):
-    response = requests.get(BASE_URL + endpoint +"?device="+dev+"&range=" + str(range_value), auth=AUTH)
-    response.raise_for_status()
-    return response.json()
+def fetch_data_with_params(endpoint, dev, range_value, tenant='default'):
+    return cached_get_json(endpoint, {'device': dev, 'range': range_value}, tenant=tenant)
 
 #######################################################STK PAYMENT CODE############################################################################
 
 
 def post_payment_prompt(endpoint, contact, amount, ref):
     data = {"contact": contact, "ref": ref, "amount":amount}
-    response = requests.post(BASE_URL + endpoint, json=data, auth=AUTH)
-    response.raise_for_status()
-    return response.json()
-
-def payment_prompt_action(usr, contact, amount, ref):
-    global payment_status
-    payment_status = {
-    "status": "pending",
-    "message": "",
-    "amount": None,
-    "receipt_number": None,
-    "transaction_date": None,
-    "phone_number": None
-    }
+    return upstream.post_json(endpoint, data)
+
+def stk_endpoint(usr):
     if usr == 'John-Maina':
-        res = post_payment_prompt(endpoint="stkpushscode", contact=contact, amount=amount, ref=ref)
-    else:
-        res = post_payment_prompt(endpoint="stkpush", contact=contact, amount=amount, ref=ref)
+        return "stkpushscode"
+    return "stkpush"
+
+def payment_prompt_action(usr, contact, amount, ref, user=None):
+    res = post_payment_prompt(endpoint=stk_endpoint(usr), contact=contact, amount=amount, ref=ref)
+    if res.get('ResponseCode') == 0:
+        payment_store.record_prompt(ref, res.get('CheckoutRequestID'), tenant=get_tenant(usr), user=user)
     return res
 
 @login_required
 def payment_prompt(request):
     usr = request.user.username
-    global ref
 
     if request.method == 'POST':
         contact = request.POST.get('contact')
         amount = request.POST.get('amount')
         ref = request.POST.get('ref')
         try:
-            res = payment_prompt_action(contact=contact, amount=amount, ref=ref, usr=usr)
+            res = payment_prompt_action(contact=contact, amount=amount, ref=ref, usr=usr, user=request.user)
             if res.get('ResponseCode') == 0:
                 messages.info(request, res.get('ResponseDescription'))
-                return redirect('payment_waiting', ref=ref)
+                waiting_url = reverse('payment_waiting', args=[ref])
+                if res.get('CheckoutRequestID'):
+                    waiting_url += '?' + urlencode({'checkout': res['CheckoutRequestID']})
+                return redirect(waiting_url)
             else:
                 messages.error(request, "Failed. Kindly try again.")
         except requests.RequestException as e:
@@ -562,82 +795,170 @@ def payment_prompt(request):
 
 @csrf_exempt
 def payment_confirmation(request):
-    global payment_status  # Use the global variable
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            stk_callback = data.get('Body', {}).get('stkCallback', {})
-            result_code = stk_callback.get('ResultCode')
-            result_desc = stk_callback.get('ResultDesc')
-
-            if result_code == 0:
-                status = 'success'
-                message = result_desc
-                callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-                amount = next((item.get('Value') for item in callback_metadata if item.get('Name') == 'Amount'), None)
-                receipt_number = next((item.get('Value') for item in callback_metadata if item.get('Name') == 'MpesaReceiptNumber'), None)
-                transaction_date = next((item.get('Value') for item in callback_metadata if item.get('Name') == 'TransactionDate'), None)
-                phone_number = next((item.get('Value') for item in callback_metadata if item.get('Name') == 'PhoneNumber'), None)
-            else:
-                status = 'failed'
-                message = 'The user cancelled the request'
-                amount = None
-                receipt_number = None
-                transaction_date = None
-                phone_number = None
-
-            # Update the global variable
-            payment_status.update({
-                "status": status,
-                "message": message,
-                "amount": amount,
-                "receipt_number": receipt_number,
-                "transaction_date": transaction_date,
-                "phone_number": phone_number
-            })
-            print('Updated payment status:', payment_status)
-
-            return JsonResponse({"status": status, "message": message})
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON"}, status=400)
+        callback = payment_callbacks.parse_stk_callback(data)
+        if not callback['checkout_request_id']:
+            return JsonResponse({"error": "Missing CheckoutRequestID"}, status=400)
+
+        if callback['result_code'] == 0:
+            status = 'success'
+            message = callback['result_desc']
+        else:
+            status = 'failed'
+            message = 'The user cancelled the request'
+
+        # M-Pesa retries callbacks; only the first one updates the payment. Both writes commit
+        # together, so a callback whose result wasn't recorded isn't taken for a duplicate on retry
+        with transaction.atomic():
+            if payment_callbacks.record_callback(callback, data) is not None:
+                payment_store.record_result(
+                    callback['checkout_request_id'], status, message, amount=callback['amount'],
+                    receipt_number=callback['receipt_number'], transaction_date=callback['transaction_date'],
+                    phone_number=callback['phone_number'],
+                )
+
+        return JsonResponse({"status": status, "message": message})
     else:
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
 # Handle the payment confirmation status check
 def payment_confirmation_page(request):
-    global payment_status  # Use the global variable
-    
-    context = {
-        'status': payment_status.get('status'),
-        'message': payment_status.get('message'),
-        'amount': payment_status.get('amount'),
-        'receipt_number': payment_status.get('receipt_number'),
-        'transaction_date': payment_status.get('transaction_date'),
-        'phone_number': payment_status.get('phone_number')
-    }
+    payment = payment_store.get_status(request.GET.get('ref'), request.GET.get('checkout'))
+    if payment is None:
+        context = {'status': request.GET.get('status'), 'message': request.GET.get('message')}
+    else:
+        context = {
+            'status': payment.status,
+            'message': payment.message,
+            'amount': payment.amount,
+            'receipt_number': payment.receipt_number,
+            'transaction_date': payment.transaction_date,
+            'phone_number': payment.phone_number
+        }
 
     return render(request, 'payment_confirmation.html', context)
 
 
 @csrf_exempt
 def payment_confirmation_status(request):
-    global payment_status  # Use the global variable
     if request.method == 'GET':
-        ref = request.GET.get('ref')
-        print('Retrieved payment_status:', payment_status)
-        status = payment_status.get('status')
-        if status != 'pending':
-            message = payment_status.get('message')
-            return JsonResponse({'status': status, 'message': message})
+        payment = payment_store.get_status(request.GET.get('ref'), request.GET.get('checkout'))
+        if payment is not None and payment.status != PaymentStatus.PENDING:
+            return JsonResponse({'status': payment.status, 'message': payment.message})
         else:
             return JsonResponse({'status': 'pending', 'message': 'Payment is still pending.'})
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
 
 
+# Payment status streams open in this process; each holds a worker thread
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+
+def payment_status_events(ref, checkout_request_id):
+    """Server-sent events for a prompt: its status now, then its result as soon as it is recorded."""
+    global _open_streams
+    config = getattr(settings, 'PAYMENTS', {})
+    poll_interval = config.get('STREAM_POLL_INTERVAL', 15)
+    deadline = time.monotonic() + config.get('STREAM_TIMEOUT', 60)
+    with _open_streams_lock:
+        admitted = _open_streams < config.get('STREAM_MAX_OPEN', 20)
+        if admitted:
+            _open_streams += 1
+    # Browsers reconnect after this many milliseconds if the stream drops
+    yield "retry: 5000\n\n"
+    if not admitted:
+        # Past the cap the page polls instead of holding another worker
+        yield "event: timeout\ndata: {}\n\n"
+        return
+
+    try:
+        event = payment_store.result_event(checkout_request_id) if checkout_request_id else threading.Event()
+        sent_pending = False
+        while True:
+            payment = payment_store.get_status(ref, checkout_request_id)
+            if payment is not None and payment.status != PaymentStatus.PENDING:
+                yield f"event: status\ndata: {json.dumps({'status': payment.status, 'message': payment.message})}\n\n"
+                return
+            if not sent_pending:
+                yield f"event: status\ndata: {json.dumps({'status': 'pending', 'message': 'Payment is still pending.'})}\n\n"
+                sent_pending = True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # The page goes back to polling
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            # Woken at once by a callback in this process; the table is only re-read for other processes' callbacks
+            if not event.wait(min(poll_interval, remaining)):
+                yield ": waiting\n\n"
+    finally:
+        with _open_streams_lock:
+            _open_streams -= 1
+
+
+def payment_status_stream(request):
+    response = StreamingHttpResponse(
+        payment_status_events(request.GET.get('ref'), request.GET.get('checkout')),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # Render the payment waiting page
 def payment_waiting(request, ref):
-    return render(request, "payment_waiting.html", {"ref": ref})
+    return render(request, "payment_waiting.html", {"ref": ref, "checkout": request.GET.get('checkout', '')})
+
+
+@login_required
+def payment_campaign_start(request):
+    if request.method != 'POST':
+        return redirect('paygo_sales')
+    usr = request.user.username
+    tenant = get_tenant(usr)
+
+    # Amounts and phone numbers come from our own records, not the form, read past the
+    # cache so customers who have just paid aren't billed their old balance
+    sales = upstream.get_json('paygoScode')
+    if request.POST.get('filter') == 'overdue':
+        selected = [sale for sale in sales if (sale.get('paymentData') or {}).get('payment_status') == 'overdue']
+    else:
+        refs = set(request.POST.getlist('ref'))
+        selected = [sale for sale in sales if sale['product_serial_number'] in refs]
+    if not selected:
+        messages.error(request, "No customers selected.")
+        return redirect('paygo_sales')
+
+    CustomerModel = TestCustomer if uses_test_models(request.user) else Customer
+    phones = dict(CustomerModel.objects.filter(pk__in={sale['customer_id'] for sale in selected})
+                  .values_list('pk', 'phone_number'))
+    targets = [
+        (sale['product_serial_number'], phones.get(sale['customer_id']), (sale.get('paymentData') or {}).get('paygoBalance'))
+        for sale in selected
+    ]
+    campaign = payment_campaigns.start_campaign(targets, stk_endpoint(usr), tenant=tenant, user=request.user)
+    return redirect('payment_campaign', pk=campaign.pk)
+
+
+@login_required
+def payment_campaign(request, pk):
+    campaigns = PaymentCampaign.objects.all()
+    if not request.user.is_staff:
+        campaigns = campaigns.filter(requested_by=request.user)
+    campaign = get_object_or_404(campaigns, pk=pk)
+    context = {
+        'campaign': campaign,
+        'progress': payment_campaigns.progress(campaign),
+        'prompts': campaign.prompts.select_related('payment').order_by('pk'),
+    }
+    return render(request, 'payment_campaign.html', context)
 
 
 ##########################################################END OF STK PAYMENT CODE#################################################################  
@@ -645,10 +966,18 @@ def payment_waiting(request, ref):
 
 @login_required
 def device_data_page(request, device_id):
-    range_value = request.GET.get('range', 9999999)
-    
-    # Fetch data based on device_id and range_value
-    data = fetch_data_with_params("deviceDataDjangoo", device_id, range_value)
+    usr = request.user.username
+    tenant = get_tenant(usr)
+    range_value = parse_range(request.GET.get('range', 9999999))
+    if range_value is None:
+        return HttpResponse("Invalid range", status=400)
+
+    snapshot = snapshots.get_snapshot(tenant, DashboardSnapshot.DEVICE, range_value, device_id)
+    if snapshot is not None:
+        data = snapshot.payload
+        dat = fetch_data(command_endpoint(tenant), tenant)
+    else:
+        data, dat = device_data(tenant, device_id, range_value)
     runtime = data['runtime']
     sum_kwh = data['sumKwh']
     emissions = sum_kwh * 0.4999 * 0.28
@@ -672,7 +1001,7 @@ def device_data_page(request, device_id):
         height=400,
         margin=dict(l=20, r=20, t=40, b=20)
     )
-    meals_per_day_chart = pio.to_html(fig_meals_bar, full_html=False)
+    meals_per_day_chart = render_chart(fig_meals_bar)
 
     # Process meals_with_durations
     for x in meals_with_durations:
@@ -701,15 +1030,8 @@ def device_data_page(request, device_id):
         #barmode='group',
         #barcornerradius=10
     )
-    metrics_chart = pio.to_html(fig_metrics_bar, full_html=False)
+    metrics_chart = render_chart(fig_metrics_bar)
 
-    usr = request.user.username
-    if usr == 'John-Maina':
-        dat = fetch_data("commandScode")
-    elif usr == 'Welight':
-        dat = fetch_data("commandWelight")
-    else:
-        dat = fetch_data("command")
     for z in dat:
         if z["deviceID"] == device_id:
             status = z["active"]
@@ -748,27 +1070,33 @@ def device_data_page(request, device_id):
         "energy_cost": energy_cost,
         "dev_List": dev_List,  # Ensure dev_List is a list of strings
         "status": status,
-        "selected_range": str(range_value)
+        "selected_range": str(range_value),
+        "computed_at": snapshot.computed_at if snapshot is not None else None,
     }
 
     return render(request, "device_data.html", context)
 
+
+def device_data(tenant, device_id, range_value):
+    """Return a device's data for a range together with the tenant's device list."""
+    if telemetry_store.is_enabled(tenant):
+        data = telemetry_store.device_summary(tenant, device_id, telemetry_store.range_start(range_value))
+        return data, fetch_data(command_endpoint(tenant), tenant)
+
+    # Fetch the device data and the device list concurrently
+    return fetch_concurrently(
+        (fetch_data_with_params, ("deviceDataDjangoo", device_id, range_value, tenant)),
+        (fetch_data, (command_endpoint(tenant), tenant)),
+    )
+
 @login_required
 def add_device(request):
     if request.method == 'POST':
         device_name = request.POST.get('device_name')
         if device_name:
-            # Replace with your actual endpoint URL
-            endpoint = 'https://appliapay.com/addDevice'
-            # Replace with your actual credentials
-            username = 'admin'
-            password = '123Give!@#'
-            credentials = (username, password)
-            headers = {'Content-Type': 'application/json'}
-
             data = {'device': device_name}
 
-            response = requests.post(endpoint, json=data, auth=credentials, headers=headers)
+            response = upstream.post('addDevice', data)
 
             if response.status_code == 200:
                 # Redirect to the devices page on success
@@ -779,43 +1107,41 @@ def add_device(request):
     return render(request, 'add_device.html')
 
 #################################DOWNLOAD TRANSACTIONS EXCEL##############################################
+@login_required
 def export_transactions_excel(request):
-    # Fetch data based on the user
-    usr = request.user.username
-    if usr == 'John-Maina':
-        data = fetch_data("mpesarecordsscode")
-    else:
-        data = fetch_data("mpesarecords")
+    tenant = get_tenant(request.user.username)
+    if export_jobs.is_enabled():
+        return export_jobs.start_export(request, ExportJob.TRANSACTIONS, {'tenant': tenant})
+
+    columns, records = transaction_records(tenant)
+    return xlsx_response(columns, iter_records(records, columns), "transactions.xlsx")
 
-    # Convert the data to a DataFrame
-    df = pd.DataFrame(data)
+
+def transaction_records(tenant):
+    """Return the export columns and M-Pesa records of a tenant, newest first."""
+    # Fetch data based on the tenant
+    if tenant == 'scode':
+        data = fetch_data("mpesarecordsscode", tenant)
+    else:
+        data = fetch_data("mpesarecords", tenant)
 
     # Convert 'transtime' to datetime format
-    df['transtime'] = pd.to_datetime(df['transtime'], format='%Y%m%d%H%M%S')
+    for record in data:
+        record['transtime'] = datetime.strptime(str(record['transtime']), '%Y%m%d%H%M%S')
 
     # Sort the data by 'transtime' in descending order
-    df = df.sort_values(by='transtime', ascending=False)
+    records = sorted(data, key=lambda record: record['transtime'], reverse=True)
 
     # Drop the 'time' column to remove it from the export
-    df = df.drop(columns=['time'])
-
-    # Create a HttpResponse with content_type as ms-excel
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    
-    # Specify the file name
-    response['Content-Disposition'] = 'attachment; filename="transactions.xlsx"'
-
-    # Use pandas to save the dataframe as an excel file in the response
-    df.to_excel(response, index=False, engine='openpyxl')
-
-    return response
+    return record_columns(records, exclude=['time']), records
 
 ###############################DOWNLOAD DEVICE DATA#######################################################
+@login_required
 def export_device_data(request, device_id):
     range_value = request.GET.get('range', 9999999)
     
     # Fetch data based on device_id and range_value
-    data = fetch_data_with_params("deviceDataDjangoo", device_id, range_value)
+    data = fetch_data_with_params("deviceDataDjangoo", device_id, range_value, get_tenant(request.user.username))
     meals_with_durations = data['mealsWithDurations'][::-1]
     for x in meals_with_durations:
         x['mealDuration'] = round(x['mealDuration']/60)
@@ -826,42 +1152,20 @@ def export_device_data(request, device_id):
         x['energyCost'] = "KSHS. " + str(x['energyCost'])
         x['totalKwh'] = round(x['totalKwh'],3)
         x['totalKwh'] = str(x['totalKwh']) + " kWh"
-    # Convert the data to a DataFrame
-    df = pd.DataFrame(meals_with_durations)
-    
-    # Create the filename
-    fileName = f"{device_id}_cooking_data.xlsx"
-    
-    # Create a HttpResponse with content_type as ms-excel
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    
-    # Specify the file name using f-string
-    response['Content-Disposition'] = f'attachment; filename="{fileName}"'
-    
-    # Use pandas to save the dataframe as an excel file in the response
-    df.to_excel(response, index=False, engine='openpyxl')
-
-    return response
-
+    columns = record_columns(meals_with_durations)
+    return xlsx_response(columns, iter_records(meals_with_durations, columns), f"{device_id}_cooking_data.xlsx")
 
 
 #######################AI MIGAA METER DOWNLOAD####################################################
+@login_required
 def export_meter_data(request):
-    data = fetch_data("migaaMeterDownload")
-
-    # Convert the data to a DataFrame
-    df = pd.DataFrame(data)
-    # Create a HttpResponse with content_type as ms-excel
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    
-    # Specify the file name
-    response['Content-Disposition'] = 'attachment; filename="migaaMeter.csv"'
+    if export_jobs.is_enabled() and request.GET.get('background'):
+        return export_jobs.start_export(request, ExportJob.METER_DATA, {})
 
-    # Use pandas to save the dataframe as an excel file in the response
-    df.to_csv(response, index=False)
-
-    return response
+    # Pass the upstream array through as CSV rows while it downloads
+    return records_csv_response(upstream.stream_json_array("migaaMeterDownload"), "migaaMeter.csv")
 
+@login_required
 def export_ml_dataset(request):
     dataset = fetch_data('getMeasurements')
     context = {
@@ -869,25 +1173,26 @@ def export_ml_dataset(request):
     }
     return render(request, 'ai_data_download.html', context)
 
+@login_required
 def export_ml(request, set):
-    data = fetch_measurement_data('getMeasurementData', set)
-
-    # Convert the data to a DataFrame
-    df = pd.DataFrame(data)
-    # Create a HttpResponse with content_type as ms-excel
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    fileName = f"{set}.csv"
-    
-    # Specify the file name using f-string
-    response['Content-Disposition'] = f'attachment; filename="{fileName}"'
-
-    # Use pandas to save the dataframe as an excel file in the response
-    df.to_csv(response, index=False)
-
-    return response
-
-def fetch_measurement_data(endpoint, q):
-    response = requests.get(BASE_URL + endpoint+"?q="+q, auth=AUTH)
-    response.raise_for_status()
-    return response.json()
+    file_format = request.GET.get('format', 'csv')
+    if file_format != 'csv' and file_format not in COLUMNAR_CONTENT_TYPES:
+        return HttpResponse(f"Unknown export format: {file_format}", status=400)
+    if file_format != 'csv' and not columnar_available():
+        return HttpResponse("Parquet and Arrow exports need pyarrow installed on the server.", status=501)
+
+    if export_jobs.is_enabled() and request.GET.get('background'):
+        params = {'set': set}
+        if file_format != 'csv':
+            params['format'] = file_format
+        return export_jobs.start_export(request, ExportJob.ML_DATASET, params)
+
+    # Pass the upstream array through as rows while it downloads
+    records = upstream.stream_json_array('getMeasurementData', {'q': set})
+    if file_format == 'csv':
+        return records_csv_response(records, f"{set}.csv")
+    return records_columnar_response(records, f"{set}.{file_format}", file_format)
 
+@login_required
+def cache_stats_view(request):
+    return JsonResponse(cache_stats())
@@ -0,0 +1,23 @@
+from django.contrib import admin
+from .models import Reading, MealSession, HourlyRollup, DailyRollup, SyncWatermark
+
+
+@admin.register(Reading)
+class ReadingAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'tenant', 'txtime', 'kwh')
+
+@admin.register(MealSession)
+class MealSessionAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'tenant', 'start', 'end', 'kwh')
+
+@admin.register(HourlyRollup)
+class HourlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'tenant', 'bucket', 'kwh', 'meals')
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('device_id', 'tenant', 'bucket', 'kwh', 'meals')
+
+@admin.register(SyncWatermark)
+class SyncWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('tenant', 'txtime', 'updated_at')
@@ -0,0 +1,189 @@
+"""
+Ingestion of upstream device readings into the local telemetry store.
+
+Readings are deduplicated on (device, txtime), so re-ingesting an
+overlapping batch is harmless. New readings later than everything stored
+for their device extend its latest meal session and add onto its rollups.
+A reading that arrives late, before others already stored for its device,
+changes the gaps around it, so that device's sessions and rollups are
+rebuilt from the start of the reading's day.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, OuterRef, Q, Subquery
+
+from .models import Reading, MealSession, HourlyRollup, DailyRollup
+
+MEAL_GAP = timedelta(minutes=20)
+# Devices that draw power but never cook
+NON_COOKING_DEVICES = {'OfficeFridge1'}
+# Devices per query when filtering with per-device bounds
+DEVICE_BATCH_SIZE = 200
+
+
+def txtime_zone():
+    """The time zone upstream txtimes are written in (settings.TELEMETRY['TXTIME_ZONE'])."""
+    return ZoneInfo(getattr(settings, 'TELEMETRY', {}).get('TXTIME_ZONE', 'UTC'))
+
+
+def parse_txtime(value):
+    """Parse an upstream YYYYMMDDHHMMSS txtime into an aware datetime."""
+    return datetime.strptime(str(value), '%Y%m%d%H%M%S').replace(tzinfo=txtime_zone())
+
+
+def _day_floor(moment):
+    return moment.astimezone(txtime_zone()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _per_device(queryset, bounds, lookup):
+    """Rows of ``queryset`` matching ``lookup`` against each device's bound in ``bounds``, a few devices per query."""
+    devices = list(bounds)
+    for i in range(0, len(devices), DEVICE_BATCH_SIZE):
+        condition = Q()
+        for device_id in devices[i:i + DEVICE_BATCH_SIZE]:
+            condition |= Q(device_id=device_id, **{lookup: bounds[device_id]})
+        yield from queryset.filter(condition)
+
+
+def _apply_rollups(model, tenant, deltas):
+    """Add per-(device, bucket) deltas onto existing rollup rows, creating missing ones."""
+    if not deltas:
+        return
+    devices = {device_id for device_id, bucket in deltas}
+    existing = {
+        (rollup.device_id, rollup.bucket): rollup
+        for rollup in model.objects.filter(
+            tenant=tenant,
+            device_id__in=devices,
+            bucket__gte=min(bucket for device_id, bucket in deltas),
+        )
+    }
+    to_create, to_update = [], []
+    for (device_id, bucket), delta in deltas.items():
+        rollup = existing.get((device_id, bucket))
+        if rollup is None:
+            rollup = model(tenant=tenant, device_id=device_id, bucket=bucket)
+            to_create.append(rollup)
+        else:
+            to_update.append(rollup)
+        rollup.kwh += delta['kwh']
+        rollup.runtime_seconds += delta['runtime_seconds']
+        rollup.meals += delta['meals']
+        rollup.readings += delta['readings']
+    model.objects.bulk_create(to_create)
+    model.objects.bulk_update(to_update, ['kwh', 'runtime_seconds', 'meals', 'readings'])
+
+
+def _rewind(tenant, device_id, since):
+    """
+    Drop a device's meal sessions and rollups from the start of the day of
+    ``since``, moved back until no session spans it, and return that cutoff
+    with the stored readings from it on, to be replayed.
+    """
+    sessions = MealSession.objects.filter(tenant=tenant, device_id=device_id)
+    cutoff = _day_floor(since)
+    while (spanning := sessions.filter(start__lt=cutoff, end__gte=cutoff).order_by('start').first()) is not None:
+        cutoff = _day_floor(spanning.start)
+
+    sessions.filter(start__gte=cutoff).delete()
+    HourlyRollup.objects.filter(tenant=tenant, device_id=device_id, bucket__gte=cutoff).delete()
+    DailyRollup.objects.filter(tenant=tenant, device_id=device_id, bucket__gte=cutoff.date()).delete()
+    stored = Reading.objects.filter(tenant=tenant, device_id=device_id, txtime__gte=cutoff).values_list('txtime', 'kwh')
+    return cutoff, list(stored)
+
+
+@transaction.atomic
+def ingest_readings(tenant, raw_data, batch_size=5000):
+    """
+    Store new readings for a tenant and fold them into meal sessions and the
+    hourly/daily rollups. Returns the number of readings stored.
+    """
+    incoming = defaultdict(dict)
+    for reading in raw_data:
+        incoming[reading['deviceID']][parse_txtime(reading['txtime'])] = reading['kwh']
+    if not incoming:
+        return 0
+
+    # Drop readings that are already stored
+    first_new = {device_id: min(readings) for device_id, readings in incoming.items()}
+    stored = Reading.objects.filter(tenant=tenant).values_list('device_id', 'txtime')
+    for device_id, txtime in _per_device(stored, first_new, 'txtime__gte'):
+        incoming[device_id].pop(txtime, None)
+    incoming = {device_id: readings for device_id, readings in incoming.items() if readings}
+    if not incoming:
+        return 0
+
+    # The state each device's new readings continue from: its last reading and latest meal session
+    last_seen = dict(
+        Reading.objects.filter(tenant=tenant, device_id__in=incoming)
+        .values('device_id').annotate(last=Max('txtime')).values_list('device_id', 'last')
+    )
+    latest = MealSession.objects.filter(tenant=tenant, device_id=OuterRef('device_id')).order_by('-start')
+    open_sessions = {
+        session.device_id: session
+        for session in MealSession.objects.filter(
+            tenant=tenant, device_id__in=incoming, pk=Subquery(latest.values('pk')[:1]),
+        )
+    }
+
+    timelines = {}
+    for device_id, readings in incoming.items():
+        timeline = [(txtime, kwh, True) for txtime, kwh in readings.items()]
+        if device_id in last_seen and min(readings) < last_seen[device_id]:
+            # Late readings: replay the device from a cutoff before them
+            cutoff, replay = _rewind(tenant, device_id, min(readings))
+            timeline += [(txtime, kwh, False) for txtime, kwh in replay]
+            last_seen[device_id] = (Reading.objects.filter(tenant=tenant, device_id=device_id, txtime__lt=cutoff)
+                                    .aggregate(last=Max('txtime'))['last'])
+            open_sessions[device_id] = (MealSession.objects.filter(tenant=tenant, device_id=device_id, start__lt=cutoff)
+                                        .order_by('-start').first())
+        timelines[device_id] = sorted(timeline, key=lambda row: row[0])
+
+    new_readings = []
+    new_sessions, updated_sessions = [], {}
+    hourly = defaultdict(lambda: {'kwh': 0.0, 'runtime_seconds': 0.0, 'meals': 0, 'readings': 0})
+    daily = defaultdict(lambda: {'kwh': 0.0, 'runtime_seconds': 0.0, 'meals': 0, 'readings': 0})
+    zone = txtime_zone()
+
+    for device_id, timeline in timelines.items():
+        cooking = device_id not in NON_COOKING_DEVICES
+        for txtime, kwh, is_new in timeline:
+            previous = last_seen.get(device_id)
+            last_seen[device_id] = txtime
+            if is_new:
+                new_readings.append(Reading(tenant=tenant, device_id=device_id, txtime=txtime, kwh=kwh))
+
+            # A gap of more than 20 minutes starts a new meal; shorter gaps count as cooking time
+            meal_start = previous is None or txtime - previous > MEAL_GAP
+            runtime_seconds = 0 if meal_start else (txtime - previous).total_seconds()
+
+            local = txtime.astimezone(zone)
+            for delta in (hourly[(device_id, local.replace(minute=0, second=0, microsecond=0))], daily[(device_id, local.date())]):
+                delta['kwh'] += kwh
+                delta['runtime_seconds'] += runtime_seconds
+                delta['meals'] += int(meal_start and cooking)
+                delta['readings'] += 1
+
+            if not cooking:
+                continue
+            session = open_sessions.get(device_id)
+            if meal_start or session is None:
+                session = MealSession(tenant=tenant, device_id=device_id, start=txtime, end=txtime, kwh=kwh)
+                open_sessions[device_id] = session
+                new_sessions.append(session)
+            else:
+                session.end = txtime
+                session.kwh += kwh
+                if session.pk is not None:
+                    updated_sessions[session.pk] = session
+
+    Reading.objects.bulk_create(new_readings, batch_size=batch_size)
+    MealSession.objects.bulk_create(new_sessions, batch_size=batch_size)
+    MealSession.objects.bulk_update(updated_sessions.values(), ['end', 'kwh'], batch_size=batch_size)
+    _apply_rollups(HourlyRollup, tenant, hourly)
+    _apply_rollups(DailyRollup, tenant, daily)
+    return len(new_readings)
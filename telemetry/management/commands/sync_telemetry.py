@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telemetry.sync import DEVICE_DATA_ENDPOINTS, sync_tenant
+
+
+class Command(BaseCommand):
+    help = "Ingest upstream device readings since each tenant's watermark into the local telemetry store."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenant', action='append', dest='tenants', choices=sorted(DEVICE_DATA_ENDPOINTS),
+            help='Tenant to sync (repeatable). Defaults to all tenants.',
+        )
+        parser.add_argument('--loop', action='store_true', help='Keep syncing until interrupted.')
+        parser.add_argument('--interval', type=int, default=60, help='Seconds between syncs with --loop.')
+        parser.add_argument(
+            '--overlap', type=int,
+            help='Minutes before the watermark to re-fetch, to pick up late readings. '
+                 "Defaults to settings.TELEMETRY['SYNC_OVERLAP_MINUTES'].",
+        )
+
+    def handle(self, *args, **options):
+        tenants = options['tenants'] or sorted(DEVICE_DATA_ENDPOINTS)
+        try:
+            while True:
+                for tenant in tenants:
+                    self.sync(tenant, options['loop'], options['overlap'])
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def sync(self, tenant, loop, overlap):
+        try:
+            ingested = sync_tenant(tenant, overlap)
+        except Exception as e:
+            # A failed pass shouldn't stop the loop; the next one retries from the same watermark
+            if not loop:
+                raise CommandError(f"Sync failed for {tenant}: {e}")
+            self.stderr.write(f"Sync failed for {tenant}: {e}")
+            return
+        self.stdout.write(f"{tenant}: ingested {ingested} readings")
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=20)),
+                ('device_id', models.CharField(max_length=100)),
+                ('bucket', models.DateField()),
+                ('kwh', models.FloatField(default=0)),
+                ('runtime_seconds', models.FloatField(default=0)),
+                ('meals', models.IntegerField(default=0)),
+                ('readings', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['device_id', 'bucket'], name='telemetry_d_device__4eeee6_idx'), models.Index(fields=['tenant', 'bucket'], name='telemetry_d_tenant_6d8b0f_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'device_id', 'bucket'), name='unique_daily_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=20)),
+                ('device_id', models.CharField(max_length=100)),
+                ('bucket', models.DateTimeField()),
+                ('kwh', models.FloatField(default=0)),
+                ('runtime_seconds', models.FloatField(default=0)),
+                ('meals', models.IntegerField(default=0)),
+                ('readings', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['device_id', 'bucket'], name='telemetry_h_device__42e216_idx'), models.Index(fields=['tenant', 'bucket'], name='telemetry_h_tenant_f4ba79_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'device_id', 'bucket'), name='unique_hourly_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MealSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=20)),
+                ('device_id', models.CharField(max_length=100)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('kwh', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tenant', 'device_id', 'start'], name='telemetry_m_tenant_fcc01a_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Reading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=20)),
+                ('device_id', models.CharField(max_length=100)),
+                ('txtime', models.DateTimeField()),
+                ('kwh', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tenant', 'txtime'], name='telemetry_r_tenant_42fd4d_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'device_id', 'txtime'), name='unique_reading')],
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.db import models
+
+
+class Reading(models.Model):
+    tenant = models.CharField(max_length=20)
+    device_id = models.CharField(max_length=100)
+    txtime = models.DateTimeField()
+    kwh = models.FloatField()
+
+    def __str__(self):
+        return f"{self.device_id} @ {self.txtime}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'device_id', 'txtime'], name='unique_reading'),
+        ]
+        indexes = [
+            models.Index(fields=['tenant', 'txtime']),
+        ]
+
+
+class MealSession(models.Model):
+    """A cooking session: consecutive readings of a device less than 20 minutes apart."""
+    tenant = models.CharField(max_length=20)
+    device_id = models.CharField(max_length=100)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    kwh = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.device_id} {self.start} - {self.end}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenant', 'device_id', 'start']),
+        ]
+
+
+class HourlyRollup(models.Model):
+    tenant = models.CharField(max_length=20)
+    device_id = models.CharField(max_length=100)
+    bucket = models.DateTimeField()
+    kwh = models.FloatField(default=0)
+    runtime_seconds = models.FloatField(default=0)
+    meals = models.IntegerField(default=0)
+    readings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'device_id', 'bucket'], name='unique_hourly_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['device_id', 'bucket']),
+            models.Index(fields=['tenant', 'bucket']),
+        ]
+
+
+class DailyRollup(models.Model):
+    tenant = models.CharField(max_length=20)
+    device_id = models.CharField(max_length=100)
+    bucket = models.DateField()
+    kwh = models.FloatField(default=0)
+    runtime_seconds = models.FloatField(default=0)
+    meals = models.IntegerField(default=0)
+    readings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'device_id', 'bucket'], name='unique_daily_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['device_id', 'bucket']),
+            models.Index(fields=['tenant', 'bucket']),
+        ]
+
+
+class SyncWatermark(models.Model):
+    """The newest upstream reading ingested for a tenant."""
+    tenant = models.CharField(max_length=20, unique=True)
+    txtime = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.tenant}: {self.txtime}"
@@ -0,0 +1,157 @@
+"""
+Range queries over the local telemetry store.
+
+Short ranges are answered from raw readings; longer ranges from the hourly
+and daily rollups, which keep the number of rows read proportional to the
+number of device-hours rather than the number of readings.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .ingest import NON_COOKING_DEVICES, txtime_zone
+from .models import Reading, MealSession, HourlyRollup, DailyRollup, SyncWatermark
+
+
+def _config():
+    return getattr(settings, 'TELEMETRY', {})
+
+
+def is_enabled(tenant):
+    """Whether dashboard views should read this tenant's data from the local store."""
+    return (_config().get('USE_LOCAL_STORE', False)
+            and SyncWatermark.objects.filter(tenant=tenant, txtime__isnull=False).exists())
+
+
+def use_raw_readings(range_minutes):
+    return int(range_minutes) <= _config().get('RAW_RANGE_MINUTES', 1440)
+
+
+def range_start(range_minutes):
+    return timezone.now() - timedelta(minutes=int(range_minutes))
+
+
+def _hour_floor(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _local_date(moment):
+    return moment.astimezone(txtime_zone()).date()
+
+
+def _as_txtime(moment):
+    # Back in the upstream's YYYYMMDDHHMMSS local time
+    return int(moment.astimezone(txtime_zone()).strftime('%Y%m%d%H%M%S'))
+
+
+def readings_since(tenant, since):
+    """Raw readings since a moment, in the upstream rawData shape."""
+    return [
+        {'deviceID': device_id, 'txtime': _as_txtime(txtime), 'kwh': kwh}
+        for device_id, txtime, kwh in Reading.objects.filter(tenant=tenant, txtime__gte=since)
+        .values_list('device_id', 'txtime', 'kwh').iterator(chunk_size=5000)
+    ]
+
+
+def runtime_since(tenant, since):
+    """Cooking time in hours per device since a moment."""
+    rows = (HourlyRollup.objects.filter(tenant=tenant, bucket__gte=_hour_floor(since))
+            .values('device_id').annotate(seconds=Sum('runtime_seconds')).order_by('device_id'))
+    return {row['device_id']: row['seconds'] / 3600 for row in rows}
+
+
+def _last_txtimes(tenant, devices):
+    """Last reading per device, as naive local datetimes like the legacy meal counts."""
+    rows = (Reading.objects.filter(tenant=tenant, device_id__in=devices)
+            .values('device_id').annotate(last=Max('txtime')).values_list('device_id', 'last'))
+    zone = txtime_zone()
+    return {device_id: last.astimezone(zone).replace(tzinfo=None) for device_id, last in rows}
+
+
+def rollup_aggregate(tenant, since):
+    """
+    Build the homepage aggregates from the hourly and daily rollups.
+
+    Returns ``(runtime, readings)`` in the same shape the homepage builds from
+    the upstream payload (see powerpay.views.aggregate_readings), with one
+    chart row per device-hour instead of one per reading, or None if there is
+    no data in the range.
+    """
+    rows = list(
+        HourlyRollup.objects.filter(tenant=tenant, bucket__gte=_hour_floor(since))
+        .order_by('device_id', 'bucket')
+        .values_list('device_id', 'bucket', 'kwh', 'runtime_seconds', 'meals')
+    )
+    if not rows:
+        return None
+
+    device_kwh = defaultdict(float)
+    device_meals = defaultdict(int)
+    runtime = defaultdict(float)
+    morning_kwh = afternoon_kwh = night_kwh = 0
+    zone = txtime_zone()
+    for device_id, bucket, kwh, runtime_seconds, meals in rows:
+        device_kwh[device_id] += kwh
+        device_meals[device_id] += meals
+        runtime[device_id] += runtime_seconds / 3600
+        hour = bucket.astimezone(zone).hour
+        if 4 <= hour < 11:
+            morning_kwh += kwh
+        elif 11 <= hour < 17:
+            afternoon_kwh += kwh
+        else:
+            night_kwh += kwh
+
+    cooking_devices = [device_id for device_id in device_kwh if device_id not in NON_COOKING_DEVICES]
+    last_txtimes = _last_txtimes(tenant, cooking_devices)
+    meals = {
+        device_id: {'count': device_meals[device_id], 'last_txtime': last_txtimes.get(device_id)}
+        for device_id in cooking_devices
+    }
+    meals_per_day = {
+        bucket.isoformat(): total
+        for bucket, total in DailyRollup.objects.filter(tenant=tenant, bucket__gte=_local_date(since))
+        .values('bucket').annotate(total=Sum('meals')).order_by('bucket').values_list('bucket', 'total')
+    }
+
+    readings = {
+        'total_kwh': sum(device_kwh.values()),
+        'device_kwh': dict(device_kwh),
+        'morning_kwh': morning_kwh,
+        'afternoon_kwh': afternoon_kwh,
+        'night_kwh': night_kwh,
+        'meals': meals,
+        'meals_per_day': meals_per_day,
+        'deviceID': np.array([row[0] for row in rows], dtype=object),
+        'txtime': np.array([_as_txtime(row[1]) for row in rows], dtype='int64'),
+        'kwh': np.array([row[2] for row in rows], dtype='float64'),
+    }
+    return dict(runtime), readings
+
+
+def device_summary(tenant, device_id, since):
+    """A single device's data since a moment, in the deviceDataDjangoo payload shape."""
+    totals = HourlyRollup.objects.filter(
+        tenant=tenant, device_id=device_id, bucket__gte=_hour_floor(since),
+    ).aggregate(kwh=Sum('kwh'), runtime_seconds=Sum('runtime_seconds'))
+    sessions = MealSession.objects.filter(tenant=tenant, device_id=device_id, start__gte=since).order_by('start')
+    meals_per_day = (DailyRollup.objects.filter(tenant=tenant, device_id=device_id, bucket__gte=_local_date(since))
+                     .order_by('bucket').values_list('bucket', 'meals'))
+    return {
+        'runtime': (totals['runtime_seconds'] or 0) / 3600,
+        'sumKwh': totals['kwh'] or 0,
+        'mealsWithDurations': [
+            {
+                'startTime': f"{session.start:%Y-%m-%dT%H:%M:%S}.000Z",
+                'endTime': f"{session.end:%Y-%m-%dT%H:%M:%S}.000Z",
+                'mealDuration': (session.end - session.start).total_seconds(),
+                'totalKwh': session.kwh,
+            }
+            for session in sessions
+        ],
+        'totalMealsPerDay': {bucket.isoformat(): meals for bucket, meals in meals_per_day if meals},
+    }
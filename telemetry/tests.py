@@ -0,0 +1,199 @@
+import random
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone as django_timezone
+
+from powerpay.testing import StubUpstream
+from .ingest import ingest_readings, parse_txtime, txtime_zone
+from .models import DailyRollup, HourlyRollup, MealSession, Reading, SyncWatermark
+from .sync import FULL_HISTORY_RANGE, sync_tenant
+
+
+def reading(device_id, txtime, kwh=0.01):
+    return {'deviceID': device_id, 'txtime': txtime, 'kwh': kwh}
+
+
+def random_readings(seed, devices=4, count=600):
+    """Readings of a few devices over three days, with gaps on both sides of the 20 minute threshold."""
+    rng = random.Random(seed)
+    readings = []
+    for i in range(devices):
+        device_id = 'OfficeFridge1' if i == 0 else f'device{i}'
+        moment = datetime(2024, 2, 28, 20)
+        for _ in range(count // devices):
+            moment += timedelta(seconds=rng.choice([60, 300, 1199, 1201, 3600, 5 * 3600]))
+            readings.append(reading(device_id, int(moment.strftime('%Y%m%d%H%M%S')), rng.choice([0.01, 0.02, 0.05])))
+    return readings
+
+
+def store_state(tenant):
+    """Everything ingestion stored for a tenant, comparable across tenants."""
+    return {
+        'readings': sorted(Reading.objects.filter(tenant=tenant).values_list('device_id', 'txtime', 'kwh')),
+        'sessions': sorted(
+            (device_id, start, end, round(kwh, 6))
+            for device_id, start, end, kwh in MealSession.objects.filter(tenant=tenant)
+            .values_list('device_id', 'start', 'end', 'kwh')
+        ),
+        'hourly': sorted(
+            (device_id, bucket, round(kwh, 6), runtime, meals, count)
+            for device_id, bucket, kwh, runtime, meals, count in HourlyRollup.objects.filter(tenant=tenant)
+            .values_list('device_id', 'bucket', 'kwh', 'runtime_seconds', 'meals', 'readings')
+        ),
+        'daily': sorted(
+            (device_id, bucket, round(kwh, 6), runtime, meals, count)
+            for device_id, bucket, kwh, runtime, meals, count in DailyRollup.objects.filter(tenant=tenant)
+            .values_list('device_id', 'bucket', 'kwh', 'runtime_seconds', 'meals', 'readings')
+        ),
+    }
+
+
+class IngestTests(TestCase):
+
+    def test_overlapping_batches_are_deduplicated(self):
+        readings = random_readings(0)
+        self.assertEqual(ingest_readings('t', readings[:400]), 400)
+        self.assertEqual(ingest_readings('t', readings[300:]), 200)
+        self.assertEqual(ingest_readings('t', readings), 0)
+        self.assertEqual(Reading.objects.filter(tenant='t').count(), 600)
+
+    def test_late_readings_give_the_same_store_as_one_batch(self):
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                readings = random_readings(seed)
+                ingest_readings(f'whole{seed}', readings)
+
+                # Batches in random order, overlapping one another, so many readings arrive after later ones
+                rng = random.Random(seed)
+                shuffled = readings[:]
+                rng.shuffle(shuffled)
+                for start in range(0, len(shuffled), 50):
+                    ingest_readings(f'pieces{seed}', shuffled[max(start - 10, 0):start + 50])
+
+                whole, pieces = store_state(f'whole{seed}'), store_state(f'pieces{seed}')
+                for part in whole:
+                    self.assertEqual(pieces[part], whole[part], part)
+
+    def test_late_reading_merges_two_meals(self):
+        ingest_readings('t', [reading('d', 20240101100000), reading('d', 20240101103000)])
+        self.assertEqual(MealSession.objects.filter(tenant='t').count(), 2)
+
+        ingest_readings('t', [reading('d', 20240101101500)])
+        session = MealSession.objects.get(tenant='t')
+        self.assertEqual((session.start, session.end), (parse_txtime(20240101100000), parse_txtime(20240101103000)))
+        self.assertEqual(DailyRollup.objects.get(tenant='t').meals, 1)
+        self.assertEqual(DailyRollup.objects.get(tenant='t').runtime_seconds, 1800)
+
+    def test_query_count_does_not_grow_with_devices(self):
+        def batch(devices, minute):
+            return [reading(f'device{i}', 20240101100000 + minute * 100) for i in range(devices)]
+
+        ingest_readings('few', batch(5, 0))
+        ingest_readings('many', batch(50, 0))
+        with self.assertNumQueries(11) as few:
+            ingest_readings('few', batch(5, 5))
+        with self.assertNumQueries(len(few.captured_queries)):
+            ingest_readings('many', batch(50, 5))
+
+    @override_settings(TELEMETRY={'TXTIME_ZONE': 'Africa/Nairobi'})
+    def test_txtimes_are_read_in_the_upstream_time_zone(self):
+        self.assertEqual(parse_txtime(20240102013000), datetime(2024, 1, 1, 22, 30, tzinfo=timezone.utc))
+
+        ingest_readings('t', [reading('d', 20240102013000)])
+        # Buckets follow the local clock, like the counts built from the raw upstream payload
+        self.assertEqual(DailyRollup.objects.get(tenant='t').bucket.isoformat(), '2024-01-02')
+        self.assertEqual(HourlyRollup.objects.get(tenant='t').bucket, datetime(2024, 1, 1, 22, tzinfo=timezone.utc))
+
+
+class RangeValidationTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('tester'))
+
+    def test_non_numeric_ranges_are_rejected(self):
+        for range in ('abc', '-5', '1.5'):
+            with self.subTest(range=range):
+                self.assertEqual(self.client.get(reverse('dashboard_panel', args=['totals']), {'range': range}).status_code, 400)
+                self.assertEqual(self.client.get(reverse('device_data_page', args=['device1']), {'range': range}).status_code, 400)
+
+
+def minutes_ago(minutes):
+    """An upstream txtime ``minutes`` before now."""
+    moment = django_timezone.now() - timedelta(minutes=minutes)
+    return int(moment.astimezone(txtime_zone()).strftime('%Y%m%d%H%M%S'))
+
+
+class SyncTests(TestCase):
+
+    def setUp(self):
+        self.upstream_readings = []
+
+    def device_data(self, params):
+        # Upstream answers with the readings of the last ``range`` minutes
+        since = minutes_ago(int(params['range'])) if int(params['range']) < FULL_HISTORY_RANGE else 0
+        readings = [reading for reading in self.upstream_readings if reading['txtime'] >= since]
+        return {'totalkwh': sum(reading['kwh'] for reading in readings), 'runtime': {}, 'rawData': readings}
+
+    def stub(self):
+        return StubUpstream({'allDeviceDataDjango': self.device_data})
+
+    def watermark(self):
+        return SyncWatermark.objects.get(tenant='default').txtime
+
+    @override_settings(TELEMETRY={'SYNC_OVERLAP_MINUTES': 60})
+    def test_syncs_pull_only_the_minutes_since_the_watermark(self):
+        self.upstream_readings = [reading('a', minutes_ago(minutes)) for minutes in (300, 200, 100)]
+        with self.stub() as upstream:
+            self.assertEqual(sync_tenant('default'), 3)
+            self.assertEqual(upstream.calls('allDeviceDataDjango'), [{'range': str(FULL_HISTORY_RANGE)}])
+            self.assertEqual(self.watermark(), parse_txtime(self.upstream_readings[-1]['txtime']))
+
+            self.upstream_readings.append(reading('a', minutes_ago(5)))
+            self.assertEqual(sync_tenant('default'), 1)
+            # 100 minutes since the watermark, plus the overlap
+            self.assertIn(int(upstream.calls('allDeviceDataDjango')[-1]['range']), (160, 161))
+
+            self.assertEqual(sync_tenant('default'), 0)
+        self.assertEqual(Reading.objects.filter(tenant='default').count(), 4)
+        self.assertEqual(self.watermark(), parse_txtime(self.upstream_readings[-1]['txtime']))
+
+    @override_settings(TELEMETRY={'SYNC_OVERLAP_MINUTES': 60})
+    def test_late_readings_within_the_overlap_are_ingested(self):
+        self.upstream_readings = [reading('fast', minutes_ago(10))]
+        with self.stub():
+            sync_tenant('default')
+            watermark = self.watermark()
+
+            # A slower device's reading reaches upstream after the fast one's, older than the watermark
+            self.upstream_readings.append(reading('slow', minutes_ago(40)))
+            self.assertEqual(sync_tenant('default'), 1)
+
+        self.assertTrue(Reading.objects.filter(tenant='default', device_id='slow').exists())
+        self.assertEqual(self.watermark(), watermark)
+
+    def test_deeper_overlap_recovers_older_readings(self):
+        self.upstream_readings = [reading('fast', minutes_ago(10))]
+        with self.stub():
+            sync_tenant('default', overlap=60)
+            self.upstream_readings.append(reading('slow', minutes_ago(600)))
+            self.assertEqual(sync_tenant('default', overlap=60), 0)
+
+            out = StringIO()
+            call_command('sync_telemetry', tenants=['default'], overlap=24 * 60, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'default: ingested 1 readings')
+
+    def test_failed_sync_leaves_the_watermark(self):
+        self.upstream_readings = [reading('a', minutes_ago(10))]
+        with self.stub():
+            sync_tenant('default')
+        watermark = self.watermark()
+
+        with StubUpstream({}):
+            with self.assertRaises(CommandError):
+                call_command('sync_telemetry', tenants=['default'], stdout=StringIO())
+        self.assertEqual(self.watermark(), watermark)